@@ -1,3 +1,4 @@
+bin/bake-version
 sam validate
 sam build --use-container --debug
 sam package --s3-bucket fastapi-postgres-boilerplate --output-template-file out.yml --region eu-central-1
@@ -0,0 +1,43 @@
+"""Trigram indexes for the ilike filters.
+
+Revision ID: 3f2b8c1d9e47
+Revises: 694335a7a3f9
+Create Date: 2026-10-16 10:12:31.118604
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3f2b8c1d9e47"
+down_revision = "694335a7a3f9"
+branch_labels = None
+depends_on = None
+
+TRIGRAM_INDEXES = [
+    ("products", "name"),
+    ("products", "description"),
+    ("product_types", "product_type"),
+    ("product_types", "description"),
+    ("maps", "name"),
+    ("maps", "description"),
+]
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm WITH SCHEMA public")
+
+    for table_name, column_name in TRIGRAM_INDEXES:
+        op.create_index(
+            f"ix_{table_name}_{column_name}_trgm",
+            table_name,
+            [column_name],
+            postgresql_using="gin",
+            postgresql_ops={column_name: "gin_trgm_ops"},
+        )
+
+
+def downgrade() -> None:
+    for table_name, column_name in TRIGRAM_INDEXES:
+        op.drop_index(f"ix_{table_name}_{column_name}_trgm", table_name=table_name)
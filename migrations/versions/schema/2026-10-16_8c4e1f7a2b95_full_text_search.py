@@ -0,0 +1,38 @@
+"""Generated tsv columns with GIN indexes for the full text search.
+
+Revision ID: 8c4e1f7a2b95
+Revises: 3f2b8c1d9e47
+Create Date: 2026-10-16 14:03:52.402117
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8c4e1f7a2b95"
+down_revision = "3f2b8c1d9e47"
+branch_labels = None
+depends_on = None
+
+# Table name and (column name, weight) pairs, the same as `search_vector` in `server.db.models`
+SEARCH_VECTORS = [
+    ("products", [("name", "A"), ("description", "B")]),
+    ("product_types", [("product_type", "A"), ("description", "B")]),
+    ("maps", [("name", "A"), ("description", "B")]),
+]
+
+
+def upgrade() -> None:
+    for table_name, weights in SEARCH_VECTORS:
+        vectors = " || ".join(
+            f"setweight(to_tsvector('english', coalesce({column_name}, '')), '{weight}')"
+            for column_name, weight in weights
+        )
+        op.execute(f"ALTER TABLE {table_name} ADD COLUMN tsv tsvector GENERATED ALWAYS AS ({vectors}) STORED")
+        op.create_index(f"ix_{table_name}_tsv", table_name, ["tsv"], postgresql_using="gin")
+
+
+def downgrade() -> None:
+    for table_name, _ in SEARCH_VECTORS:
+        op.drop_index(f"ix_{table_name}_tsv", table_name=table_name)
+        op.drop_column(table_name, "tsv")
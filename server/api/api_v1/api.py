@@ -16,7 +16,7 @@
 from fastapi.param_functions import Depends
 from fastapi.routing import APIRouter
 
-from server.api.api_v1.endpoints import health, login, maps, product_types, products, settings, users
+from server.api.api_v1.endpoints import health, login, maps, product_types, products, search, settings, users
 
 # Todo: add security depends here or in endpoints
 
@@ -30,6 +30,7 @@ api_router.include_router(
     prefix="/product_types",
     tags=["products"],
 )
+api_router.include_router(search.router, prefix="/search", tags=["search"])
 api_router.include_router(settings.router, prefix="/settings", tags=["system"])
 api_router.include_router(health.router, prefix="/health", tags=["system"])
 
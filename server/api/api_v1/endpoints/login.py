@@ -22,11 +22,11 @@ logger = structlog.get_logger(__name__)
 
 @router.post("/login/access-token")
 # @router.post("/login/access-token", response_model=Token)
-def login_access_token(form_data: OAuth2PasswordRequestForm = Depends()) -> Any:
+async def login_access_token(form_data: OAuth2PasswordRequestForm = Depends()) -> Any:
     """
     OAuth2 compatible token login, get an access token for future requests
     """
-    user = user_crud.authenticate(username=form_data.username, password=form_data.password)
+    user = await user_crud.async_authenticate(username=form_data.username, password=form_data.password)
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect email or password")
     elif not user_crud.is_active(user):
@@ -18,82 +18,142 @@ from uuid import UUID
 from fastapi import HTTPException
 from fastapi.param_functions import Body, Depends
 from fastapi.routing import APIRouter
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
 from starlette.responses import Response
 
 from server.api import deps
+from server.api.conditional import (
+    conditional_entity,
+    conditional_response,
+    entity_etag,
+    if_match_precondition,
+    last_modified,
+    set_validators,
+)
 from server.api.deps import common_parameters
 from server.api.error_handling import raise_status
+from server.api.export import export_response
+from server.api.response_cache import response_cache
+from server.api.row_serializer import row_serializer
 from server.crud import map_crud
-from server.db.models import MapsTable, UsersTable
-from server.schemas import Map, MapCreate, MapCreateAdmin, MapUpdate, MapUpdateAdmin
+from server.crud.crud_user import Principal
+from server.db.models import MapsTable
+from server.schemas import BulkResult, Map, MapCreate, MapCreateAdmin, MapUpdate, MapUpdateAdmin
 
 router = APIRouter()
 
 
 @router.get("/", response_model=List[Map])
-def get_multi(response: Response, common: dict = Depends(common_parameters)) -> List[Map]:
-    maps, header_range = map_crud.get_multi(
+@response_cache("maps")
+async def get_multi(request: Request, common: dict = Depends(common_parameters)) -> Response:
+    if common["export"]:
+        rows = await run_in_threadpool(
+            map_crud.stream_multi,
+            skip=common["skip"],
+            limit=common["limit"],
+            filter_parameters=common["filter"],
+            sort_parameters=common["sort"],
+        )
+        return export_response(rows, Map, common["export"], "maps")
+    serializer = row_serializer(Map, MapsTable)
+    maps, header_range = await map_crud.async_get_multi(
         skip=common["skip"],
         limit=common["limit"],
         filter_parameters=common["filter"],
         sort_parameters=common["sort"],
+        cursor=common["cursor"],
+        count=common["count"],
+        columns=serializer.columns,
     )
-    response.headers["Content-Range"] = header_range
-    return maps
+    headers = map_crud.page_headers(
+        maps,
+        limit=common["limit"],
+        sort_parameters=common["sort"],
+        cursor=common["cursor"],
+        count=common["count"],
+    )
+    return conditional_response(request, serializer.response(maps, headers={"Content-Range": header_range, **headers}))
 
 
 @router.get("/{id}", response_model=Map)
-def get_by_id(id: UUID) -> MapsTable:
-    map = map_crud.get(id)
+async def get_by_id(id: UUID, request: Request, response: Response) -> MapsTable:
+    map = await map_crud.async_get(id)
     if not map:
         raise_status(HTTPStatus.NOT_FOUND, f"Map id {id} not found")
-    return map
+    return conditional_entity(request, response, map) or map
 
 
 @router.post("/", response_model=None, status_code=HTTPStatus.NO_CONTENT)
-def create(data: MapCreate = Body(...), current_user: UsersTable = Depends(deps.get_current_active_user)) -> None:
+def create(data: MapCreate = Body(...), current_user: Principal = Depends(deps.get_current_active_principal)) -> None:
     return map_crud.create_with_owner(obj_in=data, created_by=current_user.id)
 
 
 @router.post("/admin", response_model=None, status_code=HTTPStatus.NO_CONTENT)
 def admin_create(
-    data: MapCreateAdmin = Body(...), current_user: UsersTable = Depends(deps.get_current_active_superuser)
+    data: MapCreateAdmin = Body(...), current_user: Principal = Depends(deps.get_current_active_superuser)
 ) -> None:
     return map_crud.create(obj_in=data)
 
 
+@router.post("/bulk", response_model=BulkResult)
+def bulk_create(
+    data: List[MapCreateAdmin] = Body(...), current_user: Principal = Depends(deps.get_current_active_superuser)
+) -> BulkResult:
+    """Create maps in chunked multi-row inserts, rows that fail are reported by their index."""
+    return map_crud.bulk_create(objs_in=data)
+
+
+@router.put("/bulk", response_model=BulkResult)
+def bulk_upsert(
+    data: List[MapCreateAdmin] = Body(...), current_user: Principal = Depends(deps.get_current_active_superuser)
+) -> BulkResult:
+    """Create maps or update the existing ones with the same `name`."""
+    return map_crud.bulk_upsert(objs_in=data, index_elements=["name"])
+
+
+@router.delete("/bulk", response_model=BulkResult)
+def bulk_delete(
+    ids: List[UUID] = Body(...), current_user: Principal = Depends(deps.get_current_active_superuser)
+) -> BulkResult:
+    return map_crud.bulk_delete(ids=ids)
+
+
 @router.put("/{map_id}", response_model=None, status_code=HTTPStatus.NO_CONTENT)
 def update(
-    *, map_id: UUID, item_in: MapUpdate, current_user: UsersTable = Depends(deps.get_current_active_user)
+    *,
+    map_id: UUID,
+    item_in: MapUpdate,
+    request: Request,
+    response: Response,
+    current_user: Principal = Depends(deps.get_current_active_principal),
 ) -> None:
-    map = map_crud.get(id=map_id)
+    map = map_crud.update_by_id(
+        id=map_id, obj_in=item_in, precondition=if_match_precondition(request), created_by=current_user.id
+    )
     if not map:
-        raise HTTPException(status_code=404, detail="Map not found")
-    if str(map.created_by) != str(current_user.id):
+        if not map_crud.exists(map_id):
+            raise HTTPException(status_code=404, detail="Map not found")
         raise HTTPException(status_code=403, detail="You are not authorized to edit this map")
-
-    map = map_crud.update(
-        db_obj=map,
-        obj_in=item_in,
-    )
-    return map
+    set_validators(response, entity_etag(map), last_modified(map))
 
 
 @router.put("/admin/{map_id}", response_model=None, status_code=HTTPStatus.NO_CONTENT)
 def admin_update(
-    *, map_id: UUID, item_in: MapUpdateAdmin, current_user: UsersTable = Depends(deps.get_current_active_superuser)
+    *,
+    map_id: UUID,
+    item_in: MapUpdateAdmin,
+    request: Request,
+    response: Response,
+    current_user: Principal = Depends(deps.get_current_active_superuser),
 ) -> None:
-    map = map_crud.get(id=map_id)
+    map = map_crud.update_by_id(id=map_id, obj_in=item_in, precondition=if_match_precondition(request))
     if not map:
         raise HTTPException(status_code=404, detail="Map not found")
-
-    map = map_crud.update(
-        db_obj=map,
-        obj_in=item_in,
-    )
-    return map
+    set_validators(response, entity_etag(map), last_modified(map))
 
 
 @router.delete("/{map_id}", response_model=None, status_code=HTTPStatus.NO_CONTENT)
 def delete(map_id: UUID) -> None:
-    return map_crud.delete(id=map_id)
+    if map_crud.delete_by_id(id=map_id) is None:
+        raise HTTPException(status_code=404, detail="Map not found")
@@ -18,35 +18,67 @@ from uuid import UUID
 from fastapi import HTTPException
 from fastapi.param_functions import Body, Depends
 from fastapi.routing import APIRouter
+from starlette.requests import Request
 from starlette.responses import Response
 
+from server.api.conditional import (
+    conditional_entity,
+    conditional_response,
+    entity_etag,
+    if_match_precondition,
+    set_validators,
+)
 from server.api.deps import common_parameters
 from server.api.error_handling import raise_status
+from server.api.export import export_response
+from server.api.response_cache import response_cache
+from server.api.row_serializer import row_serializer
 from server.crud import product_type_crud
 from server.db.models import ProductTypesTable
-from server.schemas import ProductType, ProductTypeCreate, ProductTypeUpdate
+from server.schemas import BulkResult, ProductType, ProductTypeCreate, ProductTypeUpdate
 
 router = APIRouter()
 
 
 @router.get("/", response_model=List[ProductType])
-def get_multi(response: Response, common: dict = Depends(common_parameters)) -> List[ProductType]:
+@response_cache("product_types")
+def get_multi(request: Request, common: dict = Depends(common_parameters)) -> Response:
+    if common["export"]:
+        rows = product_type_crud.stream_multi(
+            skip=common["skip"],
+            limit=common["limit"],
+            filter_parameters=common["filter"],
+            sort_parameters=common["sort"],
+        )
+        return export_response(rows, ProductType, common["export"], "product_types")
+    serializer = row_serializer(ProductType, ProductTypesTable)
     product_types, header_range = product_type_crud.get_multi(
         skip=common["skip"],
         limit=common["limit"],
         filter_parameters=common["filter"],
         sort_parameters=common["sort"],
+        cursor=common["cursor"],
+        count=common["count"],
+        columns=serializer.columns,
+    )
+    headers = product_type_crud.page_headers(
+        product_types,
+        limit=common["limit"],
+        sort_parameters=common["sort"],
+        cursor=common["cursor"],
+        count=common["count"],
+    )
+    return conditional_response(
+        request, serializer.response(product_types, headers={"Content-Range": header_range, **headers})
     )
-    response.headers["Content-Range"] = header_range
-    return product_types
 
 
 @router.get("/{id}", response_model=ProductType)
-def get_by_id(id: UUID) -> ProductTypesTable:
+def get_by_id(id: UUID, request: Request, response: Response) -> ProductTypesTable:
     product_type = product_type_crud.get(id)
     if not product_type:
         raise_status(HTTPStatus.NOT_FOUND, f"ProductType id {id} not found")
-    return product_type
+    return conditional_entity(request, response, product_type) or product_type
 
 
 @router.post("/", response_model=None, status_code=HTTPStatus.NO_CONTENT)
@@ -54,20 +86,35 @@ def create(data: ProductTypeCreate = Body(...)) -> None:
     return product_type_crud.create(obj_in=data)
 
 
+@router.post("/bulk", response_model=BulkResult)
+def bulk_create(data: List[ProductTypeCreate] = Body(...)) -> BulkResult:
+    """Create product types in chunked multi-row inserts, rows that fail are reported by their index."""
+    return product_type_crud.bulk_create(objs_in=data)
+
+
+@router.put("/bulk", response_model=BulkResult)
+def bulk_upsert(data: List[ProductTypeCreate] = Body(...)) -> BulkResult:
+    """Create product types or update the existing ones with the same `product_type`."""
+    return product_type_crud.bulk_upsert(objs_in=data, index_elements=["product_type"])
+
+
+@router.delete("/bulk", response_model=BulkResult)
+def bulk_delete(ids: List[UUID] = Body(...)) -> BulkResult:
+    return product_type_crud.bulk_delete(ids=ids)
+
+
 @router.put("/{product_type_id}", response_model=None, status_code=HTTPStatus.NO_CONTENT)
-def update(*, product_type_id: UUID, item_in: ProductTypeUpdate) -> None:
-    product_type = product_type_crud.get(id=product_type_id)
+def update(*, product_type_id: UUID, item_in: ProductTypeUpdate, request: Request, response: Response) -> None:
+    product_type = product_type_crud.update_by_id(
+        id=product_type_id, obj_in=item_in, precondition=if_match_precondition(request)
+    )
     if not product_type:
         raise HTTPException(status_code=404, detail="ProductType not found")
-
-    product_type = product_type_crud.update(
-        db_obj=product_type,
-        obj_in=item_in,
-    )
-    return product_type
+    set_validators(response, entity_etag(product_type))
 
 
 @router.delete("/{product_type_id}", response_model=None, status_code=HTTPStatus.NO_CONTENT)
 def delete(product_type_id: UUID) -> None:
     # Todo: check product first
-    return product_type_crud.delete(id=product_type_id)
+    if product_type_crud.delete_by_id(id=product_type_id) is None:
+        raise HTTPException(status_code=404, detail="ProductType not found")
@@ -18,35 +18,69 @@ from uuid import UUID
 from fastapi import HTTPException
 from fastapi.param_functions import Body, Depends
 from fastapi.routing import APIRouter
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
 from starlette.responses import Response
 
+from server.api.conditional import (
+    conditional_entity,
+    conditional_response,
+    entity_etag,
+    if_match_precondition,
+    set_validators,
+)
 from server.api.deps import common_parameters
 from server.api.error_handling import raise_status
+from server.api.export import export_response
+from server.api.response_cache import response_cache
+from server.api.row_serializer import row_serializer
 from server.crud import product_crud
 from server.db.models import ProductsTable
-from server.schemas import Product, ProductCreate, ProductUpdate
+from server.schemas import BulkResult, Product, ProductCreate, ProductUpdate
 
 router = APIRouter()
 
 
 @router.get("/", response_model=List[Product])
-def get_multi(response: Response, common: dict = Depends(common_parameters)) -> List[Product]:
-    products, header_range = product_crud.get_multi(
+@response_cache("products")
+async def get_multi(request: Request, common: dict = Depends(common_parameters)) -> Response:
+    if common["export"]:
+        rows = await run_in_threadpool(
+            product_crud.stream_multi,
+            skip=common["skip"],
+            limit=common["limit"],
+            filter_parameters=common["filter"],
+            sort_parameters=common["sort"],
+        )
+        return export_response(rows, Product, common["export"], "products")
+    serializer = row_serializer(Product, ProductsTable)
+    products, header_range = await product_crud.async_get_multi(
         skip=common["skip"],
         limit=common["limit"],
         filter_parameters=common["filter"],
         sort_parameters=common["sort"],
+        cursor=common["cursor"],
+        count=common["count"],
+        columns=serializer.columns,
+    )
+    headers = product_crud.page_headers(
+        products,
+        limit=common["limit"],
+        sort_parameters=common["sort"],
+        cursor=common["cursor"],
+        count=common["count"],
+    )
+    return conditional_response(
+        request, serializer.response(products, headers={"Content-Range": header_range, **headers})
     )
-    response.headers["Content-Range"] = header_range
-    return products
 
 
 @router.get("/{id}", response_model=Product)
-def get_by_id(id: UUID) -> ProductsTable:
-    product = product_crud.get(id)
+async def get_by_id(id: UUID, request: Request, response: Response) -> ProductsTable:
+    product = await product_crud.async_get(id)
     if not product:
         raise_status(HTTPStatus.NOT_FOUND, f"Product id {id} not found")
-    return product
+    return conditional_entity(request, response, product) or product
 
 
 @router.post("/", response_model=None, status_code=HTTPStatus.NO_CONTENT)
@@ -54,19 +88,32 @@ def create(data: ProductCreate = Body(...)) -> None:
     return product_crud.create(obj_in=data)
 
 
+@router.post("/bulk", response_model=BulkResult)
+def bulk_create(data: List[ProductCreate] = Body(...)) -> BulkResult:
+    """Create products in chunked multi-row inserts, rows that fail are reported by their index."""
+    return product_crud.bulk_create(objs_in=data)
+
+
+@router.put("/bulk", response_model=BulkResult)
+def bulk_upsert(data: List[ProductCreate] = Body(...)) -> BulkResult:
+    """Create products or update the existing ones with the same `name`."""
+    return product_crud.bulk_upsert(objs_in=data, index_elements=["name"])
+
+
+@router.delete("/bulk", response_model=BulkResult)
+def bulk_delete(ids: List[UUID] = Body(...)) -> BulkResult:
+    return product_crud.bulk_delete(ids=ids)
+
+
 @router.put("/{product_id}", response_model=None, status_code=HTTPStatus.NO_CONTENT)
-def update(*, product_id: UUID, item_in: ProductUpdate) -> None:
-    product = product_crud.get(id=product_id)
+def update(*, product_id: UUID, item_in: ProductUpdate, request: Request, response: Response) -> None:
+    product = product_crud.update_by_id(id=product_id, obj_in=item_in, precondition=if_match_precondition(request))
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-
-    product = product_crud.update(
-        db_obj=product,
-        obj_in=item_in,
-    )
-    return product
+    set_validators(response, entity_etag(product))
 
 
 @router.delete("/{product_id}", response_model=None, status_code=HTTPStatus.NO_CONTENT)
 def delete(product_id: UUID) -> None:
-    return product_crud.delete(id=product_id)
+    if product_crud.delete_by_id(id=product_id) is None:
+        raise HTTPException(status_code=404, detail="Product not found")
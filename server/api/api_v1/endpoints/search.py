@@ -0,0 +1,38 @@
+# Copyright 2019-2020 SURF.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from http import HTTPStatus
+from typing import Any, Dict, List, Optional
+
+from fastapi.param_functions import Query
+from fastapi.routing import APIRouter
+
+from server.api.error_handling import raise_status
+from server.crud import search_crud
+from server.schemas import SearchResult
+
+router = APIRouter()
+
+
+@router.get("/", response_model=List[SearchResult])
+def search(
+    q: str = Query(
+        ..., description="Words to search, every word matches the start of a word in titles or descriptions"
+    ),
+    types: Optional[List[str]] = Query(None, description="Only search these types: products, product_types or maps"),
+    limit: int = Query(20, ge=1, le=100),
+) -> List[Dict[str, Any]]:
+    unknown = sorted(set(types or []) - set(search_crud.targets))
+    if unknown:
+        raise_status(HTTPStatus.BAD_REQUEST, f"Unknown search types: {', '.join(unknown)}")
+    return search_crud.search(q, types=types, limit=limit)
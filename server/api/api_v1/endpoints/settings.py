@@ -13,19 +13,15 @@
 
 from http import HTTPStatus
 
-from aiocache import Cache
 from fastapi.routing import APIRouter
 from starlette.background import BackgroundTasks
 
-from server.settings import app_settings
+from server.api.response_cache import response_cache
 
 router = APIRouter()
 
 
 @router.delete("/cache/{name}", status_code=HTTPStatus.NO_CONTENT)
 async def clear_cache(name: str, background_tasks: BackgroundTasks) -> None:
-    cache = Cache(Cache.REDIS, endpoint=app_settings.CACHE_HOST, port=app_settings.CACHE_PORT)
-    if name == "all":
-        background_tasks.add_task(cache.delete, "/*")
-    else:
-        background_tasks.add_task(cache.delete, f"/{name}*")
+    names = response_cache.names if name == "all" else {name}
+    background_tasks.add_task(response_cache.clear, *names)
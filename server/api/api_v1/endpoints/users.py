@@ -7,7 +7,9 @@ from starlette.responses import Response
 
 from server.api import deps
 from server.api.deps import common_parameters
+from server.api.export import export_response
 from server.crud import user_crud
+from server.crud.crud_user import Principal, UserProfile
 from server.db import db
 from server.db.models import UsersTable
 from server.schemas import User, UserCreate, UserUpdate
@@ -21,18 +23,37 @@ router = APIRouter()
 def get_multi(
     response: Response,
     common: dict = Depends(common_parameters),
-    current_user: UsersTable = Depends(deps.get_current_active_superuser),
+    current_user: Principal = Depends(deps.get_current_active_superuser),
 ) -> Any:
     """
     Retrieve users.
     """
+    if common["export"]:
+        rows = user_crud.stream_multi(
+            skip=common["skip"],
+            limit=common["limit"],
+            filter_parameters=common["filter"],
+            sort_parameters=common["sort"],
+        )
+        return export_response(rows, User, common["export"], "users")
     users, header_range = user_crud.get_multi(
         skip=common["skip"],
         limit=common["limit"],
         filter_parameters=common["filter"],
         sort_parameters=common["sort"],
+        cursor=common["cursor"],
+        count=common["count"],
     )
     response.headers["Content-Range"] = header_range
+    response.headers.update(
+        user_crud.page_headers(
+            users,
+            limit=common["limit"],
+            sort_parameters=common["sort"],
+            cursor=common["cursor"],
+            count=common["count"],
+        )
+    )
     return users
 
 
@@ -40,12 +61,12 @@ def get_multi(
 def create(
     *,
     user_in: UserCreate,
-    current_user: UsersTable = Depends(deps.get_current_active_superuser),
+    current_user: Principal = Depends(deps.get_current_active_superuser),
 ) -> Any:
     """
     Create new user.
     """
-    user = user_crud.user.get_by_email(email=user_in.email)
+    user = user_crud.get_by_email(email=user_in.email, profile=UserProfile.PRINCIPAL)
     if user:
         raise HTTPException(
             status_code=400,
@@ -121,13 +142,13 @@ def get_user_me(
 @router.get("/{user_id}", response_model=User)
 def get_by_id(
     user_id: int,
-    current_user: UsersTable = Depends(deps.get_current_active_user),
+    current_user: Principal = Depends(deps.get_current_active_principal),
 ) -> Any:
     """
     Get a specific user by id.
     """
     user = user_crud.get(id=user_id)
-    if user == current_user:
+    if user and user.id == current_user.id:
         return user
     if not user_crud.is_superuser(current_user):
         raise HTTPException(status_code=400, detail="The user doesn't have enough privileges")
@@ -139,7 +160,7 @@ def update(
     *,
     user_id: int,
     user_in: UserUpdate,
-    current_user: UsersTable = Depends(deps.get_current_active_superuser),
+    current_user: Principal = Depends(deps.get_current_active_superuser),
 ) -> Any:
     """
     Update a user.
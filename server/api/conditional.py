@@ -0,0 +1,142 @@
+# Copyright 2019-2020 SURF.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Conditional requests (RFC 7232).
+
+Single entities get a strong `ETag` computed from their column values, so it is the same whether the entity was
+loaded by the ORM or as a row by the async database, and a `Last-Modified` when the table has an `updated_at`
+column. A GET with a matching `If-None-Match` (or, without it, `If-Modified-Since`) is answered with a 304 before the
+entity is serialized. A PUT with an `If-Match` that doesn't match the current entity fails with 412 instead of
+overwriting a change the client hasn't seen.
+
+List responses get an `ETag` from a hash of their body.
+"""
+
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from functools import partial
+from http import HTTPStatus
+from typing import Any, Callable, List, Optional, Tuple
+from uuid import UUID
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from server.api.error_handling import raise_status
+from server.utils.json import json_dumps
+
+
+def strong_etag(data: bytes) -> str:
+    return f'"{hashlib.blake2b(data, digest_size=16).hexdigest()}"'
+
+
+def _canonical(value: Any) -> Any:
+    # asyncpg returns timestamps in the session time zone and its own UUID type, the ORM UTC and `uuid.UUID`
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc)
+    return str(value) if isinstance(value, UUID) else value
+
+
+def _column_values(entity: Any) -> List[Tuple[str, Any]]:
+    if isinstance(entity, dict):
+        values = entity.items()
+    else:
+        mapper = entity.__mapper__
+        # Generated columns like `tsv` are derived from the others and not part of the async rows
+        values = (
+            (column.name, getattr(entity, mapper.get_property_by_column(column).key))
+            for column in mapper.columns
+            if column.computed is None
+        )
+    return sorted((name, _canonical(value)) for name, value in values)
+
+
+def entity_etag(entity: Any) -> str:
+    """The `ETag` of an ORM object or a row mapping as returned by `CRUDBase.async_get`."""
+    return strong_etag(json_dumps(_column_values(entity)).encode())
+
+
+def last_modified(entity: Any) -> Optional[datetime]:
+    updated_at = entity.get("updated_at") if isinstance(entity, dict) else getattr(entity, "updated_at", None)
+    # HTTP dates have a resolution of seconds
+    return updated_at.replace(microsecond=0) if updated_at is not None else None
+
+
+def _entity_tags(header: str) -> List[str]:
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+def _weak_match(header: str, etag: str) -> bool:
+    tags = _entity_tags(header)
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+def is_not_modified(request: Request, etag: str, modified: Optional[datetime] = None) -> bool:
+    """Whether the client's copy (per `If-None-Match`, or `If-Modified-Since` without it) is still current."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _weak_match(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or modified is None:
+        return False
+    try:
+        return modified <= parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False  # Invalid dates are ignored
+
+
+def not_modified_response(etag: str, modified: Optional[datetime] = None) -> Response:
+    response = Response(status_code=HTTPStatus.NOT_MODIFIED)
+    set_validators(response, etag, modified)
+    return response
+
+
+def set_validators(response: Response, etag: str, modified: Optional[datetime] = None) -> None:
+    response.headers["ETag"] = etag
+    if modified is not None:
+        response.headers["Last-Modified"] = format_datetime(modified.astimezone(timezone.utc), usegmt=True)
+
+
+def conditional_entity(request: Request, response: Response, entity: Any) -> Optional[Response]:
+    """Set the validators of `entity` on `response`, return a 304 response when the client's copy is current."""
+    etag, modified = entity_etag(entity), last_modified(entity)
+    if is_not_modified(request, etag, modified):
+        return not_modified_response(etag, modified)
+    set_validators(response, etag, modified)
+    return None
+
+
+def conditional_response(request: Request, response: Response) -> Response:
+    """Add an `ETag` from the body to `response`, or replace it by a 304 when the client's copy is current."""
+    etag = strong_etag(response.body)
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    response.headers["ETag"] = etag
+    return response
+
+
+def check_if_match(request: Request, entity: Any) -> None:
+    """Raise 412 when the `If-Match` of `request` doesn't match `entity`, requests without `If-Match` always pass."""
+    if_match = request.headers.get("if-match")
+    if if_match is None:
+        return
+    tags = _entity_tags(if_match)
+    # If-Match uses the strong comparison, weak tags never match
+    if "*" not in tags and entity_etag(entity) not in tags:
+        raise_status(HTTPStatus.PRECONDITION_FAILED, "The resource was modified, fetch it again and retry")
+
+
+def if_match_precondition(request: Request) -> Optional[Callable[[Any], None]]:
+    """`check_if_match` as `precondition` of `CRUDBase.update_by_id`, None for requests without `If-Match`."""
+    return partial(check_if_match, request) if "if-match" in request.headers else None
@@ -1,16 +1,19 @@
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Union
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.param_functions import Query
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt
 from pydantic import ValidationError
 
+from server.api.export import export_media_type
 from server.crud import user_crud
+from server.crud.count import CountStrategy
+from server.crud.crud_user import Principal
 from server.db import db
 from server.db.models import UsersTable
 from server.schemas import TokenPayload
-from server.settings import app_settings
+from server.security import decode_access_token
 
 reusable_oauth = OAuth2PasswordBearer(tokenUrl=f"/api/login/access-token")
 
@@ -28,20 +31,62 @@ async def common_parameters(
         description="The sort will accept parameters like `col:ASC` or `col:DESC` and will split on the `:`. "
         "If it does not find a `:` it will sort ascending on that column.",
     ),
-) -> Dict[str, Union[List[str], int]]:
-    return {"skip": skip, "limit": limit, "filter": filter, "sort": sort}
+    cursor: Optional[str] = Query(
+        None,
+        description="Switches to cursor pagination, `skip` will be ignored. Use an empty value for the first page and "
+        "the `X-Next-Cursor` or `X-Prev-Cursor` response header value for the adjacent pages. A cursor is only valid "
+        "for the `sort` it was returned with.",
+    ),
+    count: Optional[CountStrategy] = Query(
+        None,
+        description="How the total in the `Content-Range` header is determined: `exact`, `estimated` (planner "
+        "statistics), `cached` (exact, but reused for a while) or `none` (total will be `*`). The strategy that was "
+        "used is returned in the `X-Count-Strategy` header.",
+    ),
+    accept: Optional[str] = Header(
+        None,
+        description="`application/x-ndjson` or `text/csv` streams all rows matching the filter, sort, skip and limit "
+        "(0 for all rows) as an export instead of returning a JSON list.",
+    ),
+) -> Dict[str, Union[List[str], int, str, None]]:
+    return {
+        "skip": skip,
+        "limit": limit,
+        "filter": filter,
+        "sort": sort,
+        "cursor": cursor,
+        "count": count,
+        "export": export_media_type(accept),
+    }
 
 
-def get_current_user(token: str = Depends(reusable_oauth)) -> UsersTable:
+def get_current_principal(token: str = Depends(reusable_oauth)) -> Principal:
+    """Authorize the request without a database round trip when the token and the user principal are cached."""
     try:
-        payload = jwt.decode(token, app_settings.SESSION_SECRET, algorithms=[app_settings.JWT_ALGORITHM])
-        user_id: str = payload.get("sub")
+        user_id = decode_access_token(token)
     except (jwt.JWTError, ValidationError):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials",
         )
-    user = user_crud.get(id=user_id)
+    principal = user_crud.get_principal(user_id)
+
+    if not principal:
+        raise HTTPException(status_code=404, detail="User not found")
+    return principal
+
+
+def get_current_active_principal(
+    current_user: Principal = Depends(get_current_principal),
+) -> Principal:
+    if not user_crud.is_active(current_user):
+        raise HTTPException(status_code=403, detail="Inactive user")
+    return current_user
+
+
+def get_current_user(principal: Principal = Depends(get_current_principal)) -> UsersTable:
+    """The full user, only use this when the endpoint needs more than `get_current_principal` provides."""
+    user = user_crud.get(id=principal.id)
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -57,8 +102,8 @@ def get_current_active_user(
 
 
 def get_current_active_superuser(
-    current_user: UsersTable = Depends(get_current_user),
-) -> UsersTable:
+    current_user: Principal = Depends(get_current_principal),
+) -> Principal:
     if not user_crud.is_superuser(current_user):
         raise HTTPException(status_code=403, detail="The user doesn't have enough privileges")
     return current_user
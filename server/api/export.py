@@ -0,0 +1,78 @@
+# Copyright 2019-2020 SURF.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Streaming export of list endpoints as NDJSON or CSV.
+
+The list endpoints switch to this mode when the `Accept` header asks for `application/x-ndjson` or `text/csv`. Rows are
+fetched with a server side cursor (`CRUDBase.stream_multi`) and written to a `StreamingResponse` in batches, so memory
+use doesn't depend on the size of the table.
+"""
+
+import csv
+from io import StringIO
+from typing import Any, Iterable, Iterator, List, Optional, Type
+
+from fastapi.encoders import jsonable_encoder
+from more_itertools import chunked
+from pydantic import BaseModel
+from starlette.responses import StreamingResponse
+
+from server.settings import app_settings
+from server.utils.json import json_dumps
+
+NDJSON = "application/x-ndjson"
+CSV = "text/csv"
+EXPORT_MEDIA_TYPES = (NDJSON, CSV)
+
+
+def export_media_type(accept: Optional[str]) -> Optional[str]:
+    """Return the export media type the `Accept` header asks for, None for a regular JSON response."""
+    if not accept:
+        return None
+    for media_range in accept.split(","):
+        media_type = media_range.split(";", 1)[0].strip().lower()
+        if media_type in EXPORT_MEDIA_TYPES:
+            return media_type
+    return None
+
+
+def _ndjson_lines(rows: List[Any], schema: Type[BaseModel]) -> str:
+    return "".join(json_dumps(jsonable_encoder(schema.from_orm(row))) + "\n" for row in rows)
+
+
+def _csv_lines(rows: List[Any], schema: Type[BaseModel]) -> str:
+    buffer = StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(schema.__fields__), extrasaction="ignore")
+    writer.writerows(jsonable_encoder(schema.from_orm(row)) for row in rows)
+    return buffer.getvalue()
+
+
+def _export(rows: Iterable[Any], schema: Type[BaseModel], media_type: str) -> Iterator[str]:
+    if media_type == CSV:
+        header = StringIO()
+        csv.writer(header).writerow(schema.__fields__)
+        yield header.getvalue()
+    encode = _csv_lines if media_type == CSV else _ndjson_lines
+    # Every chunk is handed to the event loop from a worker thread, writing batches keeps that overhead negligible
+    for batch in chunked(rows, app_settings.EXPORT_BATCH_SIZE):
+        yield encode(batch, schema)
+
+
+def export_response(rows: Iterable[Any], schema: Type[BaseModel], media_type: str, filename: str) -> StreamingResponse:
+    """Stream `rows`, serialized like `schema` would be in a JSON response, as `media_type`."""
+    extension = "csv" if media_type == CSV else "ndjson"
+    return StreamingResponse(
+        _export(rows, schema, media_type),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{extension}"'},
+    )
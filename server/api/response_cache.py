@@ -0,0 +1,223 @@
+# Copyright 2019-2020 SURF.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Response cache for GET endpoints.
+
+Endpoints decorated with `response_cache(name)` store their responses in the aiocache cache selected by the
+`RESPONSE_CACHE` setting: "redis" (on `CACHE_HOST`:`CACHE_PORT`, shared by all processes), "memory" (per process) or
+"" to disable caching. Entries are keyed by the path, the query parameters, the `Accept` header and an auth scope, all
+keys start with `/{name}`.
+
+Invalidation works with a generation counter per name that is part of every key. Writes through `CRUDBase` and the
+`DELETE /settings/cache/{name}` endpoint increment it, so all entries of a name become unreachable at once and expire
+by their TTL. aiocache can't delete keys by pattern.
+
+A miss takes a `RedLock` on the key so concurrent requests for the same key wait for the first one to fill the cache
+instead of all hitting the database. Responses get an `ETag`; a matching `If-None-Match` is answered with a 304.
+"""
+
+import asyncio
+import inspect
+from functools import partial, wraps
+from typing import Any, Awaitable, Callable, List, NamedTuple, Optional, Set, Tuple
+from urllib.parse import urlencode
+
+import structlog
+from anyio import from_thread
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+from server.api.conditional import is_not_modified, not_modified_response, strong_etag
+from server.metrics import cache_access
+from server.settings import app_settings
+from server.utils.json import json_dumps, json_loads
+
+logger = structlog.get_logger(__name__)
+
+REDIS = "redis"
+MEMORY = "memory"
+# Seconds other requests wait for the request that fills the cache, after that they run the endpoint themselves
+LOCK_LEASE = 5
+REQUEST_PARAMETER = "response_cache_request"
+
+
+def public_scope(request: Request) -> str:
+    """Auth scope for endpoints whose responses don't depend on the user."""
+    return "public"
+
+
+class CachedResponse(NamedTuple):
+    status_code: int
+    headers: List[Tuple[str, str]]
+    body: str
+
+    @classmethod
+    def from_response(cls, response: Response) -> "CachedResponse":
+        headers = [(k.decode(), v.decode()) for k, v in response.raw_headers if k != b"content-length"]
+        if "etag" not in response.headers:
+            headers.append(("etag", strong_etag(response.body)))
+        return cls(response.status_code, headers, response.body.decode())
+
+    @classmethod
+    def decode(cls, value: str) -> "CachedResponse":
+        status_code, headers, body = json_loads(value)  # type: ignore
+        return cls(status_code, [tuple(header) for header in headers], body)  # type: ignore
+
+    def encode(self) -> str:
+        return json_dumps(list(self))
+
+    def response(self, request: Request, hit: bool) -> Response:
+        etag = dict(self.headers)["etag"]
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
+        response = Response(self.body, status_code=self.status_code)
+        for key, value in self.headers:
+            response.headers.append(key, value)
+        response.headers["X-Cache"] = "HIT" if hit else "MISS"
+        return response
+
+
+class ResponseCache:
+    def __init__(self, backend: Callable[[], str], ttl: Callable[[], int]) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.names: Set[str] = set()
+        self._cache: Optional[Any] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.backend())
+
+    @property
+    def cache(self) -> Any:
+        if self._cache is None:
+            # Imported here: aiocache is slow to import and not needed when caching is off
+            from aiocache import Cache
+            from aiocache.serializers import StringSerializer
+
+            if self.backend() == REDIS:
+                self._cache = Cache(
+                    Cache.REDIS,
+                    endpoint=app_settings.CACHE_HOST,
+                    port=app_settings.CACHE_PORT,
+                    serializer=StringSerializer(),
+                )
+            else:
+                self._cache = Cache(Cache.MEMORY, serializer=StringSerializer())
+        return self._cache
+
+    async def generation(self, name: str) -> int:
+        return int(await self.cache.get(f"/{name}:generation") or 0)
+
+    async def key(self, name: str, scope: str, request: Request) -> str:
+        query = urlencode(sorted(request.query_params.multi_items()))
+        accept = request.headers.get("accept", "")
+        return f"/{name}:{await self.generation(name)}:{scope}:{request.url.path}?{query}|{accept}"
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        value = await self.cache.get(key)
+        return CachedResponse.decode(value) if value is not None else None
+
+    async def set(self, key: str, entry: CachedResponse, ttl: Optional[int] = None) -> None:
+        await self.cache.set(key, entry.encode(), ttl=ttl or self.ttl())
+
+    async def clear(self, *names: str) -> None:
+        """Invalidate all cached responses of `names`."""
+        if self.enabled:
+            for name in names:
+                await self.cache.increment(f"/{name}:generation")
+
+    def invalidate(self, *names: str) -> None:
+        """Synchronous `clear` for the CRUD layer, which runs in the threadpool (or in scripts without event loop)."""
+        if not self.enabled:
+            return
+        try:
+            from_thread.run(partial(self.clear, *names))
+            return
+        except RuntimeError:
+            pass  # Not in a worker thread of the event loop
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(self.clear(*names))
+        else:
+            loop.create_task(self.clear(*names))
+
+    async def cached(
+        self,
+        name: str,
+        request: Request,
+        call: Callable[[], Awaitable[Any]],
+        ttl: Optional[int] = None,
+        scope: Callable[[Request], str] = public_scope,
+    ) -> Any:
+        """Return the cached response for `request` or `call` the endpoint and cache its response."""
+        if not self.enabled:
+            return await call()
+        from aiocache.lock import RedLock
+
+        key = await self.key(name, scope(request), request)
+        entry = await self.get(key)
+        if entry is None:
+            async with RedLock(self.cache, key, lease=LOCK_LEASE):
+                entry = await self.get(key)
+                if entry is None:
+                    cache_access("response", False)
+                    response = await call()
+                    # Only complete 200 responses, e.g. no streaming exports
+                    if (
+                        not isinstance(response, Response)
+                        or isinstance(response, StreamingResponse)
+                        or response.status_code != 200
+                    ):
+                        return response
+                    entry = CachedResponse.from_response(response)
+                    await self.set(key, entry, ttl)
+                    return entry.response(request, hit=False)
+        cache_access("response", True)
+        return entry.response(request, hit=True)
+
+    def __call__(
+        self, name: str, ttl: Optional[int] = None, scope: Callable[[Request], str] = public_scope
+    ) -> Callable[[Callable], Callable]:
+        """Decorate a GET endpoint to cache its responses under `name`, place it below the route decorator."""
+        self.names.add(name)
+
+        def decorator(endpoint: Callable) -> Callable:
+            signature = inspect.signature(endpoint)
+            request_parameter = next(
+                (p.name for p in signature.parameters.values() if p.annotation is Request), REQUEST_PARAMETER
+            )
+            call = endpoint if asyncio.iscoroutinefunction(endpoint) else partial(run_in_threadpool, endpoint)
+
+            @wraps(endpoint)
+            async def wrapper(*args: Any, **kwargs: Any) -> Any:
+                if request_parameter == REQUEST_PARAMETER:
+                    request = kwargs.pop(REQUEST_PARAMETER)
+                else:
+                    request = kwargs[request_parameter]
+                return await self.cached(name, request, partial(call, *args, **kwargs), ttl, scope)
+
+            if request_parameter == REQUEST_PARAMETER:
+                # Let FastAPI inject the request, the endpoint itself doesn't need it
+                parameter = inspect.Parameter(REQUEST_PARAMETER, inspect.Parameter.KEYWORD_ONLY, annotation=Request)
+                wrapper.__signature__ = signature.replace(  # type: ignore
+                    parameters=[*signature.parameters.values(), parameter]
+                )
+            return wrapper
+
+        return decorator
+
+
+response_cache = ResponseCache(lambda: app_settings.RESPONSE_CACHE, lambda: app_settings.RESPONSE_CACHE_TTL)
@@ -2,11 +2,13 @@ from .crud_map import map_crud
 from .crud_product import product_crud
 from .crud_product_type import product_type_crud
 from .crud_user import user_crud
+from .search import search_crud
 
 __all__ = [
     "user_crud",
     "map_crud",
     "product_crud",
     "product_type_crud",
+    "search_crud",
     # "crud_product",
 ]
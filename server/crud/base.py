@@ -1,17 +1,63 @@
-import logging
-from typing import Any, Dict, Generic, List, Optional, Tuple, Type, TypeVar, Union
+from collections import namedtuple
+from functools import cached_property
+from http import HTTPStatus
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
 
-from fastapi.encoders import jsonable_encoder
-from more_itertools import one
-from sqlalchemy import String, cast, or_
+import structlog
+from sqlalchemy import and_, bindparam, delete, insert, literal_column, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.inspection import inspect as sa_inspect
+from sqlalchemy.orm import Query
 from sqlalchemy.sql import expression
+from sqlalchemy.sql.expression import Executable, Select
+from starlette.concurrency import run_in_threadpool
 
+from server.api.error_handling import raise_status
 from server.api.models import transform_json
-from server.db import db
+from server.api.response_cache import response_cache
+from server.crud.count import (
+    CountStatements,
+    CountStrategy,
+    async_count_statements,
+    count_query,
+    count_statements,
+    format_total,
+)
+from server.crud.filters import FilterPlan, FilterPlanner
+from server.crud.pagination import (
+    PREV,
+    Cursor,
+    InvalidCursor,
+    SortKey,
+    decode_cursor,
+    order_by_clauses,
+    page_cursors,
+    seek_condition,
+    seek_params,
+    seek_shape,
+)
+from server.crud.query_cache import query_cache
+from server.db import async_db, db
 from server.db.database import BaseModel
+from server.schemas.bulk import BulkResult, BulkRowError
+from server.settings import app_settings
 
-logger = logging.getLogger("crud.base")
+logger = structlog.get_logger(__name__)
 
 ModelType = TypeVar("ModelType", bound=BaseModel)
 CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
@@ -22,20 +68,50 @@ class NotFound(Exception):
     pass
 
 
+class PageStatements(NamedTuple):
+    page: Select
+    counts: CountStatements
+    # Named tuple type of the page rows, they are accessed by attribute like ORM objects
+    row: Type[Tuple[Any, ...]]
+
+
 class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
-    def __init__(self, model: Type[ModelType]):
+    def __init__(self, model: Type[ModelType], count_strategy: Optional[CountStrategy] = None):
         """
         CRUD object with default methods to Create, Read, Update, Delete (CRUD).
 
         **Parameters**
         * `model`: A SQLAlchemy model class
-        * `schema`: A Pydantic model (schema) class
+        * `count_strategy`: How `get_multi` counts the total for this model, defaults to `COUNT_STRATEGY` setting
         """
         self.model = model
+        self.count_strategy = count_strategy
+        self._filter_planner: Optional[FilterPlanner] = None
+
+    def resolve_count_strategy(self, count: Optional[CountStrategy] = None) -> CountStrategy:
+        """Return the count strategy for a request: the requested one, the model default or the app default."""
+        return count or self.count_strategy or CountStrategy(app_settings.COUNT_STRATEGY)
+
+    @property
+    def filter_planner(self) -> FilterPlanner:
+        if self._filter_planner is None:
+            self._filter_planner = FilterPlanner(self.model)
+        return self._filter_planner
+
+    def filter_plan(self, filter_parameters: Optional[List[str]]) -> FilterPlan:
+        """Return the conditions `get_multi` uses for `filter_parameters` and which strategy was picked per column."""
+        return self.filter_planner.plan(filter_parameters)
+
+    def query(self) -> Query:
+        """The base query of `get_multi`, subclasses can override this to add loader options."""
+        return db.session.query(self.model)
 
     def get(self, id: str) -> Optional[ModelType]:
         return db.session.query(self.model).get(id)
 
+    def exists(self, id: str) -> bool:
+        return db.session.query(db.session.query(self.model).filter(self._pk_column == id).exists()).scalar()
+
     def get_multi(
         self,
         *,
@@ -43,86 +119,617 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         limit: int = 100,
         filter_parameters: Optional[List[str]],
         sort_parameters: Optional[List[str]],
+        cursor: Optional[str] = None,
+        count: Optional[CountStrategy] = None,
+        columns: Optional[Sequence[str]] = None,
     ) -> Tuple[List[ModelType], str]:
-        query = db.session.query(self.model)
+        """Get a filtered and sorted page of objects together with the value for the `Content-Range` header.
+
+        When `cursor` is None the page is selected with `skip` and `limit`. Any other value (an empty string for the
+        first page) switches to keyset pagination: `skip` is ignored and the page is selected by seeking on the sort
+        columns plus the primary key. Use `page_headers` to get the cursors for the adjacent pages.
+
+        The total in the `Content-Range` is determined by the `count` strategy, see `resolve_count_strategy`.
 
+        With `columns` only those columns are queried and the page consists of row tuples instead of objects, in cursor
+        mode followed by the sort columns needed for the cursors. See `server.api.row_serializer`.
+        """
         logger.debug(
-            f"Filter and Sort parameters model={self.model}, sort_parameters={sort_parameters}, filter_parameters={filter_parameters}",
+            "Filter and sort parameters",
+            model=self.model.__name__,
+            sort_parameters=sort_parameters,
+            filter_parameters=filter_parameters,
         )
-        conditions = []
+        filter_plan = self.filter_plan(filter_parameters)
+        if filter_plan.ignored:
+            logger.info("Filter keys not found in database model", keys=filter_plan.ignored, model=self.model.__name__)
+        logger.debug("Filter plan", model=self.model.__name__, plan=filter_plan.describe())
+        if columns:
+            return self._get_rows(
+                skip=skip,
+                limit=limit,
+                filter_plan=filter_plan,
+                sort_parameters=sort_parameters,
+                cursor=cursor,
+                count=count,
+                columns=columns,
+            )
 
-        if filter_parameters:
-            for filter_parameter in filter_parameters:
-                key, *value = filter_parameter.split(":", 1)
+        query = self.query().filter(*filter_plan.conditions)
 
-                # Use this branch if we detect a key value search (key:value) if it is just a single string (value)
-                # treat the key as the value
-                if len(value) > 0:
-                    if key in sa_inspect(self.model).columns.keys():
-                        conditions.append(cast(self.model.__dict__[key], String).ilike("%" + one(value) + "%"))
-                    else:
-                        logger.info(f"Key: not found in database model key={key}, model={self.model}")
-                    query = query.filter(or_(*conditions))
-                else:
-                    for column in sa_inspect(self.model).columns.keys():
-                        conditions.append(cast(self.model.__dict__[column], String).ilike("%" + key + "%"))
-                    query = query.filter(or_(*conditions))
-
-        if sort_parameters and len(sort_parameters):
-            for sort_parameter in sort_parameters:
-                try:
-                    sort_col, sort_order = sort_parameter.split(":")
-                    if sort_col in sa_inspect(self.model).columns.keys():
-                        if sort_order.upper() == "DESC":
-                            query = query.order_by(expression.desc(self.model.__dict__[sort_col]))
-                        else:
-                            query = query.order_by(expression.asc(self.model.__dict__[sort_col]))
-                    else:
-                        logger.debug(f"Sort col does not exist sort_col={sort_col}")
-                except ValueError:
-                    if sort_parameter in sa_inspect(self.model).columns.keys():
-                        query = query.order_by(expression.asc(self.model.__dict__[sort_parameter]))
-                    else:
-                        logger.debug(f"Sort param does not exist sort_parameter={sort_parameter}")
+        if cursor is not None:
+            return self._get_page_by_cursor(
+                query, limit=limit, sort_parameters=sort_parameters, cursor=cursor, count=count
+            )
+
+        query = self._apply_sort(query, sort_parameters)
 
         # Generate Content Range Header Values
-        count = query.count()
+        total = self._count(query, count)
 
         if limit:
             # Limit is not 0: use limit
-            response_range = "{} {}-{}/{}".format(self.model.__table__.name.lower(), skip, skip + limit, count)
+            response_range = "{} {}-{}/{}".format(self.model.__table__.name.lower(), skip, skip + limit, total)
             return query.offset(skip).limit(limit).all(), response_range
         else:
             # Limit is 0: unlimited
-            response_range = "{} {}/{}".format(self.model.__table__.name.lower(), skip, count)
+            response_range = "{} {}/{}".format(self.model.__table__.name.lower(), skip, total)
             return query.offset(skip).all(), response_range
 
+    def _get_rows(
+        self,
+        *,
+        skip: int,
+        limit: int,
+        filter_plan: FilterPlan,
+        sort_parameters: Optional[List[str]],
+        cursor: Optional[str],
+        count: Optional[CountStrategy],
+        columns: Sequence[str],
+    ) -> Tuple[List[Any], str]:
+        """The `columns` variant of `get_multi`, with statements from the query shape cache (see `query_cache`)."""
+        page_columns = tuple(self._page_columns(columns, sort_parameters, cursor))
+        if cursor is None:
+            sort_keys = [SortKey(name, self._columns[name], desc) for name, desc in self._sort_spec(sort_parameters)]
+        else:
+            sort_keys = self._sort_keys(sort_parameters)
+        statements, params, decoded_cursor = self._cached_page_statements(
+            page_columns, filter_plan, sort_keys, skip=skip, limit=limit, cursor=cursor
+        )
+
+        total = format_total(
+            count_statements(
+                lambda statement, extra: query_cache.execute(statement, {**filter_plan.params, **extra}).scalar(),
+                statements.counts,
+                self.resolve_count_strategy(count),
+                self.model.__table__.name,
+                filtered=bool(filter_plan.conditions),
+                cache_key=(self.model, page_columns, filter_plan.shape, tuple(sorted(filter_plan.params.items()))),
+            )
+        )
+        table_name = self.model.__table__.name.lower()
+        if cursor is not None:
+            response_range = "{} */{}".format(table_name, total)
+        elif limit:
+            response_range = "{} {}-{}/{}".format(table_name, skip, skip + limit, total)
+        else:
+            response_range = "{} {}/{}".format(table_name, skip, total)
+
+        rows = [statements.row._make(row) for row in query_cache.execute(statements.page, params)]
+        if decoded_cursor is not None and decoded_cursor.direction == PREV:
+            rows.reverse()
+        return rows, response_range
+
+    def _cached_page_statements(
+        self,
+        page_columns: Tuple[str, ...],
+        filter_plan: FilterPlan,
+        sort_keys: List[SortKey],
+        *,
+        skip: int,
+        limit: int,
+        cursor: Optional[str],
+    ) -> Tuple[PageStatements, Dict[str, Any], Optional[Cursor]]:
+        """The statements of the query shape from `query_cache` with the parameters of this page and its cursor."""
+        params = dict(filter_plan.params)
+        decoded_cursor = None
+        if cursor is None:
+            pagination: Tuple[Any, ...] = ("offset",)
+            params["offset"] = skip
+        else:
+            decoded_cursor = self._decode_cursor(cursor, sort_keys)
+            pagination = ("cursor", decoded_cursor and seek_shape(sort_keys, decoded_cursor))
+            if decoded_cursor is not None:
+                params.update(seek_params(sort_keys, decoded_cursor))
+        if limit:
+            params["limit"] = limit
+        sort_shape = tuple((key.name, key.desc) for key in sort_keys)
+        shape = (self.model, page_columns, filter_plan.shape, sort_shape, pagination, bool(limit))
+        statements = query_cache.statements(
+            shape,
+            lambda: self._page_statements(
+                page_columns, filter_plan, sort_keys, cursor is None, decoded_cursor, limited=bool(limit)
+            ),
+        )
+        return statements, params, decoded_cursor
+
+    def _page_statements(
+        self,
+        page_columns: Sequence[str],
+        filter_plan: FilterPlan,
+        sort_keys: List[SortKey],
+        offset: bool,
+        decoded_cursor: Optional[Cursor],
+        limited: bool,
+    ) -> PageStatements:
+        table = self.model.__table__
+        statement = select([table.columns[name] for name in page_columns])
+        if filter_plan.conditions:
+            statement = statement.where(and_(*filter_plan.conditions))
+        counts = CountStatements.for_statement(statement)
+
+        if offset:
+            statement = statement.order_by(*order_by_clauses(sort_keys)).offset(bindparam("offset"))
+        else:
+            if decoded_cursor is not None:
+                statement = statement.where(seek_condition(sort_keys, decoded_cursor))
+            statement = statement.order_by(
+                *order_by_clauses(sort_keys, flip=decoded_cursor is not None and decoded_cursor.direction == PREV)
+            )
+        if limited:
+            statement = statement.limit(bindparam("limit"))
+        return PageStatements(statement, counts, namedtuple("Row", page_columns))  # type: ignore
+
+    def _page_columns(
+        self, columns: Sequence[str], sort_parameters: Optional[List[str]], cursor: Optional[str]
+    ) -> List[str]:
+        if cursor is None:
+            return list(columns)
+        return list(dict.fromkeys([*columns, *(key.name for key in self._sort_keys(sort_parameters))]))
+
+    @cached_property
+    def _columns(self) -> Any:
+        return sa_inspect(self.model).columns
+
+    def _sort_spec(self, sort_parameters: Optional[List[str]]) -> List[Tuple[str, bool]]:
+        """The (column, descending) pairs of the offset mode ordering, unknown columns are skipped."""
+        sort_spec = []
+        for sort_parameter in sort_parameters or []:
+            try:
+                sort_col, sort_order = sort_parameter.split(":")
+            except ValueError:
+                sort_col, sort_order = sort_parameter, "ASC"
+            if sort_col in self._columns.keys():
+                sort_spec.append((sort_col, sort_order.upper() == "DESC"))
+            else:
+                logger.debug("Sort column does not exist", sort_col=sort_col)
+        return sort_spec
+
+    def _apply_sort(self, query: Query, sort_parameters: Optional[List[str]]) -> Query:
+        for sort_col, desc in self._sort_spec(sort_parameters):
+            attribute = self.model.__dict__[sort_col]
+            query = query.order_by(expression.desc(attribute) if desc else expression.asc(attribute))
+        return query
+
+    def stream_multi(
+        self,
+        *,
+        skip: int = 0,
+        limit: int = 100,
+        filter_parameters: Optional[List[str]],
+        sort_parameters: Optional[List[str]],
+    ) -> Iterator[ModelType]:
+        """Yield the objects `get_multi` would return (limit 0 is unlimited) using a server side cursor.
+
+        Only `EXPORT_BATCH_SIZE` rows are fetched from the database at a time, so this is safe to use on huge tables.
+        The query is bound to the session of the caller; iterating from another thread (as `StreamingResponse` does)
+        keeps using that session.
+        """
+        query = self.query().filter(*self.filter_plan(filter_parameters).conditions)
+        query = self._apply_sort(query, sort_parameters).offset(skip)
+        if limit:
+            query = query.limit(limit)
+        return iter(query.yield_per(app_settings.EXPORT_BATCH_SIZE))
+
+    def _count(self, query: Any, count: Optional[CountStrategy]) -> str:
+        table_name = self.model.__table__.name
+        return format_total(count_query(query, self.resolve_count_strategy(count), table_name))
+
+    def _sort_keys(self, sort_parameters: Optional[List[str]]) -> List[SortKey]:
+        """Parse the sort parameters like `get_multi` does and append the primary key as a tiebreaker."""
+        columns = self._columns
+        sort_keys = []
+        for sort_parameter in sort_parameters or []:
+            sort_col, _, sort_order = sort_parameter.partition(":")
+            if sort_col in columns.keys():
+                sort_keys.append(SortKey(sort_col, columns[sort_col], sort_order.upper() == "DESC"))
+            else:
+                logger.debug("Sort column does not exist", sort_col=sort_col)
+
+        for pk_column in sa_inspect(self.model).primary_key:
+            if pk_column.key not in {key.name for key in sort_keys}:
+                sort_keys.append(SortKey(pk_column.key, pk_column, False))
+        return sort_keys
+
+    def _decode_cursor(self, cursor: str, sort_keys: List[SortKey]) -> Any:
+        try:
+            return decode_cursor(cursor, sort_keys) if cursor else None
+        except InvalidCursor as e:
+            raise_status(HTTPStatus.BAD_REQUEST, str(e))
+
+    def _get_page_by_cursor(
+        self,
+        query: Any,
+        *,
+        limit: int,
+        sort_parameters: Optional[List[str]],
+        cursor: str,
+        count: Optional[CountStrategy],
+    ) -> Tuple[List[ModelType], str]:
+        sort_keys = self._sort_keys(sort_parameters)
+        decoded_cursor = self._decode_cursor(cursor, sort_keys)
+
+        # Generate Content Range Header Values; the position of a keyset page within the result is unknown
+        response_range = "{} */{}".format(self.model.__table__.name.lower(), self._count(query, count))
+
+        backwards = decoded_cursor is not None and decoded_cursor.direction == PREV
+        if decoded_cursor is not None:
+            query = query.filter(seek_condition(sort_keys, decoded_cursor))
+        query = query.order_by(*order_by_clauses(sort_keys, flip=backwards))
+        if limit:
+            query = query.limit(limit)
+
+        rows = query.all()
+        if backwards:
+            rows.reverse()
+        return rows, response_range
+
+    def page_headers(
+        self,
+        items: List[ModelType],
+        *,
+        limit: int,
+        sort_parameters: Optional[List[str]],
+        cursor: Optional[str],
+        count: Optional[CountStrategy] = None,
+    ) -> Dict[str, str]:
+        """Return the headers that go along with the `Content-Range` of a page returned by `get_multi`.
+
+        `X-Count-Strategy` tells how the total was determined, so clients can show "about N" for estimates.
+        `X-Next-Cursor` and `X-Prev-Cursor` are only present in cursor mode and when an adjacent page exists.
+        """
+        headers = {"X-Count-Strategy": str(self.resolve_count_strategy(count))}
+        if cursor is None:
+            return headers
+        sort_keys = self._sort_keys(sort_parameters)
+        next_cursor, prev_cursor = page_cursors(items, sort_keys, limit, self._decode_cursor(cursor, sort_keys))
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        if prev_cursor:
+            headers["X-Prev-Cursor"] = prev_cursor
+        return headers
+
+    def invalidate_cache(self) -> None:
+        """Invalidate the cached responses of this model's endpoints, call after committing a change."""
+        response_cache.invalidate(self.model.__tablename__)
+
+    async def async_invalidate_cache(self) -> None:
+        """`invalidate_cache` for the async variants."""
+        await response_cache.clear(self.model.__tablename__)
+
     def create(self, *, obj_in: CreateSchemaType) -> ModelType:
         obj_in_data = transform_json(obj_in.dict())
         db_obj = self.model(**obj_in_data)
         db.session.add(db_obj)
         db.session.commit()
+        self.invalidate_cache()
         db.session.refresh(db_obj)
         return db_obj
 
     def update(self, *, db_obj: ModelType, obj_in: Union[UpdateSchemaType, Dict[str, Any]]) -> ModelType:
-        obj_data = jsonable_encoder(db_obj)
         if isinstance(obj_in, dict):
             update_data = obj_in
         else:
             update_data = obj_in.dict(exclude_unset=True)
-        for field in obj_data:
+        for field in sa_inspect(self.model).column_attrs.keys():
             if field in update_data:
                 setattr(db_obj, field, update_data[field])
         db.session.add(db_obj)
         db.session.commit()
+        self.invalidate_cache()
         db.session.refresh(db_obj)
         return db_obj
 
+    def _where(self, id: Any, where: Dict[str, Any]) -> Any:
+        columns = self.model.__table__.columns
+        return and_(self._pk_column == id, *(columns[key] == value for key, value in where.items()))
+
+    def _update_statement(
+        self, id: Any, obj_in: Union[UpdateSchemaType, Dict[str, Any]], where: Dict[str, Any]
+    ) -> Executable:
+        update_data = obj_in if isinstance(obj_in, dict) else obj_in.dict(exclude_unset=True)
+        values = self._column_values(update_data, for_update=True)
+        # Without values (and onupdate columns) a no-op assignment keeps the statement valid and returns the row
+        return (
+            update(self.model.__table__)
+            .where(self._where(id, where))
+            .values(values or {self._pk_column.key: self._pk_column})
+            .returning(*self._data_columns)
+        )
+
+    def update_by_id(
+        self,
+        *,
+        id: Any,
+        obj_in: Union[UpdateSchemaType, Dict[str, Any]],
+        precondition: Optional[Callable[[Dict[str, Any]], None]] = None,
+        **where: Any,
+    ) -> Optional[Dict[str, Any]]:
+        """Update the row with primary key `id` with one `UPDATE ... RETURNING`, without loading it first.
+
+        The keyword arguments in `where` are extra column conditions, e.g. `created_by=user_id`. Returns the updated
+        row, None when no row matched; use `exists` to tell a missing row from one that didn't match `where`.
+        `precondition` is called with the current row, locked until the commit, and can raise to abort the update
+        (e.g. on an `If-Match` mismatch). That takes an extra round trip, only pass it when needed.
+        """
+        if precondition is not None:
+            current = db.session.execute(
+                select(self._data_columns).where(self._where(id, where)).with_for_update()
+            ).first()
+            if current is None:
+                db.session.rollback()
+                return None
+            precondition(dict(current))
+        row = db.session.execute(self._update_statement(id, obj_in, where)).first()
+        db.session.commit()
+        if row is None:
+            return None
+        self.invalidate_cache()
+        return dict(row)
+
+    def delete_by_id(self, *, id: Any, **where: Any) -> Optional[Any]:
+        """Delete the row with primary key `id` (and matching `where`) with one `DELETE ... RETURNING`.
+
+        Returns the primary key, None when no row matched. Unlike `delete` this skips the ORM, so relationship cascades
+        don't apply; the database foreign keys still do.
+        """
+        row = db.session.execute(
+            delete(self.model.__table__).where(self._where(id, where)).returning(self._pk_column)
+        ).first()
+        db.session.commit()
+        if row is None:
+            return None
+        self.invalidate_cache()
+        return row[0]
+
     def delete(self, *, id: str) -> ModelType:
         obj = db.session.query(self.model).get(id)
         if obj is None:
             raise NotFound
         db.session.delete(obj)
         db.session.commit()
+        self.invalidate_cache()
         return obj
+
+    def _bulk(self, rows: Sequence[Any], statement: Callable[[Sequence[Any]], Executable]) -> BulkResult:
+        """Execute `statement` for chunks of `rows`, each chunk in its own transaction.
+
+        `statement` has to return the primary key of the affected rows. When a chunk fails, e.g. on a constraint, it is
+        retried row by row within savepoints so only the offending rows are reported in the errors, by their index.
+        """
+        result = BulkResult()
+        chunk_size = app_settings.BULK_CHUNK_SIZE
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start : start + chunk_size]
+            try:
+                with db.session.begin_nested():
+                    result.ids.extend(row[0] for row in db.session.execute(statement(chunk)))
+            except DBAPIError:
+                for index, value in enumerate(chunk, start):
+                    try:
+                        with db.session.begin_nested():
+                            result.ids.extend(row[0] for row in db.session.execute(statement([value])))
+                    except DBAPIError as e:
+                        result.errors.append(BulkRowError(index=index, detail=str(e.orig).strip()))
+            db.session.commit()
+        if result.ids:
+            self.invalidate_cache()
+        return result
+
+    def _bulk_values(self, objs_in: Sequence[Union[CreateSchemaType, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Column values per row, all with the same keys as a multi-row `INSERT` needs.
+
+        `transform_json` drops empty values so the column defaults apply, a column that is missing in some rows gets
+        its python side default or the `DEFAULT` keyword (server default or NULL) in those rows.
+        """
+        rows = [
+            self._column_values(transform_json(obj_in if isinstance(obj_in, dict) else obj_in.dict()))
+            for obj_in in objs_in
+        ]
+        columns = self.model.__table__.columns
+        for key in set().union(*rows):
+            column = columns[key]
+            for row in rows:
+                if key not in row:
+                    if column.default is None:
+                        row[key] = literal_column("DEFAULT")
+                    else:
+                        row[key] = column.default.arg(None) if column.default.is_callable else column.default.arg
+        return rows
+
+    def bulk_create(self, *, objs_in: Sequence[Union[CreateSchemaType, Dict[str, Any]]]) -> BulkResult:
+        """Insert `objs_in` with multi-row `INSERT`s, see `_bulk` for the chunking and error reporting."""
+        table = self.model.__table__
+        return self._bulk(
+            self._bulk_values(objs_in), lambda chunk: insert(table).values(chunk).returning(self._pk_column)
+        )
+
+    def bulk_upsert(
+        self, *, objs_in: Sequence[Union[CreateSchemaType, Dict[str, Any]]], index_elements: Sequence[str]
+    ) -> BulkResult:
+        """Insert `objs_in` or update the existing rows with the same (unique) `index_elements` columns.
+
+        Within one chunk an index value may only occur once, otherwise the rows of that chunk are upserted one by one.
+        """
+        table = self.model.__table__
+        on_update = {
+            column.key: column.onupdate.arg(None)
+            for column in table.columns
+            if column.onupdate is not None and column.onupdate.is_callable
+        }
+
+        def upsert(chunk: Sequence[Dict[str, Any]]) -> Executable:
+            statement = pg_insert(table).values(chunk)
+            updates = {key: statement.excluded[key] for key in chunk[0] if key not in index_elements}
+            return statement.on_conflict_do_update(
+                index_elements=index_elements, set_={**on_update, **updates}
+            ).returning(self._pk_column)
+
+        return self._bulk(self._bulk_values(objs_in), upsert)
+
+    def bulk_delete(self, *, ids: Sequence[Any]) -> BulkResult:
+        """Delete the rows with the primary keys in `ids`, ids that don't exist are reported as errors."""
+        table = self.model.__table__
+        result = self._bulk(
+            ids, lambda chunk: delete(table).where(self._pk_column.in_(chunk)).returning(self._pk_column)
+        )
+        deleted = {str(id) for id in result.ids}
+        failed = {error.index for error in result.errors}
+        result.errors.extend(
+            BulkRowError(index=index, detail=f"{self.model.__name__} id {id} not found")
+            for index, id in enumerate(ids)
+            if str(id) not in deleted and index not in failed
+        )
+        result.errors.sort(key=lambda error: error.index)
+        return result
+
+    # Async variants. These run on `async_db` when the `ASYNC_DATABASE` pool is connected and return mappings instead
+    # of ORM instances; otherwise they fall back to the sync methods above on the threadpool.
+
+    @property
+    def _pk_column(self) -> Any:
+        return sa_inspect(self.model).primary_key[0]
+
+    @cached_property
+    def _data_columns(self) -> List[Any]:
+        """The table columns without generated ones like `tsv`, for the rows the async variants return."""
+        return [column for column in self.model.__table__.columns if column.computed is None]
+
+    def _column_values(self, data: Dict[str, Any], for_update: bool = False) -> Dict[str, Any]:
+        """Restrict `data` to table columns and evaluate the python side (on)update defaults like `nowtz`.
+
+        The `databases` package only compiles statements, so callable defaults have to be resolved here.
+        """
+        columns = self.model.__table__.columns
+        values = {key: value for key, value in data.items() if key in columns and not columns[key].primary_key}
+        for column in columns:
+            default = column.onupdate if for_update else column.default
+            if column.key not in values and default is not None and default.is_callable:
+                values[column.key] = default.arg(None)
+        return values
+
+    async def async_get(self, id: str) -> Optional[Union[ModelType, Dict[str, Any]]]:
+        if not async_db.is_connected:
+            return await run_in_threadpool(self.get, id)
+        row = await async_db.session.fetch_one(select(self._data_columns).where(self._pk_column == id))
+        return dict(row) if row is not None else None
+
+    async def async_get_multi(
+        self,
+        *,
+        skip: int = 0,
+        limit: int = 100,
+        filter_parameters: Optional[List[str]],
+        sort_parameters: Optional[List[str]],
+        cursor: Optional[str] = None,
+        count: Optional[CountStrategy] = None,
+        columns: Optional[Sequence[str]] = None,
+    ) -> Tuple[List[Union[ModelType, Dict[str, Any]]], str]:
+        """Async `get_multi`, the pages and the `Content-Range` are the same as those of the sync variant."""
+        if not async_db.is_connected:
+            return await run_in_threadpool(
+                self.get_multi,
+                skip=skip,
+                limit=limit,
+                filter_parameters=filter_parameters,
+                sort_parameters=sort_parameters,
+                cursor=cursor,
+                count=count,
+                columns=columns,
+            )
+
+        filter_plan = self.filter_plan(filter_parameters)
+        logger.debug("Filter plan", model=self.model.__name__, plan=filter_plan.describe())
+        if columns:
+            page_columns = tuple(self._page_columns(columns, sort_parameters, cursor))
+        else:
+            page_columns = tuple(column.key for column in self._data_columns)
+        statements, params, decoded_cursor = self._cached_page_statements(
+            page_columns, filter_plan, self._sort_keys(sort_parameters), skip=skip, limit=limit, cursor=cursor
+        )
+
+        async def fetch_val(statement: Executable, extra: Dict[str, Any]) -> Any:
+            # `databases` takes the values of a clause from its bind parameters
+            return await async_db.session.fetch_val(statement.params(**filter_plan.params, **extra))
+
+        total = format_total(
+            await async_count_statements(
+                fetch_val,
+                statements.counts,
+                self.resolve_count_strategy(count),
+                self.model.__table__.name,
+                filtered=bool(filter_plan.conditions),
+                cache_key=(self.model, page_columns, filter_plan.shape, tuple(sorted(filter_plan.params.items()))),
+            )
+        )
+        table_name = self.model.__table__.name.lower()
+        if cursor is not None:
+            response_range = "{} */{}".format(table_name, total)
+        elif limit:
+            response_range = "{} {}-{}/{}".format(table_name, skip, skip + limit, total)
+        else:
+            response_range = "{} {}/{}".format(table_name, skip, total)
+
+        rows = [dict(row) for row in await async_db.session.fetch_all(statements.page.params(**params))]
+        if decoded_cursor is not None and decoded_cursor.direction == PREV:
+            rows.reverse()
+        return rows, response_range
+
+    async def async_create(self, *, obj_in: CreateSchemaType) -> Union[ModelType, Dict[str, Any]]:
+        if not async_db.is_connected:
+            return await run_in_threadpool(self.create, obj_in=obj_in)
+        values = self._column_values(transform_json(obj_in.dict()))
+        table = self.model.__table__
+        row = await async_db.session.fetch_one(insert(table).values(**values).returning(*self._data_columns))
+        await self.async_invalidate_cache()
+        return dict(row)
+
+    async def async_update(
+        self, *, id: str, obj_in: Union[UpdateSchemaType, Dict[str, Any]]
+    ) -> Optional[Union[ModelType, Dict[str, Any]]]:
+        """Update the object with primary key `id` in one statement, returns None when it does not exist."""
+        if not async_db.is_connected:
+
+            def _update() -> Optional[ModelType]:
+                db_obj = self.get(id)
+                return self.update(db_obj=db_obj, obj_in=obj_in) if db_obj is not None else None
+
+            return await run_in_threadpool(_update)
+
+        row = await async_db.session.fetch_one(self._update_statement(id, obj_in, {}))
+        if row is None:
+            return None
+        await self.async_invalidate_cache()
+        return dict(row)
+
+    async def async_delete(self, *, id: str) -> Union[ModelType, Dict[str, Any]]:
+        if not async_db.is_connected:
+            return await run_in_threadpool(self.delete, id=id)
+        table = self.model.__table__
+        row = await async_db.session.fetch_one(
+            delete(table).where(self._pk_column == id).returning(*self._data_columns)
+        )
+        if row is None:
+            raise NotFound
+        await self.async_invalidate_cache()
+        return dict(row)
@@ -0,0 +1,186 @@
+"""Count strategies for the total in the `Content-Range` header of list endpoints.
+
+An exact `COUNT(*)` has to visit every matching row; on big tables that costs more than fetching the page itself. The
+strategies below trade accuracy for speed:
+
+- `exact`: `SELECT count(*)`, always correct.
+- `estimated`: the planner statistics. `pg_class.reltuples` for unfiltered queries and the row estimate of `EXPLAIN`
+  for filtered ones. Estimates below `COUNT_ESTIMATE_THRESHOLD` are replaced by an exact count as those are cheap.
+- `cached`: an exact count that is reused for `COUNT_CACHE_TTL` seconds per distinct query.
+- `none`: no total at all; the `Content-Range` header will contain `*` as total.
+"""
+
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, NamedTuple, Optional
+
+import structlog
+from sqlalchemy import func, select, text
+from sqlalchemy.engine import Dialect
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Query
+from sqlalchemy.sql.elements import _clone
+from sqlalchemy.sql.expression import ClauseElement, Executable, Select
+
+from server.db import db
+from server.metrics import cache_access
+from server.settings import app_settings
+from server.types import strEnum
+from server.utils.json import json_loads
+from server.utils.ttl_cache import TTLCache
+
+logger = structlog.get_logger(__name__)
+
+COUNT_CACHE_MAX_ENTRIES = 1024
+
+
+class CountStrategy(strEnum):
+    EXACT = "exact"
+    ESTIMATED = "estimated"
+    CACHED = "cached"
+    NONE = "none"
+
+
+class explain(Executable, ClauseElement):
+    """`EXPLAIN (FORMAT JSON)` for an arbitrary statement; bind parameters are processed as usual."""
+
+    def __init__(self, statement: ClauseElement) -> None:
+        self.statement = statement
+
+    # Traversed like other clauses, so `params()` also sets the bind parameters of the explained statement
+    def get_children(self, **kw: Any) -> List[ClauseElement]:
+        return [self.statement]
+
+    def _copy_internals(self, clone: Callable[..., ClauseElement] = _clone, **kw: Any) -> None:
+        self.statement = clone(self.statement, **kw)
+
+
+@compiles(explain, "postgresql")
+def _compile_explain(element: explain, compiler: Any, **kw: Any) -> str:
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+ESTIMATE_FROM_STATISTICS = text("SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table_name AS regclass)")
+
+_count_cache: TTLCache[int] = TTLCache(
+    COUNT_CACHE_MAX_ENTRIES, lambda: app_settings.COUNT_CACHE_TTL, partial(cache_access, "count")
+)
+
+
+def clear_count_cache() -> None:
+    _count_cache.clear()
+
+
+def _cache_key(statement: ClauseElement, dialect: Dialect) -> str:
+    compiled = statement.compile(dialect=dialect)
+    return f"{compiled}|{sorted(compiled.params.items())!r}"
+
+
+def _usable_estimate(estimate: Optional[int]) -> bool:
+    # Never analyzed tables report -1 (or 0 on older Postgres versions); small results are cheap to count anyway
+    return estimate is not None and estimate >= app_settings.COUNT_ESTIMATE_THRESHOLD
+
+
+def _plan_rows(plan: Any) -> int:
+    if isinstance(plan, str):
+        plan = json_loads(plan)
+    return plan[0]["Plan"]["Plan Rows"]
+
+
+def _cached_count(query: Query) -> int:
+    key = _cache_key(query.statement, db.session.bind.dialect)
+    total = _count_cache.get(key)
+    if total is None:
+        total = query.count()
+        _count_cache.set(key, total)
+    return total
+
+
+def _estimated_count(query: Query, table_name: str) -> int:
+    if query.whereclause is None:
+        estimate = db.session.execute(ESTIMATE_FROM_STATISTICS, {"table_name": table_name}).scalar()
+    else:
+        estimate = _plan_rows(db.session.execute(explain(query.enable_eagerloads(False).statement)).scalar())
+    return int(estimate) if _usable_estimate(estimate) else query.count()
+
+
+def count_query(query: Query, strategy: CountStrategy, table_name: str) -> Optional[int]:
+    """Return the total number of rows `query` would yield according to `strategy`, None for `CountStrategy.NONE`."""
+    if strategy == CountStrategy.NONE:
+        return None
+    if strategy == CountStrategy.ESTIMATED:
+        return _estimated_count(query, table_name)
+    if strategy == CountStrategy.CACHED:
+        return _cached_count(query)
+    return query.count()
+
+
+class CountStatements(NamedTuple):
+    """The statements to count the rows of a select, built once so they can be cached with it."""
+
+    count: Select
+    explain: explain
+
+    @classmethod
+    def for_statement(cls, statement: Select) -> "CountStatements":
+        return cls(select([func.count()]).select_from(statement.alias("counted")), explain(statement))
+
+
+def count_statements(
+    fetch_val: Callable[[Executable, Dict[str, Any]], Any],
+    statements: CountStatements,
+    strategy: CountStrategy,
+    table_name: str,
+    filtered: bool,
+    cache_key: Hashable,
+) -> Optional[int]:
+    """`count_query` for prebuilt `statements`, executed by `fetch_val` with the parameters of the counted select.
+
+    `cache_key` identifies the counted select including its parameters, for `CountStrategy.CACHED`.
+    """
+    if strategy == CountStrategy.NONE:
+        return None
+    if strategy == CountStrategy.ESTIMATED:
+        if filtered:
+            estimate = _plan_rows(fetch_val(statements.explain, {}))
+        else:
+            estimate = fetch_val(ESTIMATE_FROM_STATISTICS, {"table_name": table_name})
+        if _usable_estimate(estimate):
+            return int(estimate)
+    if strategy == CountStrategy.CACHED:
+        total = _count_cache.get(cache_key)
+        if total is None:
+            total = fetch_val(statements.count, {})
+            _count_cache.set(cache_key, total)
+        return total
+    return fetch_val(statements.count, {})
+
+
+async def async_count_statements(
+    fetch_val: Callable[[Executable, Dict[str, Any]], Awaitable[Any]],
+    statements: CountStatements,
+    strategy: CountStrategy,
+    table_name: str,
+    filtered: bool,
+    cache_key: Hashable,
+) -> Optional[int]:
+    """Async counterpart of `count_statements`, e.g. for an `AsyncDatabase` session."""
+    if strategy == CountStrategy.NONE:
+        return None
+    if strategy == CountStrategy.ESTIMATED:
+        if filtered:
+            estimate = _plan_rows(await fetch_val(statements.explain, {}))
+        else:
+            estimate = await fetch_val(ESTIMATE_FROM_STATISTICS, {"table_name": table_name})
+        if _usable_estimate(estimate):
+            return int(estimate)
+    if strategy == CountStrategy.CACHED:
+        total = _count_cache.get(cache_key)
+        if total is None:
+            total = await fetch_val(statements.count, {})
+            _count_cache.set(cache_key, total)
+        return total
+    return await fetch_val(statements.count, {})
+
+
+def format_total(total: Optional[int]) -> str:
+    return "*" if total is None else str(total)
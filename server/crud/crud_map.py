@@ -14,6 +14,7 @@ class CRUDMap(CRUDBase[MapsTable, MapCreate, MapUpdate]):
         db_obj = self.model(**obj_in_data, created_by=created_by)
         db.session.add(db_obj)
         db.session.commit()
+        self.invalidate_cache()
         db.session.refresh(db_obj)
         return db_obj
 
@@ -1,23 +1,78 @@
-from typing import Optional
+from functools import partial
+from typing import Any, List, NamedTuple, Optional, Tuple, Union
+from uuid import UUID
 
 from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import Query, lazyload, load_only, selectinload
+from starlette.concurrency import run_in_threadpool
 
 from server.crud.base import CRUDBase
 from server.db import db
-from server.db.models import UsersTable
+from server.db.models import RolesTable, UsersTable
+from server.metrics import cache_access
 from server.schemas.user import UserCreate, UserUpdate
-from server.security import get_password_hash, verify_password
+from server.security import async_verify_and_update_password, get_password_hash, verify_and_update_password
+from server.settings import app_settings
+from server.types import strEnum
+from server.utils.ttl_cache import TTLCache
+
+PRINCIPAL_CACHE_MAX_ENTRIES = 4096
+
+
+class UserProfile(strEnum):
+    """How much of a user a query loads, pick the cheapest profile that satisfies the response model.
+
+    - `principal`: only the columns needed to authenticate and authorize, no relationships.
+    - `list`: all columns, relationships are only loaded when accessed. Enough for the `User` schema.
+    - `detail`: all columns plus `roles` and `maps`, each loaded with one extra `SELECT .. IN` for all users.
+    """
+
+    PRINCIPAL = "principal"
+    LIST = "list"
+    DETAIL = "detail"
+
+
+PRINCIPAL_COLUMNS = ("id", "username", "hashed_password", "is_active", "is_superuser")
+
+
+def user_loader_options(profile: UserProfile) -> List[Any]:
+    if profile == UserProfile.PRINCIPAL:
+        return [load_only(*PRINCIPAL_COLUMNS), lazyload(UsersTable.roles), lazyload(UsersTable.maps)]
+    if profile == UserProfile.DETAIL:
+        return [selectinload(UsersTable.roles), selectinload(UsersTable.maps)]
+    return [lazyload(UsersTable.roles), lazyload(UsersTable.maps)]
+
+
+class Principal(NamedTuple):
+    """The part of a user that is needed to authorize a request."""
+
+    id: UUID
+    is_active: bool
+    is_superuser: bool
+    roles: Tuple[str, ...]
+
+
+_principal_cache: TTLCache[Principal] = TTLCache(
+    PRINCIPAL_CACHE_MAX_ENTRIES, lambda: app_settings.AUTH_CACHE_TTL, partial(cache_access, "principal")
+)
+
+
+def clear_principal_cache() -> None:
+    _principal_cache.clear()
 
 
 class CRUDUser(CRUDBase[UsersTable, UserCreate, UserUpdate]):
-    def get_by_email(self, *, email: str) -> Optional[UsersTable]:
-        return UsersTable.query.filter(UsersTable.email == email).first()
+    def query(self, profile: UserProfile = UserProfile.LIST) -> Query:
+        return UsersTable.query.options(*user_loader_options(profile))
 
-    def get_by_username(self, *, username: str) -> Optional[UsersTable]:
-        return UsersTable.query.filter(UsersTable.username == username).first()
+    def get_by_email(self, *, email: str, profile: UserProfile = UserProfile.LIST) -> Optional[UsersTable]:
+        return self.query(profile).filter(UsersTable.email == email).first()
 
-    def get(self, id: Optional[str] = None) -> Optional[UsersTable]:
-        user = UsersTable.query.get(id)
+    def get_by_username(self, *, username: str, profile: UserProfile = UserProfile.LIST) -> Optional[UsersTable]:
+        return self.query(profile).filter(UsersTable.username == username).first()
+
+    def get(self, id: Optional[str] = None, profile: UserProfile = UserProfile.LIST) -> Optional[UsersTable]:
+        user = self.query(profile).get(id)
         return user
 
     def create(self, *, obj_in: UserCreate) -> UsersTable:
@@ -29,6 +84,7 @@ class CRUDUser(CRUDBase[UsersTable, UserCreate, UserUpdate]):
         )
         db.session.add(db_obj)
         db.session.commit()
+        self.invalidate_cache()
         return db_obj
 
     def update(self, *, db_obj: UsersTable, obj_in: UserUpdate) -> UsersTable:
@@ -44,21 +100,77 @@ class CRUDUser(CRUDBase[UsersTable, UserCreate, UserUpdate]):
                 setattr(db_obj, field, update_data[field])
         db.session.add(db_obj)
         db.session.commit()
+        self.invalidate_cache()
         db.session.refresh(db_obj)
         return db_obj
 
+    def invalidate_cache(self) -> None:
+        super().invalidate_cache()
+        # The by id and bulk writes don't know which users changed, and user writes are rare: drop all principals
+        _principal_cache.clear()
+
+    async def async_invalidate_cache(self) -> None:
+        await super().async_invalidate_cache()
+        _principal_cache.clear()
+
+    def get_principal(self, id: Optional[str]) -> Optional[Principal]:
+        """Return the (cached) principal of the user with `id`.
+
+        Only the columns needed for authorization are queried, the joined `maps` and `roles` of `UsersTable` are not
+        loaded. Every write through `user_crud` invalidates the cached principals of this process, other processes keep
+        theirs for up to `AUTH_CACHE_TTL` seconds.
+        """
+        if id is None:
+            return None
+        principal = _principal_cache.get(str(id))
+        if principal is not None:
+            return principal
+
+        rows = (
+            db.session.query(UsersTable.id, UsersTable.is_active, UsersTable.is_superuser, RolesTable.name)
+            .outerjoin(UsersTable.roles)
+            .filter(UsersTable.id == id)
+            .all()
+        )
+        if not rows:
+            return None
+        user_id, is_active, is_superuser, _ = rows[0]
+        principal = Principal(user_id, is_active, is_superuser, tuple(sorted(row[3] for row in rows if row[3])))
+        _principal_cache.set(str(id), principal)
+        return principal
+
     def authenticate(self, *, username: str, password: str) -> Optional[UsersTable]:
-        user = self.get_by_username(username=username)
+        user = self.get_by_username(username=username, profile=UserProfile.PRINCIPAL)
+        if not user:
+            return None
+        valid, new_hash = verify_and_update_password(password, user.hashed_password)
+        if not valid:
+            return None
+        if new_hash:
+            self._rehash(user, new_hash)
+        return user
+
+    async def async_authenticate(self, *, username: str, password: str) -> Optional[UsersTable]:
+        """`authenticate` that awaits the password hasher instead of holding a thread for the bcrypt run."""
+        user = await run_in_threadpool(self.get_by_username, username=username, profile=UserProfile.PRINCIPAL)
         if not user:
             return None
-        if not verify_password(password, user.hashed_password):
+        valid, new_hash = await async_verify_and_update_password(password, user.hashed_password)
+        if not valid:
             return None
+        if new_hash:
+            await run_in_threadpool(self._rehash, user, new_hash)
         return user
 
-    def is_active(self, user: UsersTable) -> bool:
+    def _rehash(self, user: UsersTable, new_hash: str) -> None:
+        # The hash was made with settings that are no longer current (e.g. fewer rounds), upgrade it transparently
+        user.hashed_password = new_hash
+        db.session.commit()
+
+    def is_active(self, user: Union[UsersTable, Principal]) -> bool:
         return user.is_active
 
-    def is_superuser(self, user: UsersTable) -> bool:
+    def is_superuser(self, user: Union[UsersTable, Principal]) -> bool:
         return user.is_superuser
 
 
@@ -0,0 +1,242 @@
+"""Filter planner for the `key:value` and free text filters of `CRUDBase.get_multi`.
+
+Casting every column to a string and matching it with `ILIKE '%value%'` can't use any index, so each filter results in
+a sequential scan. The planner instead picks a predicate per column based on its type:
+
+- text columns are matched with `ILIKE` without a cast; with a `gin_trgm_ops` GIN index on the column Postgres can use
+  the trigram index for the infix match.
+- UUID, integer and boolean columns get an equality predicate when the value parses as such.
+- timestamp columns get a range predicate covering the given precision, e.g. `2021-10` matches the whole month.
+- `tsvector` columns (`tsv:value`) get a full text match with every word of the value as prefix, see
+  `server.db.search`. They are skipped for free text filters, the text columns they are generated from are matched.
+- everything else falls back to the original cast to string.
+
+For free text filters (no key) only the columns whose predicate can match the value are OR-ed together.
+
+The chosen plan is available via `FilterPlanner.plan` so it can be logged and checked. Filter values are bind
+parameters with fixed names (`filter_0`, `filter_1`, ..), so plans with the same `shape` produce the same SQL and a
+statement built for one plan can be executed with the `params` of another, see `server.crud.query_cache`.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+from uuid import UUID
+
+from sqlalchemy import Boolean, DateTime, Integer, String, and_, bindparam, cast, false, or_
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.inspection import inspect as sa_inspect
+from sqlalchemy.sql.elements import ColumnElement
+
+from server.db.search import prefix_tsquery, tsquery
+from server.types import strEnum
+
+
+class FilterStrategy(strEnum):
+    TRIGRAM = "trigram"
+    TEXT = "text"
+    UUID = "uuid"
+    INTEGER = "integer"
+    BOOLEAN = "boolean"
+    TIMESTAMP_RANGE = "timestamp_range"
+    FULL_TEXT = "full_text"
+    CAST = "cast"
+
+
+class FilterStep(NamedTuple):
+    column: str
+    value: str
+    strategy: FilterStrategy
+
+
+class FilterPlan(NamedTuple):
+    conditions: List[ColumnElement]
+    steps: List[FilterStep]
+    ignored: List[str]
+    # The structure of `conditions` without the values, and the values by bind parameter name
+    shape: Tuple[Tuple[Any, ...], ...]
+    params: Dict[str, Any]
+
+    def describe(self) -> List[str]:
+        return [f"{step.column}:{step.strategy}" for step in self.steps]
+
+
+TRUE_VALUES = ("yes", "y", "true", "1")
+FALSE_VALUES = ("no", "n", "false", "0")
+
+
+def _parse_uuid(value: str) -> Optional[UUID]:
+    try:
+        return UUID(value)
+    except ValueError:
+        return None
+
+
+def _parse_int(value: str) -> Optional[int]:
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _parse_bool(value: str) -> Optional[bool]:
+    if value.lower() in TRUE_VALUES:
+        return True
+    if value.lower() in FALSE_VALUES:
+        return False
+    return None
+
+
+def _next_month(dt: datetime) -> datetime:
+    return dt.replace(year=dt.year + 1, month=1) if dt.month == 12 else dt.replace(month=dt.month + 1)
+
+
+# (length, format, end of the range) for the partial timestamps a client can filter on
+TIMESTAMP_PRECISIONS: List[Tuple[int, str, Callable[[datetime], datetime]]] = [
+    (4, "%Y", lambda dt: dt.replace(year=dt.year + 1)),
+    (7, "%Y-%m", _next_month),
+    (10, "%Y-%m-%d", lambda dt: dt + timedelta(days=1)),
+    (13, "%Y-%m-%dT%H", lambda dt: dt + timedelta(hours=1)),
+    (16, "%Y-%m-%dT%H:%M", lambda dt: dt + timedelta(minutes=1)),
+    (19, "%Y-%m-%dT%H:%M:%S", lambda dt: dt + timedelta(seconds=1)),
+]
+
+
+def parse_timestamp_range(value: str) -> Optional[Tuple[datetime, datetime]]:
+    """Return the half open `[start, end)` range a (partial) ISO timestamp covers, naive timestamps are UTC."""
+    value = value.strip().replace(" ", "T")
+    for length, fmt, end_of_range in TIMESTAMP_PRECISIONS:
+        if len(value) == length:
+            try:
+                start = datetime.strptime(value, fmt).replace(tzinfo=timezone.utc)
+            except ValueError:
+                return None
+            return start, end_of_range(start)
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp, timestamp + timedelta(microseconds=1)
+
+
+def _column_strategy(column: Any, trigram_columns: Set[str]) -> FilterStrategy:
+    column_type = column.type
+    if isinstance(column_type, PG_UUID):
+        return FilterStrategy.UUID
+    if isinstance(column_type, TSVECTOR):
+        return FilterStrategy.FULL_TEXT
+    # TypeDecorators like `UtcTimestamp` are classified by their implementation
+    column_type = getattr(column_type, "impl", column_type)
+    if isinstance(column_type, String):
+        return FilterStrategy.TRIGRAM if column.name in trigram_columns else FilterStrategy.TEXT
+    if isinstance(column_type, Boolean):
+        return FilterStrategy.BOOLEAN
+    if isinstance(column_type, Integer):
+        return FilterStrategy.INTEGER
+    if isinstance(column_type, DateTime):
+        return FilterStrategy.TIMESTAMP_RANGE
+    return FilterStrategy.CAST
+
+
+def trigram_indexed_columns(table: Any) -> Set[str]:
+    """Return the names of the columns that have a `gin_trgm_ops` GIN index in the model definition."""
+    columns = set()
+    for index in table.indexes:
+        options = index.dialect_options["postgresql"]
+        if options["using"] != "gin":
+            continue
+        ops = options["ops"] or {}
+        columns |= {column.name for column in index.columns if ops.get(column.name) == "gin_trgm_ops"}
+    return columns
+
+
+class FilterPlanner:
+    def __init__(self, model: Any) -> None:
+        self.model = model
+        self.columns = sa_inspect(model).columns
+        trigram_columns = trigram_indexed_columns(model.__table__)
+        self.strategies: Dict[str, FilterStrategy] = {
+            key: _column_strategy(column, trigram_columns) for key, column in self.columns.items()
+        }
+
+    def _condition(
+        self, key: str, value: str, free_text: bool, params: Dict[str, Any]
+    ) -> Tuple[Optional[ColumnElement], FilterStrategy, Any]:
+        """Return the predicate for `key` matching `value`, the strategy used for it and the shape of the predicate.
+
+        The values are added to `params` under new names. When the value can't be parsed for a typed column the cast
+        to string is used for `key:value` filters. For free text filters the column is skipped (None) as it can't
+        contain the value.
+        """
+        column = self.columns[key]
+        strategy = self.strategies[key]
+        name = f"filter_{len(params)}"
+
+        def parameter(value: Any, type_: Any = None, suffix: str = "") -> Any:
+            params[name + suffix] = value
+            return bindparam(name + suffix, value, type_=type_)
+
+        if strategy in (FilterStrategy.TRIGRAM, FilterStrategy.TEXT):
+            return column.ilike(parameter("%" + value + "%")), strategy, None
+        if strategy == FilterStrategy.UUID:
+            uuid = _parse_uuid(value)
+            if uuid is not None:
+                return column == parameter(uuid, column.type), strategy, None
+        elif strategy == FilterStrategy.INTEGER:
+            number = _parse_int(value)
+            if number is not None:
+                return column == parameter(number, column.type), strategy, None
+        elif strategy == FilterStrategy.BOOLEAN:
+            boolean = _parse_bool(value)
+            if boolean is not None:
+                # `IS` only takes literals, the value is part of the shape
+                return column.is_(boolean), strategy, boolean
+        elif strategy == FilterStrategy.TIMESTAMP_RANGE:
+            timestamp_range = parse_timestamp_range(value)
+            if timestamp_range is not None:
+                start, end = timestamp_range
+                condition = and_(column >= parameter(start, column.type), column < parameter(end, column.type, "_end"))
+                return condition, strategy, None
+        elif strategy == FilterStrategy.FULL_TEXT:
+            if free_text:
+                return None, strategy, None
+            return column.op("@@")(tsquery(parameter(prefix_tsquery(value)))), strategy, None
+
+        if free_text and strategy != FilterStrategy.CAST:
+            return None, strategy, None
+        return cast(column, String).ilike(parameter("%" + value + "%")), FilterStrategy.CAST, None
+
+    def plan(self, filter_parameters: Optional[List[str]]) -> FilterPlan:
+        """Plan the filters: each filter parameter results in one condition, the conditions should be AND-ed."""
+        conditions = []
+        steps = []
+        ignored = []
+        shape = []
+        params: Dict[str, Any] = {}
+        for filter_parameter in filter_parameters or []:
+            key, *value = filter_parameter.split(":", 1)
+
+            # Use this branch if we detect a key value search (key:value) if it is just a single string (value)
+            # treat the key as the value
+            if len(value) > 0:
+                if key not in self.columns.keys():
+                    ignored.append(key)
+                    continue
+                condition, strategy, literal = self._condition(key, value[0], False, params)
+                conditions.append(condition)
+                steps.append(FilterStep(key, value[0], strategy))
+                shape.append(((key, strategy, literal),))
+            else:
+                column_conditions = []
+                column_shapes = []
+                for column_key in self.columns.keys():
+                    condition, strategy, literal = self._condition(column_key, key, True, params)
+                    if condition is not None:
+                        column_conditions.append(condition)
+                        steps.append(FilterStep(column_key, key, strategy))
+                        column_shapes.append((column_key, strategy, literal))
+                conditions.append(or_(*column_conditions) if column_conditions else false())
+                shape.append(tuple(column_shapes))
+        return FilterPlan(conditions, steps, ignored, tuple(shape), params)
@@ -0,0 +1,166 @@
+"""Keyset (cursor) pagination helpers for `CRUDBase.get_multi`.
+
+Offset pagination makes Postgres produce and throw away every skipped row. Keyset pagination instead seeks directly
+to the position after the last row of the previous page using the sort key values of that row. The primary key is
+always appended to the sort key as a tiebreaker so the ordering is total and no rows are skipped or repeated.
+
+A cursor is an opaque, url safe string that holds the sort key values of the row to seek from and the direction to
+seek in. Clients should never construct or inspect cursors themselves.
+"""
+
+import base64
+import binascii
+from datetime import datetime
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+from uuid import UUID
+
+import rapidjson
+from sqlalchemy import and_, bindparam, false, or_
+from sqlalchemy.sql.elements import ColumnElement
+
+NEXT = "next"
+PREV = "prev"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class SortKey(NamedTuple):
+    name: str
+    column: Any
+    desc: bool
+
+
+class Cursor(NamedTuple):
+    values: Dict[str, Any]
+    direction: str
+
+
+def _encode_value(value: Any) -> Any:
+    # Full precision is needed here: `server.utils.json` truncates timestamps to seconds which would make the seek skip
+    # rows that were created within the same second.
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    return value
+
+
+def _decode_value(column: Any, value: Any) -> Any:
+    if value is None:
+        return None
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        # TypeDecorators like `UtcTimestamp` don't always report a python type, their implementation does.
+        try:
+            python_type = getattr(column.type, "impl", column.type).python_type
+        except NotImplementedError:
+            return value
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is UUID:
+        return UUID(value)
+    return value
+
+
+def _row_value(row: Any, name: str) -> Any:
+    # Rows are ORM instances for the sync path and mappings for the `AsyncDatabase` path
+    return row[name] if isinstance(row, Mapping) else getattr(row, name)
+
+
+def encode_cursor(row: Any, sort_keys: Sequence[SortKey], direction: str = NEXT) -> str:
+    """Create an opaque cursor pointing at `row` for the given sort keys."""
+    payload = {"v": {key.name: _encode_value(_row_value(row, key.name)) for key in sort_keys}, "d": direction}
+    return base64.urlsafe_b64encode(rapidjson.dumps(payload).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_keys: Sequence[SortKey]) -> Cursor:
+    """Decode a cursor created by `encode_cursor` and convert its values back to the column types.
+
+    Raises:
+        InvalidCursor: when the cursor is malformed or was created for a different sort order.
+
+    """
+    try:
+        payload = rapidjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        values, direction = payload["v"], payload["d"]
+    except (binascii.Error, ValueError, TypeError, KeyError) as e:
+        raise InvalidCursor("Malformed cursor") from e
+
+    if direction not in (NEXT, PREV) or not isinstance(values, dict) or set(values) != {k.name for k in sort_keys}:
+        raise InvalidCursor("Cursor does not match the requested sort order")
+    try:
+        return Cursor({key.name: _decode_value(key.column, values[key.name]) for key in sort_keys}, direction)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor("Malformed cursor value") from e
+
+
+def _after(column: Any, value: Any, desc: bool) -> ColumnElement:
+    """Rows that come after `value` in the ordering of `column`.
+
+    Postgres sorts NULLs last for ascending and first for descending order, this is taken into account so nullable
+    sort columns don't lose rows.
+    """
+    if desc:
+        return column.isnot(None) if value is None else column < value
+    return false() if value is None else or_(column > value, column.is_(None))
+
+
+def _equal(column: Any, value: Any) -> ColumnElement:
+    return column.is_(None) if value is None else column == value
+
+
+def _seek_value(index: int, key: SortKey, cursor: Cursor) -> Any:
+    value = cursor.values[key.name]
+    return None if value is None else bindparam(f"cursor_{index}", value, type_=key.column.type)
+
+
+def seek_condition(sort_keys: Sequence[SortKey], cursor: Cursor) -> ColumnElement:
+    """Build the lexicographic `(k1, k2, ..) > (v1, v2, ..)` condition, honouring per key sort direction.
+
+    For a `prev` cursor the sort directions are flipped: the caller is expected to order on the flipped keys as well and
+    reverse the fetched rows afterwards. The values are bind parameters named as in `seek_params`.
+    """
+    flip = cursor.direction == PREV
+    values = [_seek_value(i, key, cursor) for i, key in enumerate(sort_keys)]
+    clauses = []
+    for i, key in enumerate(sort_keys):
+        equal_prefix = [_equal(k.column, value) for k, value in zip(sort_keys[:i], values)]
+        clauses.append(and_(*equal_prefix, _after(key.column, values[i], key.desc != flip)))
+    return or_(*clauses)
+
+
+def seek_shape(sort_keys: Sequence[SortKey], cursor: Cursor) -> Tuple[Any, ...]:
+    """What determines the SQL of `seek_condition` apart from the sort keys: the direction and which values are NULL."""
+    return (cursor.direction, *(cursor.values[key.name] is None for key in sort_keys))
+
+
+def seek_params(sort_keys: Sequence[SortKey], cursor: Cursor) -> Dict[str, Any]:
+    return {
+        f"cursor_{i}": cursor.values[key.name] for i, key in enumerate(sort_keys) if cursor.values[key.name] is not None
+    }
+
+
+def order_by_clauses(sort_keys: Sequence[SortKey], flip: bool = False) -> List[ColumnElement]:
+    return [key.column.desc() if key.desc != flip else key.column.asc() for key in sort_keys]
+
+
+def page_cursors(
+    rows: Sequence[Any], sort_keys: Sequence[SortKey], limit: int, cursor: Optional[Cursor]
+) -> Tuple[Optional[str], Optional[str]]:
+    """Return the (next, prev) cursors for a fetched page.
+
+    A next cursor is only handed out when the page is full, a prev cursor only when the page itself was reached with a
+    cursor. Pages fetched backwards (with a `prev` cursor) always have a next page: the page the client came from.
+    The rows are expected in presentation order, e.g. already reversed for a backwards fetch.
+    """
+    if not rows:
+        return None, None
+    backwards = cursor is not None and cursor.direction == PREV
+    has_next = backwards or (bool(limit) and len(rows) >= limit)
+    has_prev = cursor is not None and (not backwards or len(rows) >= limit)
+    next_cursor = encode_cursor(rows[-1], sort_keys, NEXT) if has_next else None
+    prev_cursor = encode_cursor(rows[0], sort_keys, PREV) if has_prev else None
+    return next_cursor, prev_cursor
@@ -0,0 +1,78 @@
+"""Query shape cache for the list queries of `CRUDBase.get_multi`.
+
+SQLAlchemy 1.3 builds and compiles the SQL of a query again on every execution, which takes more CPU than fetching a
+page of rows. Most requests share a handful of query *shapes* though: the model, the selected columns, the columns and
+strategies of the filters, the sort keys and the pagination mode. All values (filter values, cursor values, offset and
+limit) are bind parameters with fixed names, so the statements of a shape are built once, kept in an LRU and executed
+with the values of each request as parameters. Executions go through a shared `compiled_cache`, which makes SQLAlchemy
+compile each cached statement only once per dialect.
+
+SELECTs are marked with the `prepare` execution option, with `DATABASE_PREPARED_STATEMENTS` these are also prepared
+server side, see `server.db.prepared`.
+"""
+
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable, Optional, TypeVar
+
+from sqlalchemy.engine import ResultProxy
+from sqlalchemy.sql.expression import Executable, Select
+from sqlalchemy.util import LRUCache
+
+from server.db import db
+from server.metrics import cache_access
+from server.settings import app_settings
+
+T = TypeVar("T")
+
+
+class QueryCache:
+    def __init__(self, size: Callable[[], int]) -> None:
+        self.size = size
+        self._statements: Optional[LRUCache] = None
+        self._compiled: Optional[LRUCache] = None
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.size() > 0
+
+    def _caches(self) -> None:
+        with self._lock:
+            if self._statements is None:
+                self._statements = LRUCache(self.size())
+                # A shape has a few statements (page, count, explain), each compiled per dialect
+                self._compiled = LRUCache(self.size() * 4)
+
+    def statements(self, key: Hashable, build: Callable[[], T]) -> T:
+        """Return the statements cached for the shape `key`, `build` them on a miss."""
+        if not self.enabled:
+            return build()
+        if self._statements is None:
+            self._caches()
+        statements = self._statements.get(key)  # type: ignore
+        cache_access("query_statements", statements is not None)
+        if statements is None:
+            statements = self._statements[key] = build()  # type: ignore
+        return statements
+
+    def execute(self, statement: Executable, params: Dict[str, Any]) -> ResultProxy:
+        """Execute a cached `statement` with `params` on the connection of the current session."""
+        session = db.session
+        if session.autoflush:
+            session.flush()
+        # The clause lets the session route the statement, e.g. to a replica
+        connection = session.connection(clause=statement)
+        if self.enabled:
+            # Only SELECTs can be prepared, e.g. not the EXPLAIN of the estimated count
+            connection = connection.execution_options(
+                compiled_cache=self._compiled, prepare=isinstance(statement, Select)
+            )
+        return connection.execute(statement, params)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._statements = None
+            self._compiled = None
+
+
+query_cache = QueryCache(lambda: app_settings.QUERY_CACHE_SIZE)
@@ -0,0 +1,82 @@
+"""Full text search across the searchable tables, ranked with highlighted snippets.
+
+Each table is searched on its `tsv` column (GIN indexed, see `server.db.search`) and ranked with `ts_rank_cd`, the
+title column has weight A and the description weight B. The hits of all tables are combined with `UNION ALL` and
+limited before `ts_headline` runs: highlighting re-parses the text of a row, so it is only done for the returned rows.
+"""
+
+from functools import partial
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, desc, func, literal_column, select, union_all
+from sqlalchemy.sql.expression import Select
+
+from server.crud.query_cache import query_cache
+from server.db.models import MapsTable, ProductsTable, ProductTypesTable
+from server.db.search import prefix_tsquery, regconfig, tsquery
+
+SNIPPET_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxWords=25, MinWords=10, MaxFragments=2"
+TITLE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, HighlightAll=true"
+
+
+class SearchTarget(NamedTuple):
+    name: str
+    model: Any
+    title: str
+    body: str
+
+
+class CRUDSearch:
+    def __init__(self, targets: Sequence[SearchTarget]) -> None:
+        self.targets = {target.name: target for target in targets}
+
+    def _statement(self, names: Tuple[str, ...]) -> Select:
+        query = tsquery(bindparam("query"))
+        selects = []
+        for name in names:
+            target = self.targets[name]
+            table = target.model.__table__
+            selects.append(
+                select(
+                    [
+                        literal_column(f"'{name}'").label("type"),
+                        table.c.id,
+                        table.c[target.title].label("title"),
+                        table.c[target.body].label("body"),
+                        func.ts_rank_cd(table.c.tsv, query).label("rank"),
+                    ]
+                ).where(table.c.tsv.op("@@")(query))
+            )
+        hits = union_all(*selects).order_by(desc("rank"), "type", "id").limit(bindparam("limit")).alias("hits")
+        return select(
+            [
+                hits.c.type,
+                hits.c.id,
+                hits.c.title,
+                func.ts_headline(regconfig(), hits.c.title, query, TITLE_OPTIONS).label("title_highlight"),
+                func.ts_headline(regconfig(), func.coalesce(hits.c.body, ""), query, SNIPPET_OPTIONS).label("snippet"),
+                hits.c.rank,
+            ]
+        ).order_by(hits.c.rank.desc(), hits.c.type, hits.c.id)
+
+    def search(self, text: str, types: Optional[Sequence[str]] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """Search `text` in the tables named in `types` (all by default), best matches first.
+
+        Every word of `text` has to match the start of a word in the title or the description. Returns the type (the
+        table name), id, title, highlighted title, a snippet with the matches highlighted and the rank of the hits.
+        """
+        terms = prefix_tsquery(text)
+        names = tuple(name for name in self.targets if types is None or name in types)
+        if not terms or not names:
+            return []
+        statement = query_cache.statements(("search", names), partial(self._statement, names))
+        return [dict(row) for row in query_cache.execute(statement, {"query": terms, "limit": limit})]
+
+
+search_crud = CRUDSearch(
+    [
+        SearchTarget("products", ProductsTable, "name", "description"),
+        SearchTarget("product_types", ProductTypesTable, "product_type", "description"),
+        SearchTarget("maps", MapsTable, "name", "description"),
+    ]
+)
@@ -12,12 +12,26 @@
 # limitations under the License.
 
 
-from server.db.database import Database, transactional
+from server.db.database import AsyncDatabase, Database, async_engine_arguments, engine_arguments, transactional
 from server.db.models import ProductsTable  # noqa: F401
 from server.db.models import MapsTable, ProductTypesTable, UtcTimestamp, UtcTimestampException
 from server.settings import app_settings
 
-db = Database(app_settings.DATABASE_URI)
+db = Database(
+    app_settings.DATABASE_URI,
+    replica_urls=app_settings.DATABASE_REPLICA_URIS,
+    replica_max_lag=app_settings.REPLICA_MAX_LAG,
+    replica_check_interval=app_settings.REPLICA_CHECK_INTERVAL,
+    engine_arguments=engine_arguments(app_settings.RUNNING_ON_LAMBDA, app_settings.DATABASE_PGBOUNCER),
+    prepared_statements=app_settings.DATABASE_PREPARED_STATEMENTS and not app_settings.DATABASE_PGBOUNCER,
+    # The page and count SELECTs of every cached query shape
+    max_prepared_statements=max(2 * app_settings.QUERY_CACHE_SIZE, 1),
+    instrumentation=app_settings.SQL_INSTRUMENTATION,
+    n_plus_one_threshold=app_settings.SQL_N_PLUS_ONE_THRESHOLD,
+)
+async_db = AsyncDatabase(
+    app_settings.DATABASE_URI, engine_arguments=async_engine_arguments(app_settings.DATABASE_PGBOUNCER)
+)
 
 __all__ = [
     "transactional",
@@ -26,4 +40,5 @@ __all__ = [
     "MapsTable" "UtcTimestamp",
     "UtcTimestampException",
     "db",
+    "async_db",
 ]
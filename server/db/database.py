@@ -11,35 +11,67 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, contextmanager, nullcontext
 from contextvars import ContextVar
-from typing import Any, Callable, ClassVar, Dict, Generator, Iterator, List, Optional, Set, cast
+from functools import cached_property
+from typing import (
+    Any,
+    AsyncGenerator,
+    Callable,
+    ClassVar,
+    Dict,
+    FrozenSet,
+    Generator,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    cast,
+)
 from uuid import uuid4
 
 import structlog
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, desc, event, func
 from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import as_declarative
 from sqlalchemy.ext.declarative.api import DeclarativeMeta
-from sqlalchemy.orm import Query, Session, scoped_session, sessionmaker
+from sqlalchemy.orm import Mapper, Query, Session, scoped_session, sessionmaker
+from sqlalchemy.orm.base import instance_state
 from sqlalchemy.orm.state import InstanceState
 from sqlalchemy.sql.schema import MetaData
-from sqlalchemy_searchable import SearchQueryMixin
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-from starlette.requests import Request
-from starlette.responses import Response
-from starlette.types import ASGIApp
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from structlog.stdlib import BoundLogger
 
+from server.db.instrumentation import current_query_stats, enable_instrumentation, query_stats_scope
+from server.db.prepared import MAX_PREPARED_STATEMENTS, enable_prepared_statements
+from server.db.routing import ReplicaRouter, RoutingScope, parse_lsn
+from server.db.search import SEARCH_REGCONFIG, prefix_tsquery, tsquery
 from server.utils.json import json_dumps, json_loads
 
 logger = structlog.get_logger(__name__)
 
 
-class SearchQuery(Query, SearchQueryMixin):
+class SearchQuery(Query):
     """Custom Query class to have search() property."""
 
-    pass
+    def search(
+        self, search_query: str, vector: Any = None, regconfig: str = SEARCH_REGCONFIG, sort: bool = False
+    ) -> "SearchQuery":
+        """Filter on full text `vector`, by default the `tsv` column of the queried model, every word is a prefix."""
+        terms = prefix_tsquery(search_query)
+        if not terms:
+            return self
+        if vector is None:
+            vector = self._entities[0].entity_zero.class_.tsv
+        query = tsquery(terms, regconfig)
+        result = self.filter(vector.op("@@")(query))
+        return result.order_by(desc(func.ts_rank_cd(vector, query))) if sort else result
 
 
 class NoSessionError(RuntimeError):
@@ -60,6 +92,35 @@ class BaseModelMeta(DeclarativeMeta):
             raise NoSessionError("Cant get session. Please, call BaseModel.set_query() first")
 
 
+class JsonPlan(NamedTuple):
+    """The keys `_Base.__json__` considers for a mapped class, computed once per mapper."""
+
+    columns: FrozenSet[str]
+    relationships: FrozenSet[str]
+    include: FrozenSet[str]
+    exclude: FrozenSet[str]
+    # Columns and relationships without the excluded keys, in mapper order
+    keys: Tuple[str, ...]
+
+
+def json_plan(cls: Any) -> JsonPlan:
+    plan = cls.__dict__.get("_json_plan")
+    if plan is None:
+        mapper = sa_inspect(cls)
+        columns = mapper.column_attrs.keys()
+        relationships = mapper.relationships.keys()
+        exclude = frozenset(cls._json_exclude)
+        plan = JsonPlan(
+            columns=frozenset(columns),
+            relationships=frozenset(relationships),
+            include=frozenset(cls._json_include),
+            exclude=exclude,
+            keys=tuple(key for key in [*columns, *relationships] if key not in exclude),
+        )
+        cls._json_plan = plan
+    return plan
+
+
 @as_declarative(metaclass=BaseModelMeta)
 class _Base:
     """SQLAlchemy base class."""
@@ -70,14 +131,21 @@ class _Base:
     _json_exclude: List = []
 
     def __json__(self, excluded_keys: Set = set()) -> Dict:  # noqa: B006
-        ins = sa_inspect(self)
+        plan = json_plan(type(self))
+        ins = instance_state(self)
+        loaded = ins.dict
+
+        # Fast path for the common case: a loaded object in a session without extra includes or excludes. This is the
+        # same as the full algorithm below: only the loaded columns and relationships minus the excluded keys.
+        if ins.persistent and not ins.expired and not plan.include and not excluded_keys:
+            return {key: loaded[key] for key in plan.keys if key in loaded}
 
-        columns = set(ins.mapper.column_attrs.keys())
-        relationships = set(ins.mapper.relationships.keys())
+        columns = plan.columns
+        relationships = plan.relationships
         unloaded = ins.unloaded
         expired = ins.expired_attributes
-        include = set(self._json_include)
-        exclude = set(self._json_exclude) | set(excluded_keys)
+        include = plan.include
+        exclude = plan.exclude | set(excluded_keys)
 
         # This set of keys determines which fields will be present in
         # the resulting JSON object.
@@ -129,6 +197,12 @@ class _Base:
         return {key: getattr(self, key) for key in keys}
 
 
+@event.listens_for(_Base, "mapper_configured", propagate=True)
+def _compute_json_plan(mapper: Mapper, cls: Any) -> None:
+    cls._json_plan = None
+    json_plan(cls)
+
+
 class BaseModel(_Base):
     """
     Separate BaseModel class to be able to include mixins and to Fix typing.
@@ -155,7 +229,21 @@ class BaseModel(_Base):
 
 
 class WrappedSession(Session):
-    """This Session class allows us to disable commit during steps."""
+    """This Session class allows us to disable commit during steps.
+
+    With a ``ReplicaRouter`` read only statements are executed on a replica, see ``server.db.routing``.
+    """
+
+    def __init__(self, *args: Any, router: Optional[ReplicaRouter] = None, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.router = router
+
+    def get_bind(self, mapper: Any = None, clause: Any = None) -> Any:
+        if self.router is not None:
+            replica = self.router.get_bind(self, clause)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper, clause)
 
     def commit(self) -> None:
         if self.info.get("disabled", False):
@@ -165,6 +253,8 @@ class WrappedSession(Session):
             )
         else:
             super().commit()
+            if self.router is not None:
+                self.router.after_commit(self)
 
 
 ENGINE_ARGUMENTS = {
@@ -174,6 +264,50 @@ ENGINE_ARGUMENTS = {
     "json_serializer": json_dumps,
     "json_deserializer": json_loads,
 }
+# A Lambda container handles one invocation at a time and is frozen in between. A single connection is kept for the
+# warm invocations that follow instead of a pool per container that exhausts `max_connections` at scale. Pre-pinging
+# would cost a round trip per invocation; recycling replaces connections the server may have dropped in the meantime
+# without one.
+LAMBDA_ENGINE_ARGUMENTS = {
+    **ENGINE_ARGUMENTS,
+    "pool_pre_ping": False,
+    "pool_size": 1,
+    "max_overflow": 0,
+    "pool_recycle": 300,
+}
+ASYNC_ENGINE_ARGUMENTS = {
+    "timeout": 10,
+    "server_settings": {"timezone": "UTC"},
+    "min_size": 1,
+    "max_size": 60,
+}
+
+
+def engine_arguments(running_on_lambda: bool = False, pgbouncer: bool = False) -> Dict[str, Any]:
+    """Return the ``create_engine`` arguments for the runtime.
+
+    PgBouncer in transaction mode rejects the ``options`` startup parameter, so the connection time zone is left to the
+    server configuration. ``UtcTimestamp`` columns are UTC regardless of it.
+    """
+    arguments = LAMBDA_ENGINE_ARGUMENTS if running_on_lambda else ENGINE_ARGUMENTS
+    if pgbouncer:
+        connect_args = {key: value for key, value in arguments["connect_args"].items() if key != "options"}
+        arguments = {**arguments, "connect_args": connect_args}
+    return arguments
+
+
+def async_engine_arguments(pgbouncer: bool = False) -> Dict[str, Any]:
+    """Return the ``AsyncDatabase`` pool options.
+
+    asyncpg prepares every statement on its connection, which breaks when PgBouncer hands out another server connection
+    for the next transaction. With PgBouncer the statement cache and the startup parameters are disabled.
+    """
+    if not pgbouncer:
+        return ASYNC_ENGINE_ARGUMENTS
+    options = {key: value for key, value in ASYNC_ENGINE_ARGUMENTS.items() if key != "server_settings"}
+    return {**options, "statement_cache_size": 0}
+
+
 SESSION_ARGUMENTS = {
     "class_": WrappedSession,
     "autocommit": False,
@@ -193,14 +327,61 @@ class Database:
     easily start a new session or get the existing one using the scoped_session mechanics.
     """
 
-    def __init__(self, db_url: str) -> None:
+    def __init__(
+        self,
+        db_url: str,
+        replica_urls: Sequence[str] = (),
+        replica_max_lag: float = 5.0,
+        replica_check_interval: float = 1.0,
+        engine_arguments: Dict[str, Any] = ENGINE_ARGUMENTS,
+        prepared_statements: bool = False,
+        max_prepared_statements: int = MAX_PREPARED_STATEMENTS,
+        instrumentation: bool = False,
+        n_plus_one_threshold: int = 0,
+    ) -> None:
         self.request_context: ContextVar[str] = ContextVar("request_context", default="")
-        self.engine = create_engine(db_url, **ENGINE_ARGUMENTS)
-        self.session_factory = sessionmaker(bind=self.engine, **SESSION_ARGUMENTS)
-
-        self.scoped_session = scoped_session(self.session_factory, self._scopefunc)
+        self.db_url = db_url
+        self.replica_urls = replica_urls
+        self.replica_max_lag = replica_max_lag
+        self.replica_check_interval = replica_check_interval
+        self.engine_arguments = engine_arguments
+        self.prepared_statements = prepared_statements
+        self.max_prepared_statements = max_prepared_statements
+        self.instrumentation = instrumentation
+        self.n_plus_one_threshold = n_plus_one_threshold
+
+        self.scoped_session = scoped_session(self._create_session, self._scopefunc)
         BaseModel.set_query(cast(SearchQuery, self.scoped_session.query_property()))
 
+    # The engines (and with them the DBAPI driver) are only created on first use, which keeps them out of the import
+    # time of `server.main`: on Lambda that is part of every cold start.
+    def _create_engine(self, db_url: str) -> Engine:
+        engine = create_engine(db_url, **self.engine_arguments)
+        if self.prepared_statements:
+            enable_prepared_statements(engine, self.max_prepared_statements)
+        return enable_instrumentation(engine) if self.instrumentation else engine
+
+    @cached_property
+    def engine(self) -> Engine:
+        return self._create_engine(self.db_url)
+
+    @cached_property
+    def router(self) -> Optional[ReplicaRouter]:
+        if not self.replica_urls:
+            return None
+        return ReplicaRouter(
+            [self._create_engine(url) for url in self.replica_urls],
+            max_lag=self.replica_max_lag,
+            check_interval=self.replica_check_interval,
+        )
+
+    @cached_property
+    def session_factory(self) -> sessionmaker:
+        return sessionmaker(bind=self.engine, router=self.router, **SESSION_ARGUMENTS)
+
+    def _create_session(self, **kwargs: Any) -> WrappedSession:
+        return self.session_factory(**kwargs)
+
     def _scopefunc(self) -> Optional[str]:
         scope_str = self.request_context.get()
         return scope_str
@@ -210,32 +391,154 @@ class Database:
         return self.scoped_session()
 
     @contextmanager
-    def database_scope(self, **kwargs: Any) -> Generator["Database", None, None]:
+    def database_scope(
+        self, read_only: bool = False, min_lsn: Optional[int] = None, **kwargs: Any
+    ) -> Generator["Database", None, None]:
         """Create a new database session (scope).
 
         This creates a new database session to handle all the database connection from a single scope (request or workflow).
         This method should typically only been called in request middleware or at the start of workflows.
 
+        The session itself is created lazily on the first ``db.session`` access, so a scope that never touches the
+        database costs nothing. Session kw args need to be applied on creation, with those the session is created
+        right away.
+
         Args:
+            read_only: Allow routing the ``SELECT`` statements of this scope to a replica (when configured).
+            min_lsn: Only use replicas that replayed the WAL up to this position.
             ``**kwargs``: Optional session kw args for this session
+
+        With ``instrumentation`` the statements of the scope are counted and timed, see ``server.db.instrumentation``.
         """
+        routing = self.router.routing_scope(read_only, min_lsn) if self.router is not None else nullcontext()
+        stats = query_stats_scope(self.n_plus_one_threshold) if self.instrumentation else nullcontext()
         token = self.request_context.set(str(uuid4()))
-        self.scoped_session(**kwargs)
-        yield self
-        self.scoped_session.remove()
-        self.request_context.reset(token)
+        try:
+            with routing, stats:
+                if kwargs:
+                    self.scoped_session(**kwargs)
+                yield self
+        finally:
+            self.scoped_session.remove()
+            self.request_context.reset(token)
+
+
+class AsyncDatabase:
+    """Async counterpart of ``Database`` for read heavy endpoints.
+
+    SQLAlchemy 1.3 has no asyncio support, so this uses the ``databases`` package (asyncpg) which executes SQLAlchemy
+    Core statements: rows are mappings instead of ORM instances. The connection pool is only created by ``connect()``
+    and ``databases`` is only imported then, so nothing changes as long as the ``ASYNC_DATABASE`` setting is off.
+
+    Scoping follows ``Database``: ``database_scope()`` binds a single connection to the current context and ``session``
+    returns it. Outside a scope ``session`` returns the pool itself, so each statement gets a connection of its own.
+    """
+
+    def __init__(self, db_url: str, engine_arguments: Dict[str, Any] = ASYNC_ENGINE_ARGUMENTS, **options: Any) -> None:
+        self.db_url = db_url
+        self.options = {**engine_arguments, **options}
+        self.request_context: ContextVar[Optional[Any]] = ContextVar("async_request_context", default=None)
+        self.database: Optional[Any] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self.database is not None and self.database.is_connected
+
+    async def connect(self) -> None:
+        from databases import Database as AsyncPool
+
+        if self.database is None:
+            self.database = AsyncPool(self.db_url, **self.options)
+        await self.database.connect()
 
+    async def disconnect(self) -> None:
+        if self.database is not None:
+            await self.database.disconnect()
+
+    @property
+    def session(self) -> Any:
+        connection = self.request_context.get()
+        if connection is not None:
+            return connection
+        if not self.is_connected:
+            raise NoSessionError("Async database is not connected. Please, call AsyncDatabase.connect() first")
+        return self.database
+
+    @asynccontextmanager
+    async def database_scope(self) -> AsyncGenerator["AsyncDatabase", None]:
+        """Create a new async database scope that uses one connection for all statements within it."""
+        if not self.is_connected:
+            raise NoSessionError("Async database is not connected. Please, call AsyncDatabase.connect() first")
+        async with self.database.connection() as connection:  # type: ignore
+            token = self.request_context.set(connection)
+            try:
+                yield self
+            finally:
+                self.request_context.reset(token)
+
+
+class DBSessionMiddleware:
+    """Run each HTTP and websocket request in its own database scope.
+
+    This is a plain ASGI middleware instead of a ``BaseHTTPMiddleware``: that one runs the endpoint in a separate task
+    with a memory stream per request and buffers streaming responses. As ``database_scope`` creates the session lazily,
+    requests that don't use the database (docs, CORS preflights, health checks) don't get a session either.
+
+    With replicas configured, requests with a safe method get a read only scope. After a commit with writes the
+    response sets the ``LSN_COOKIE`` so the next requests of the same client only read from replicas that caught up.
+
+    With instrumentation enabled responses get a ``Server-Timing`` header with the query count, the database time and
+    the duration of the slowest statement of the request.
+    """
 
-class DBSessionMiddleware(BaseHTTPMiddleware):
     def __init__(self, app: ASGIApp, database: Database, commit_on_exit: bool = False):
-        super().__init__(app)
+        self.app = app
         self.commit_on_exit = commit_on_exit
         self.database = database
 
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
-        with self.database.database_scope():
-            response = await call_next(request)
-        return response
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        router = self.database.router
+        if router is None:
+            scope_arguments: Dict[str, Any] = {}
+        else:
+            read_only = scope["type"] == "http" and scope["method"] in SAFE_METHODS
+            scope_arguments = {"read_only": read_only, "min_lsn": _min_lsn(scope)}
+
+        with self.database.database_scope(**scope_arguments):
+            routing = cast(RoutingScope, router.scope.get()) if router is not None else None
+            stats = current_query_stats()
+
+            async def send_with_headers(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    if stats is not None and stats.count:
+                        MutableHeaders(scope=message).append("server-timing", stats.server_timing())
+                    if routing is not None and routing.commit_lsn is not None:
+                        MutableHeaders(scope=message).append(
+                            "set-cookie",
+                            f"{LSN_COOKIE}={routing.commit_lsn}; Max-Age={LSN_COOKIE_MAX_AGE}; Path=/; HttpOnly",
+                        )
+                await send(message)
+
+            await self.app(scope, receive, send_with_headers)
+
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+LSN_COOKIE = "db_lsn"
+# Replicas normally catch up within seconds, after this the cookie is of no use anymore
+LSN_COOKIE_MAX_AGE = 60
+
+
+def _min_lsn(scope: Scope) -> Optional[int]:
+    lsn = HTTPConnection(scope).cookies.get(LSN_COOKIE)
+    if lsn is None:
+        return None
+    try:
+        return parse_lsn(lsn)
+    except ValueError:
+        return None
 
 
 @contextmanager
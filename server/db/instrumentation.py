@@ -0,0 +1,130 @@
+"""Per scope SQL statistics: query count, database time and the slowest statement.
+
+The statements executed on an instrumented engine are timed with the `before_cursor_execute` and
+`after_cursor_execute` events and counted in the `QueryStats` of the current `Database.database_scope`. Requests get
+them in a `Server-Timing` header (see `DBSessionMiddleware`) and every log line within the scope gets them through the
+`add_query_stats` structlog processor, with the text of the slowest statement cut to `SLOWEST_STATEMENT_LENGTH`.
+
+The same statement (with its bind parameters as placeholders) executed more than `SQL_N_PLUS_ONE_THRESHOLD` times in
+one scope usually means a lazy loaded relationship in a loop, that is logged as a warning once per statement.
+
+`capture_queries` collects the statements of all scopes, also those of requests handled in another thread like with
+the `TestClient`, e.g. to check the number of queries of an endpoint in a test.
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import structlog
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, Engine
+
+logger = structlog.get_logger(__name__)
+
+QUERY_START = "query_start"
+# Characters of the slowest statement added to log lines, enough to recognize it without flooding the log
+SLOWEST_STATEMENT_LENGTH = 200
+
+
+class QueryStats:
+    def __init__(self, n_plus_one_threshold: int = 0) -> None:
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.count = 0
+        self.duration = 0.0
+        self.slowest: Optional[Tuple[float, str]] = None
+        self.statements: Counter = Counter()
+
+    def record(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.duration += duration
+        if self.slowest is None or duration > self.slowest[0]:
+            self.slowest = (duration, statement)
+        self.statements[statement] += 1
+        if self.n_plus_one_threshold and self.statements[statement] == self.n_plus_one_threshold + 1:
+            logger.warning(
+                "Possible N+1 query: statement repeated in one database scope",
+                statement=statement,
+                threshold=self.n_plus_one_threshold,
+            )
+
+    def server_timing(self) -> str:
+        """The `Server-Timing` header value, durations in milliseconds."""
+        timing = f'db;dur={self.duration * 1000:.2f};desc="{self.count} queries"'
+        if self.slowest is not None:
+            timing += f", db-slowest;dur={self.slowest[0] * 1000:.2f}"
+        return timing
+
+    def describe(self) -> str:
+        return "\n".join(f"{count}x {statement}" for statement, count in self.statements.most_common())
+
+
+_scope_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+_captures: List[QueryStats] = []
+
+
+def current_query_stats() -> Optional[QueryStats]:
+    return _scope_stats.get()
+
+
+@contextmanager
+def query_stats_scope(n_plus_one_threshold: int = 0) -> Iterator[QueryStats]:
+    stats = QueryStats(n_plus_one_threshold)
+    token = _scope_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _scope_stats.reset(token)
+
+
+@contextmanager
+def capture_queries() -> Iterator[QueryStats]:
+    """Collect the statements executed on instrumented engines in any scope and thread while the block runs."""
+    stats = QueryStats()
+    _captures.append(stats)
+    try:
+        yield stats
+    finally:
+        _captures.remove(stats)
+
+
+def _before_cursor_execute(
+    connection: Connection, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool
+) -> None:
+    # Statements on a connection run one after another, a failed one is simply overwritten by the next
+    connection.info[QUERY_START] = perf_counter()
+
+
+def _after_cursor_execute(
+    connection: Connection, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool
+) -> None:
+    duration = perf_counter() - connection.info.pop(QUERY_START)
+    stats = _scope_stats.get()
+    if stats is not None:
+        stats.record(statement, duration)
+    for capture in _captures:
+        capture.record(statement, duration)
+
+
+def enable_instrumentation(engine: Engine) -> Engine:
+    """Count and time the statements executed on `engine` in the `QueryStats` of the current scope."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    return engine
+
+
+def add_query_stats(logger: Any, method_name: str, event_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """structlog processor that adds the query count, database time and slowest statement of the current scope."""
+    stats = _scope_stats.get()
+    if stats is not None and stats.count:
+        event_dict.setdefault("db_queries", stats.count)
+        event_dict.setdefault("db_time_ms", round(stats.duration * 1000, 2))
+        if stats.slowest is not None:
+            duration, statement = stats.slowest
+            event_dict.setdefault("db_slowest_ms", round(duration * 1000, 2))
+            if len(statement) > SLOWEST_STATEMENT_LENGTH:
+                statement = statement[: SLOWEST_STATEMENT_LENGTH - 3] + "..."
+            event_dict.setdefault("db_slowest", statement)
+    return event_dict
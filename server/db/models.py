@@ -16,17 +16,17 @@ from __future__ import annotations
 from datetime import datetime, timezone
 from typing import Optional
 
-import pytz
 import sqlalchemy
 import structlog
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, TypeDecorator, text
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Boolean, Column, Computed, ForeignKey, Index, Integer, String, Text, TypeDecorator, text
+from sqlalchemy.dialects.postgresql import TSVECTOR, UUID
 from sqlalchemy.engine import Dialect
 from sqlalchemy.exc import DontWrapMixin
-from sqlalchemy.orm import relationship
-from sqlalchemy_utils import UUIDType
+from sqlalchemy.orm import deferred, relationship
+from sqlalchemy.orm.properties import ColumnProperty
 
 from server.db.database import BaseModel
+from server.db.search import SEARCH_REGCONFIG
 from server.utils.date_utils import nowtz
 
 logger = structlog.get_logger(__name__)
@@ -35,6 +35,33 @@ TAG_LENGTH = 20
 STATUS_LENGTH = 255
 
 
+def trigram_index(table_name: str, column_name: str) -> Index:
+    """GIN index with `gin_trgm_ops` so `ILIKE '%value%'` filters on the column can use an index."""
+    return Index(
+        f"ix_{table_name}_{column_name}_trgm",
+        column_name,
+        postgresql_using="gin",
+        postgresql_ops={column_name: "gin_trgm_ops"},
+    )
+
+
+def search_vector(**weights: str) -> ColumnProperty:
+    """Generated `tsv` column of the text columns in `weights` (name to weight "A" to "D"), see `server.db.search`.
+
+    The column is deferred, it is only needed in the `WHERE` clause of searches.
+    """
+    vectors = " || ".join(
+        f"setweight(to_tsvector('{SEARCH_REGCONFIG}', coalesce({column_name}, '')), '{weight}')"
+        for column_name, weight in weights.items()
+    )
+    return deferred(Column("tsv", TSVECTOR, Computed(vectors, persisted=True)))
+
+
+def search_index(table_name: str) -> Index:
+    """GIN index on the `tsv` column of `search_vector`."""
+    return Index(f"ix_{table_name}_tsv", "tsv", postgresql_using="gin")
+
+
 class UtcTimestampException(Exception, DontWrapMixin):
     pass
 
@@ -71,20 +98,20 @@ class RolesUsersTabke(BaseModel):
 class RolesTable(BaseModel):
     __tablename__ = "roles"
 
-    id = Column(UUIDType, server_default=text("uuid_generate_v4()"), primary_key=True)
+    id = Column(UUID(as_uuid=True), server_default=text("uuid_generate_v4()"), primary_key=True)
     name = Column(String(255), nullable=False, unique=True)
     created_at = Column(UtcTimestamp, nullable=False, server_default=text("current_timestamp()"))
     updated_at = Column(
         UtcTimestamp,
-        default=datetime.now(tz=pytz.utc),
-        onupdate=datetime.now(tz=pytz.utc),
+        default=datetime.now(tz=timezone.utc),
+        onupdate=datetime.now(tz=timezone.utc),
     )
 
 
 class UsersTable(BaseModel):
     __tablename__ = "users"
 
-    id = Column(UUIDType, server_default=text("uuid_generate_v4()"), primary_key=True)
+    id = Column(UUID(as_uuid=True), server_default=text("uuid_generate_v4()"), primary_key=True)
     username = Column(String(32), nullable=False, unique=True)
     email = Column(String(255), unique=True, index=True, nullable=False)
     hashed_password = Column(String(255), nullable=False)
@@ -97,30 +124,44 @@ class UsersTable(BaseModel):
         onupdate=nowtz,
         nullable=False,
     )
-    maps = relationship("MapsTable", lazy="joined")
-    roles = relationship("RolesTable", secondary="roles_users", lazy="joined")
+    # Loaded per query, see `UserProfile` in `server.crud.crud_user`
+    maps = relationship("MapsTable")
+    roles = relationship("RolesTable", secondary="roles_users")
 
 
 class ProductsTable(BaseModel):
     __tablename__ = "products"
+    __table_args__ = (
+        trigram_index("products", "name"),
+        trigram_index("products", "description"),
+        search_index("products"),
+    )
 
-    id = Column(UUIDType, server_default=text("uuid_generate_v4()"), primary_key=True)
+    id = Column(UUID(as_uuid=True), server_default=text("uuid_generate_v4()"), primary_key=True)
     name = Column(String(), nullable=False, unique=True)
     description = Column(Text(), nullable=False)
     created_at = Column(UtcTimestamp, nullable=False, server_default=text("current_timestamp()"))
+    tsv = search_vector(name="A", description="B")
 
 
 class ProductTypesTable(BaseModel):
     __tablename__ = "product_types"
+    __table_args__ = (
+        trigram_index("product_types", "product_type"),
+        trigram_index("product_types", "description"),
+        search_index("product_types"),
+    )
 
-    id = Column(UUIDType, server_default=text("uuid_generate_v4()"), primary_key=True)
+    id = Column(UUID(as_uuid=True), server_default=text("uuid_generate_v4()"), primary_key=True)
     product_type = Column(String(510), nullable=False, unique=True)
     description = Column(Text())
+    tsv = search_vector(product_type="A", description="B")
 
 
 class MapsTable(BaseModel):
     __tablename__ = "maps"
-    id = Column(UUIDType, server_default=text("uuid_generate_v4()"), primary_key=True)
+    __table_args__ = (trigram_index("maps", "name"), trigram_index("maps", "description"), search_index("maps"))
+    id = Column(UUID(as_uuid=True), server_default=text("uuid_generate_v4()"), primary_key=True)
     name = Column(String(510), nullable=False, unique=True)
     description = Column(Text())
     size_x = Column(Integer, default=100)
@@ -133,4 +174,5 @@ class MapsTable(BaseModel):
         onupdate=nowtz,
         nullable=False,
     )
-    created_by = Column(UUIDType, ForeignKey("users.id"), nullable=True)
+    created_by = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=True)
+    tsv = search_vector(name="A", description="B")
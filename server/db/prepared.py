@@ -0,0 +1,73 @@
+"""Server side prepared statements for psycopg2.
+
+psycopg2 sends every statement as text, so Postgres parses and plans it again each time. SELECTs executed with the
+`prepare` execution option (the cached list queries, see `server.crud.query_cache`) are rewritten to an `EXECUTE`,
+after a `PREPARE` of the statement on its first use per connection. SQLAlchemy still processes the results with the
+compiled statement, so the rows are the same.
+
+Prepared statements live in the server session: with PgBouncer in transaction pooling mode the next transaction can
+run on another server connection, so this must not be enabled there.
+"""
+
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Any, List, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.util import LRUCache
+
+PARAMETER = re.compile(r"%\((\w+)\)s")
+PREPARED_STATEMENTS = "prepared_statements"
+MAX_PREPARED_STATEMENTS = 1000
+
+
+class PreparedStatements:
+    """`before_cursor_execute` listener that prepares statements, at most `max_statements` per connection.
+
+    Clients can combine filters into any number of query shapes, so both the plans (shared by all connections) and the
+    statements prepared on each connection are kept in an LRU: the least recently used statement of a connection is
+    deallocated when it would prepare one more.
+    """
+
+    def __init__(self, max_statements: int) -> None:
+        self.max_statements = max_statements
+        # SQL text to (statement name, PREPARE statement, parameter names)
+        self._plans = LRUCache(max_statements)
+
+    def _plan(self, statement: str) -> Tuple[str, str, List[str]]:
+        plan = self._plans.get(statement)
+        if plan is None:
+            names = list(dict.fromkeys(PARAMETER.findall(statement)))
+            positions = {name: f"${position}" for position, name in enumerate(names, 1)}
+            sql = PARAMETER.sub(lambda match: positions[match.group(1)], statement).replace("%%", "%")
+            name = "q_" + hashlib.blake2b(statement.encode(), digest_size=8).hexdigest()
+            plan = self._plans[statement] = (name, f"PREPARE {name} AS {sql}", names)
+        return plan
+
+    def __call__(
+        self, connection: Connection, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool
+    ) -> Tuple[str, Any]:
+        if executemany or context is None or not context.execution_options.get("prepare"):
+            return statement, parameters
+        name, prepare, names = self._plan(statement)
+        # The connection info lives as long as the DBAPI connection, and so do its prepared statements
+        prepared: "OrderedDict[str, None]" = connection.info.setdefault(PREPARED_STATEMENTS, OrderedDict())
+        if name in prepared:
+            prepared.move_to_end(name)
+        else:
+            while len(prepared) >= self.max_statements:
+                evicted, _ = prepared.popitem(last=False)
+                cursor.execute(f"DEALLOCATE {evicted}")
+            cursor.execute(prepare)
+            prepared[name] = None
+        arguments = ", ".join(f"%({parameter})s" for parameter in names)
+        return f"EXECUTE {name}({arguments})" if names else f"EXECUTE {name}", parameters
+
+
+def enable_prepared_statements(engine: Engine, max_statements: int = MAX_PREPARED_STATEMENTS) -> PreparedStatements:
+    """Prepare the statements executed with the `prepare` execution option on `engine` server side."""
+    listener = PreparedStatements(max_statements)
+    event.listen(engine, "before_cursor_execute", listener, retval=True)
+    return listener
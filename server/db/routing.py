@@ -0,0 +1,148 @@
+"""Route read only database work to streaming replicas.
+
+Statements are routed per session by `WrappedSession.get_bind`:
+
+- Only `SELECT` statements within a read only routing scope go to a replica. The `DBSessionMiddleware` opens a read
+  only scope for requests with a safe method (GET, HEAD, OPTIONS).
+- Once a session flushes or executes DML, everything after that goes to the primary, so a request reads its own writes.
+- A scope can require a minimal WAL position (LSN); only replicas that replayed at least up to there are used. The
+  `DBSessionMiddleware` hands out the LSN of each commit in a cookie so a client also reads its own writes in later
+  requests.
+- Replicas are checked at most every `check_interval` seconds. Replicas that lag more than `max_lag` seconds or that
+  failed their last check or a statement are skipped until the next check.
+
+Without a usable replica everything goes to the primary.
+"""
+
+from contextlib import closing, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from itertools import count
+from math import inf
+from threading import Lock
+from time import monotonic
+from typing import Any, Generator, Optional, Sequence
+
+import structlog
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import CompoundSelect, Select, UpdateBase
+
+logger = structlog.get_logger(__name__)
+
+# A primary (e.g. a development setup pointing the replica at the primary) reports its own WAL position and no lag
+REPLICA_STATUS = text("""
+    SELECT
+        CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END::text,
+        CASE
+            WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END
+    """)
+CURRENT_LSN = text("SELECT pg_current_wal_lsn()::text")
+
+
+def parse_lsn(lsn: str) -> int:
+    """Convert a textual Postgres LSN like `16/B374D848` into a comparable integer.
+
+    Raises:
+        ValueError: when `lsn` is not an LSN.
+
+    """
+    high, low = lsn.split("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+class Replica:
+    def __init__(self, engine: Engine) -> None:
+        self.engine = engine
+        self.healthy = False
+        self.lag = inf
+        self.replayed_lsn = 0
+        self.checked_at = -inf
+        self._lock = Lock()
+        event.listen(engine, "handle_error", self._handle_error)
+
+    def _handle_error(self, context: Any) -> None:
+        if context.is_disconnect:
+            self.healthy = False
+
+    def check(self, interval: float) -> None:
+        """Refresh the replication status when the last check is older than `interval` seconds."""
+        if monotonic() - self.checked_at < interval or not self._lock.acquire(blocking=False):
+            # Recent enough, or another thread is checking right now
+            return
+        try:
+            with closing(self.engine.connect()) as connection:
+                replayed_lsn, lag = connection.execute(REPLICA_STATUS).first()
+            self.replayed_lsn, self.lag, self.healthy = parse_lsn(replayed_lsn), float(lag), True
+        except SQLAlchemyError:
+            logger.warning("Replica check failed, using the primary instead", replica=repr(self.engine.url))
+            self.healthy = False
+        finally:
+            self.checked_at = monotonic()
+            self._lock.release()
+
+    def usable(self, max_lag: float, min_lsn: Optional[int]) -> bool:
+        return self.healthy and self.lag <= max_lag and (min_lsn is None or self.replayed_lsn >= min_lsn)
+
+
+@dataclass
+class RoutingScope:
+    read_only: bool = False
+    min_lsn: Optional[int] = None
+    wrote: bool = False
+    # LSN of the last commit of this scope after a write, for the read-your-writes cookie
+    commit_lsn: Optional[str] = None
+
+
+class ReplicaRouter:
+    """Pick a replica engine for the statements of a session, see the module docstring."""
+
+    def __init__(self, replicas: Sequence[Engine], max_lag: float, check_interval: float) -> None:
+        self.replicas = [Replica(engine) for engine in replicas]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.scope: ContextVar[Optional[RoutingScope]] = ContextVar("routing_scope", default=None)
+        self._round_robin = count()
+
+    @contextmanager
+    def routing_scope(
+        self, read_only: bool = False, min_lsn: Optional[int] = None
+    ) -> Generator[RoutingScope, None, None]:
+        scope = RoutingScope(read_only=read_only, min_lsn=min_lsn)
+        token = self.scope.set(scope)
+        try:
+            yield scope
+        finally:
+            self.scope.reset(token)
+
+    def replica(self, min_lsn: Optional[int] = None) -> Optional[Engine]:
+        """Return the next usable replica engine (round robin), None when there is none."""
+        start = next(self._round_robin)
+        for i in range(len(self.replicas)):
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            replica.check(self.check_interval)
+            if replica.usable(self.max_lag, min_lsn):
+                return replica.engine
+        return None
+
+    def get_bind(self, session: Session, clause: Any) -> Optional[Engine]:
+        """Return the replica engine to execute `clause` on, None when it should run on the primary."""
+        scope = self.scope.get()
+        if scope is None:
+            return None
+        if session._flushing or isinstance(clause, UpdateBase):
+            scope.wrote = True
+            return None
+        if not scope.read_only or scope.wrote or not isinstance(clause, (Select, CompoundSelect)):
+            return None
+        return self.replica(scope.min_lsn)
+
+    def after_commit(self, session: Session) -> None:
+        scope = self.scope.get()
+        if scope is not None and scope.wrote:
+            with closing(session.get_bind().connect()) as connection:
+                scope.commit_lsn = connection.execute(CURRENT_LSN).scalar()
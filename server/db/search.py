@@ -0,0 +1,30 @@
+"""Full text search on the generated `tsv` columns.
+
+Searchable tables have a `tsv` column generated by Postgres from their text columns (see `search_vector` in
+`server.db.models`) with a GIN index on it. Search input is turned into a `to_tsquery` where every word has to match
+as a prefix, so the results update while the user is typing. Only the words of the input are used, operators and
+quotes are dropped, so user input can't produce a `tsquery` syntax error.
+"""
+
+import re
+from typing import Any
+
+from sqlalchemy import func, literal_column
+from sqlalchemy.sql.elements import ColumnElement
+
+SEARCH_REGCONFIG = "english"
+WORD = re.compile(r"\w+")
+
+
+def prefix_tsquery(text: str) -> str:
+    """The `to_tsquery` input for `text` with every word as prefix, e.g. "red wid" becomes "red:* & wid:*"."""
+    return " & ".join(f"{word}:*" for word in WORD.findall(text))
+
+
+def regconfig(name: str = SEARCH_REGCONFIG) -> ColumnElement:
+    return literal_column(f"'{name}'::regconfig")
+
+
+def tsquery(value: Any, regconfig_name: str = SEARCH_REGCONFIG) -> ColumnElement:
+    """`to_tsquery` of `value`, a `prefix_tsquery` string or a bind parameter holding one."""
+    return func.to_tsquery(regconfig(regconfig_name), value)
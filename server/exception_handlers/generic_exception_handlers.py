@@ -18,6 +18,7 @@ from starlette.responses import JSONResponse
 
 from server.api.error_handling import ProblemDetailException
 from server.forms import FormException, FormNotCompleteError, FormValidationError
+from server.security import PasswordHashingBusy
 from server.utils.errors import show_ex
 
 PROBLEM_DETAIL_FIELDS = ("title", "type")
@@ -74,3 +75,12 @@ async def form_error_handler(request: Request, exc: FormException) -> JSONRespon
             },
             status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
         )
+
+
+async def password_hashing_busy_handler(request: Request, exc: PasswordHashingBusy) -> JSONResponse:
+    status = HTTPStatus.SERVICE_UNAVAILABLE
+    return JSONResponse(
+        {"detail": str(exc), "status": status.value, "title": status.phrase},
+        status_code=status,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
@@ -0,0 +1,14 @@
+"""Gunicorn settings for `bin/server`, loaded with `--config python:server.gunicorn_conf`."""
+
+import os
+from typing import Any
+
+from server.metrics import MULTIPROCESS_DIR
+
+
+def child_exit(server: Any, worker: Any) -> None:
+    # Drop the live gauges (in progress requests, pool connections) of the worker from the aggregated metrics
+    if os.environ.get(MULTIPROCESS_DIR):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,161 @@
+"""structlog configuration, see `configure_logging`.
+
+There are two profiles, selected with `LOG_FORMAT`:
+
+- `console` (the default): coloured lines for development, written to stdout when the log call is made.
+- `json`: one JSON object per line, rendered with rapidjson. The rendered lines are put on a bounded queue and written
+  to stdout in batches by a background thread, so a log call never waits on a slow stdout (e.g. a pipe to a log
+  collector). When the queue is full lines are dropped, the number of dropped lines is logged when there is room
+  again. Loggers are cached on first use, which means `structlog.configure` has no effect on loggers that were already
+  used. On Lambda the lines are written right away: the process is frozen between invocations.
+
+In both profiles calls below `LOG_LEVEL` are no-ops and events listed in `LOG_SAMPLING` are kept once every N times
+(with a `sample_rate` field to scale counts in the log collector) before any other processing happens. Sampling keys on
+the event, so log a constant event with the variable parts as fields: `logger.debug("Filter plan", model=...)`.
+"""
+
+import atexit
+import logging
+import sys
+from itertools import count
+from queue import Empty, SimpleQueue
+from threading import Event, Lock, Thread
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Union
+
+import rapidjson
+import structlog
+
+from server.db.instrumentation import add_query_stats
+
+LOG_QUEUE_SIZE = 10000
+
+
+class EventSampler:
+    """structlog processor that keeps one in `rate` of the events in `rates` and drops the others."""
+
+    def __init__(self, rates: Dict[str, int]) -> None:
+        self.rates = rates
+        # next() on an itertools.count is atomic, no lock is needed between threads
+        self._counters: Dict[str, Iterator[int]] = {event: count() for event in rates}
+
+    def __call__(self, logger: Any, method_name: str, event_dict: Dict[str, Any]) -> Dict[str, Any]:
+        event = event_dict.get("event")
+        counter = self._counters.get(event)  # type: ignore
+        if counter is None:
+            return event_dict
+        rate = self.rates[event]  # type: ignore
+        if next(counter) % rate:
+            raise structlog.DropEvent
+        event_dict["sample_rate"] = rate
+        return event_dict
+
+
+class LogQueue:
+    """A structlog logger (and its factory) that writes the rendered lines from a background thread."""
+
+    def __init__(self, file: TextIO, maxsize: int = LOG_QUEUE_SIZE) -> None:
+        self._file = file
+        self.maxsize = maxsize
+        # A SimpleQueue is a lot cheaper to put on than a Queue, the size limit is checked by hand (and approximate)
+        self._queue: "SimpleQueue[Union[str, Event, None]]" = SimpleQueue()
+        self._worker: Optional[Thread] = None
+        self._lock = Lock()
+        self.dropped = 0
+
+    def __call__(self, *args: Any) -> "LogQueue":
+        return self
+
+    def msg(self, message: str) -> None:
+        if self._worker is None:
+            self._start()
+        if self._queue.qsize() >= self.maxsize:
+            self.dropped += 1
+        else:
+            self._queue.put(message)
+
+    log = debug = info = warn = warning = msg
+    fatal = failure = err = error = critical = exception = msg
+
+    def flush(self) -> None:
+        """Wait until the queued lines are written."""
+        if self._worker is not None:
+            written = Event()
+            self._queue.put(written)
+            written.wait()
+
+    def shutdown(self) -> None:
+        """Write the queued lines and stop the thread."""
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            self._queue.put(None)
+            worker.join()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._worker is None:
+                self._worker = Thread(target=self._run, name="log-queue", daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            items = [self._queue.get()]
+            # Take whatever else is queued to write it with one call
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            text = "".join(f"{item}\n" for item in items if isinstance(item, str))
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                text += rapidjson.dumps({"event": "Dropped log lines", "count": dropped, "level": "warning"}) + "\n"
+            try:
+                self._file.write(text)
+                self._file.flush()
+            except Exception:
+                # There is nowhere left to report it, the lines are lost
+                pass
+            for item in items:
+                if isinstance(item, Event):
+                    item.set()
+            if None in items:
+                return
+
+
+log_queue = LogQueue(sys.stdout)
+
+
+def configure_logging(level: str, log_format: str, sampling: Dict[str, int], background: bool) -> None:
+    processors: List[Any] = [EventSampler(sampling)] if sampling else []
+    processors += [
+        add_query_stats,
+        structlog.processors.add_log_level,
+        structlog.processors.StackInfoRenderer(),
+        structlog.dev.set_exc_info,
+        structlog.processors.format_exc_info,
+    ]
+    if log_format == "json":
+        processors += [
+            structlog.processors.TimeStamper(fmt="iso", utc=True),
+            structlog.processors.JSONRenderer(serializer=rapidjson.dumps, default=repr),
+        ]
+        if background:
+            logger_factory: Any = log_queue
+            # Also write the lines logged while shutting down
+            atexit.register(log_queue.shutdown)
+        else:
+            logger_factory = structlog.PrintLoggerFactory()
+        cache_logger_on_first_use = True
+    else:
+        processors += [structlog.processors.TimeStamper(), structlog.dev.ConsoleRenderer()]
+        logger_factory = structlog.PrintLoggerFactory()
+        cache_logger_on_first_use = False
+
+    structlog.configure(
+        processors=processors,
+        wrapper_class=structlog.make_filtering_bound_logger(getattr(logging, level.upper())),
+        context_class=dict,
+        logger_factory=logger_factory,
+        cache_logger_on_first_use=cache_logger_on_first_use,
+    )
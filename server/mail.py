@@ -0,0 +1,194 @@
+"""Outbound mail, queued and delivered by a background worker.
+
+Request handlers only render the mail and put it on the queue. A worker thread takes the mails off the queue in
+batches of up to `EMAIL_BATCH_SIZE` and sends them over one SMTP connection, which stays open for the next batch until
+it is idle for `EMAIL_IDLE_TIMEOUT` seconds. When the server can't be reached or drops the connection the remaining
+mails of the batch are retried, up to `EMAIL_MAX_RETRIES` times with exponential backoff starting at
+`EMAIL_RETRY_BACKOFF` seconds. Mails the server refuses (e.g. an unknown recipient) are logged and not retried.
+
+Templates are compiled once per process and kept by Jinja, they are not read from disk again.
+
+On Lambda there is no process that outlives the request, so mails are sent in the request thread there.
+"""
+
+from functools import lru_cache
+from queue import Empty, Queue
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import TYPE_CHECKING, Any, List, NamedTuple, Optional
+
+from structlog import get_logger
+
+from server.settings import app_settings
+
+if TYPE_CHECKING:
+    from smtplib import SMTP
+
+    from jinja2 import Environment
+
+logger = get_logger(__name__)
+
+SMTP_TIMEOUT = 10
+# Seconds the worker waits for more mails to fill a batch after the first one
+BATCH_WAIT = 0.05
+
+
+class Mail(NamedTuple):
+    to: str
+    subject: str
+    html: str
+
+
+@lru_cache()
+def template_environment(directory: str) -> "Environment":
+    # Imported here: Jinja is slow to import and only needed when a mail is actually sent
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+    # Without auto_reload the compiled templates are cached without checking the files again
+    return Environment(loader=FileSystemLoader(directory), autoescape=select_autoescape(["html"]), auto_reload=False)
+
+
+def render_template(name: str, **context: Any) -> str:
+    return template_environment(app_settings.EMAIL_TEMPLATES_DIR).get_template(name).render(**context)
+
+
+class MailQueue:
+    def __init__(self, background: bool, batch_size: int, max_retries: int, retry_backoff: float, idle_timeout: float):
+        self.background = background
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.idle_timeout = idle_timeout
+        self._queue: "Queue[Optional[Mail]]" = Queue()
+        self._worker: Optional[Thread] = None
+        self._smtp: Optional["SMTP"] = None
+        self._lock = Lock()
+
+    def send(self, mail: Mail) -> None:
+        """Queue `mail` for delivery, without a background worker it is sent right away."""
+        if not self.background:
+            self._deliver([mail])
+            self._disconnect()
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = Thread(target=self._run, name="mail-queue", daemon=True)
+                self._worker.start()
+        self._queue.put(mail)
+
+    def join(self) -> None:
+        """Wait until all queued mails are delivered or given up on."""
+        self._queue.join()
+
+    def shutdown(self) -> None:
+        """Deliver the queued mails and stop the worker."""
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            self._queue.put(None)
+            worker.join()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                mail = self._queue.get(timeout=self.idle_timeout)
+            except Empty:
+                self._disconnect()
+                continue
+            if mail is None:
+                self._queue.task_done()
+                self._disconnect()
+                return
+            batch = [mail]
+            stop = False
+            deadline = monotonic() + BATCH_WAIT
+            while len(batch) < self.batch_size:
+                try:
+                    mail = self._queue.get(timeout=max(deadline - monotonic(), 0))
+                except Empty:
+                    break
+                if mail is None:
+                    stop = True
+                    break
+                batch.append(mail)
+            try:
+                self._deliver(batch)
+            except Exception:
+                logger.exception("Mail delivery failed", recipients=[mail.to for mail in batch])
+            for _ in range(len(batch) + stop):
+                self._queue.task_done()
+            if stop:
+                self._disconnect()
+                return
+
+    def _deliver(self, batch: List[Mail]) -> None:
+        # Imported here: smtplib pulls in ssl and the email package, only needed when a mail is actually sent
+        from smtplib import SMTPException, SMTPRecipientsRefused, SMTPResponseException
+
+        pending = list(batch)
+        for attempt in range(self.max_retries + 1):
+            try:
+                smtp = self._connect()
+                while pending:
+                    mail = pending[0]
+                    try:
+                        smtp.send_message(self._message(mail))
+                    except SMTPRecipientsRefused as e:
+                        logger.error("Mail recipient refused by the SMTP server", to=mail.to, error=str(e))
+                    except SMTPResponseException as e:
+                        # Only permanent (5xx) failures are skipped, sending the mail again won't help
+                        if e.smtp_code < 500:
+                            raise
+                        logger.error("Mail refused by the SMTP server", to=mail.to, error=str(e))
+                    pending.pop(0)
+                logger.info("Sent mails", count=len(batch))
+                return
+            except (SMTPException, OSError) as e:
+                self._disconnect()
+                if attempt == self.max_retries:
+                    logger.error("Giving up on mails", recipients=[mail.to for mail in pending], error=str(e))
+                    return
+                backoff = self.retry_backoff * 2**attempt
+                logger.warning("Mail delivery failed, retrying", pending=len(pending), backoff=backoff, error=str(e))
+                sleep(backoff)
+
+    def _connect(self) -> "SMTP":
+        if self._smtp is None:
+            from smtplib import SMTP
+
+            smtp = SMTP(app_settings.SMTP_HOST, app_settings.SMTP_PORT, timeout=SMTP_TIMEOUT)
+            if app_settings.SMTP_TLS:
+                smtp.starttls()
+            if app_settings.SMTP_USER:
+                smtp.login(app_settings.SMTP_USER, app_settings.SMTP_PASSWORD)
+            self._smtp = smtp
+        return self._smtp
+
+    def _disconnect(self) -> None:
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except Exception:
+                smtp.close()
+
+    @staticmethod
+    def _message(mail: Mail) -> Any:
+        from email.message import EmailMessage
+        from email.utils import formataddr
+
+        message = EmailMessage()
+        message["From"] = formataddr((app_settings.EMAILS_FROM_NAME, app_settings.EMAILS_FROM_EMAIL))
+        message["To"] = mail.to
+        message["Subject"] = mail.subject
+        message.set_content(mail.html, subtype="html")
+        return message
+
+
+mail_queue = MailQueue(
+    not app_settings.RUNNING_ON_LAMBDA,
+    app_settings.EMAIL_BATCH_SIZE,
+    app_settings.EMAIL_MAX_RETRIES,
+    app_settings.EMAIL_RETRY_BACKOFF,
+    app_settings.EMAIL_IDLE_TIMEOUT,
+)
@@ -12,7 +12,6 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import logging
 import os
 
 import structlog
@@ -25,26 +24,26 @@ from starlette.responses import JSONResponse
 
 from server.api.api_v1.api import api_router
 from server.api.error_handling import ProblemDetailException
-from server.db import db
+from server.db import async_db, db
 from server.db.database import DBSessionMiddleware
-from server.exception_handlers.generic_exception_handlers import form_error_handler, problem_detail_handler
+from server.exception_handlers.generic_exception_handlers import (
+    form_error_handler,
+    password_hashing_busy_handler,
+    problem_detail_handler,
+)
 from server.forms import FormException
+from server.log import configure_logging
+from server.mail import mail_queue
+from server.metrics import MetricsMiddleware, instrument_pool, metrics, metrics_endpoint
+from server.security import PasswordHashingBusy, password_hasher
 from server.settings import app_settings
 from server.version import GIT_COMMIT_HASH
 
-structlog.configure(
-    processors=[
-        structlog.processors.add_log_level,
-        structlog.processors.StackInfoRenderer(),
-        structlog.dev.set_exc_info,
-        structlog.processors.format_exc_info,
-        structlog.processors.TimeStamper(),
-        structlog.dev.ConsoleRenderer(),
-    ],
-    wrapper_class=structlog.make_filtering_bound_logger(logging.NOTSET),
-    context_class=dict,
-    logger_factory=structlog.PrintLoggerFactory(),
-    cache_logger_on_first_use=False,
+configure_logging(
+    app_settings.LOG_LEVEL,
+    app_settings.LOG_FORMAT,
+    app_settings.LOG_SAMPLING,
+    background=not app_settings.RUNNING_ON_LAMBDA,
 )
 
 logger = structlog.get_logger(__name__)
@@ -81,9 +80,44 @@ app.add_middleware(
     allow_headers=app_settings.CORS_ALLOW_HEADERS,
     expose_headers=app_settings.CORS_EXPOSE_HEADERS,
 )
+app.add_middleware(MetricsMiddleware)
 
 app.add_exception_handler(FormException, form_error_handler)
 app.add_exception_handler(ProblemDetailException, problem_detail_handler)
+app.add_exception_handler(PasswordHashingBusy, password_hashing_busy_handler)
+
+
+@app.on_event("startup")
+async def connect_async_database() -> None:
+    if app_settings.ASYNC_DATABASE:
+        await async_db.connect()
+
+
+@app.on_event("startup")
+def enable_metrics() -> None:
+    if app_settings.METRICS_ENABLED:
+        metrics.enable()
+        instrument_pool(db.engine, "primary")
+        for i, replica in enumerate(db.router.replicas if db.router is not None else []):
+            instrument_pool(replica.engine, f"replica_{i}")
+
+
+@app.on_event("shutdown")
+async def disconnect_async_database() -> None:
+    await async_db.disconnect()
+
+
+@app.on_event("shutdown")
+def shutdown_password_hasher() -> None:
+    password_hasher.shutdown()
+
+
+@app.on_event("shutdown")
+def shutdown_mail_queue() -> None:
+    mail_queue.shutdown()
+
+
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
 
 
 @app.router.get("/", response_model=str, response_class=JSONResponse, include_in_schema=False)
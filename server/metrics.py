@@ -0,0 +1,191 @@
+"""Prometheus metrics, served on `/metrics`.
+
+- `http_request_duration_seconds`: latency histogram per method, route template and status code.
+- `http_requests_in_progress`: requests being handled per method.
+- `db_pool_*`: checked out and overflow connections and the time spent waiting for a connection, per engine.
+- `threadpool_*`: busy threads and tasks waiting for a thread of the pool that runs the sync endpoints.
+- `password_hash_*`: pending hashes and the capacity of the bcrypt pool, see `server.security.PasswordHasher`.
+- `cache_requests_total`: hits and misses per cache, the hit ratio is `hits / (hits + misses)`.
+
+The threadpool and bcrypt gauges are sampled at the start of each request, the pool gauges on every checkout and
+checkin.
+
+Under gunicorn every worker has its own metrics. With the `PROMETHEUS_MULTIPROC_DIR` environment variable set (see
+`bin/server`) the workers write them to files in that directory and `/metrics` aggregates them, so a scrape sees the
+whole server no matter which worker answers it. Gauges are summed over the live workers; `server.gunicorn_conf` removes
+the gauges of workers that exited.
+
+`prometheus_client` is only imported by `enable`, which runs at startup when `METRICS_ENABLED` is set. On Lambda there
+is no startup (and nothing to scrape), so there the metrics cost nothing.
+"""
+
+import os
+from time import perf_counter
+from typing import Any, Callable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+MULTIPROCESS_DIR = "PROMETHEUS_MULTIPROC_DIR"
+UNMATCHED_ROUTE = "unmatched"
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self.enabled = False
+        self._registered = False
+
+    def enable(self) -> None:
+        if not self._registered:
+            self._register()
+        self.enabled = True
+
+    def disable(self) -> None:
+        """Stop recording, the collectors stay registered for when metrics are enabled again."""
+        self.enabled = False
+
+    def _register(self) -> None:
+        # Imported here: prometheus_client takes long to import and isn't used on Lambda
+        from prometheus_client import Counter, Gauge, Histogram
+
+        self.request_duration = Histogram(
+            "http_request_duration_seconds", "Request latency", ["method", "route", "status"]
+        )
+        self.requests_in_progress = Gauge(
+            "http_requests_in_progress", "Requests being handled", ["method"], multiprocess_mode="livesum"
+        )
+        self.pool_checked_out = Gauge(
+            "db_pool_checked_out", "Connections in use", ["pool"], multiprocess_mode="livesum"
+        )
+        self.pool_overflow = Gauge(
+            "db_pool_overflow", "Connections over the pool size", ["pool"], multiprocess_mode="livesum"
+        )
+        self.pool_wait = Histogram("db_pool_wait_seconds", "Time waiting for a connection from the pool", ["pool"])
+        self.threadpool_busy = Gauge(
+            "threadpool_busy_threads", "Threads running sync endpoints", multiprocess_mode="livesum"
+        )
+        self.threadpool_waiting = Gauge(
+            "threadpool_waiting_tasks", "Sync endpoints waiting for a thread", multiprocess_mode="livesum"
+        )
+        self.password_hash_pending = Gauge(
+            "password_hash_pending", "Password hashes running or queued", multiprocess_mode="livesum"
+        )
+        self.password_hash_capacity = Gauge(
+            "password_hash_capacity", "Password hashes that can run or queue", multiprocess_mode="livesum"
+        )
+        self.cache_requests = Counter("cache_requests", "Cache lookups", ["cache", "result"])
+
+        from server.security import password_hasher
+
+        self.password_hasher = password_hasher
+        self.password_hash_capacity.set(password_hasher.workers + password_hasher.queue_limit)
+        self._registered = True
+
+    def sample(self) -> None:
+        from anyio.to_thread import current_default_thread_limiter
+
+        limiter = current_default_thread_limiter()
+        self.threadpool_busy.set(limiter.borrowed_tokens)
+        self.threadpool_waiting.set(limiter.statistics().tasks_waiting)
+        self.password_hash_pending.set(self.password_hasher.pending)
+
+
+metrics = Metrics()
+
+
+def cache_access(cache: str, hit: bool) -> None:
+    """Count a lookup in `cache`, a no-op while metrics are disabled."""
+    if metrics.enabled:
+        metrics.cache_requests.labels(cache, "hit" if hit else "miss").inc()
+
+
+def instrument_pool(engine: Engine, name: str) -> None:
+    """Report the connection pool of `engine` as `pool` `name`."""
+    pool = engine.pool
+
+    def update(*args: Any) -> None:
+        metrics.pool_checked_out.labels(name).set(pool.checkedout())
+        metrics.pool_overflow.labels(name).set(max(pool.overflow(), 0))
+
+    event.listen(engine, "checkout", update)
+    event.listen(engine, "checkin", update)
+
+    # The pool has no event before a checkout, so the wait is measured around its internal `_do_get`
+    do_get: Callable[[], Any] = pool._do_get  # type: ignore
+    wait = metrics.pool_wait.labels(name)
+
+    def timed_do_get() -> Any:
+        start = perf_counter()
+        try:
+            return do_get()
+        finally:
+            wait.observe(perf_counter() - start)
+
+    pool._do_get = timed_do_get  # type: ignore
+
+
+def route_template(scope: Scope) -> str:
+    """The path template of the route that handled the request in `scope`.
+
+    Recent FastAPI versions add the matched `APIRoute` to the scope, otherwise (also for plain Starlette routes) the
+    routes of the app are matched again. Unmatched paths share a label to bound the cardinality.
+    """
+    route = scope.get("route")
+    if route is None and "app" in scope:
+        partial = None
+        for candidate in scope["app"].router.routes:
+            match, _ = candidate.matches(scope)
+            if match == Match.FULL:
+                route = candidate
+                break
+            if match == Match.PARTIAL and partial is None:
+                partial = candidate
+        else:
+            route = partial
+    return getattr(route, "path", UNMATCHED_ROUTE)
+
+
+class MetricsMiddleware:
+    """Measure the latency of HTTP requests per route template, e.g. `/api/products/{id}`."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        method = scope["method"]
+        in_progress = metrics.requests_in_progress.labels(method)
+        in_progress.inc()
+        metrics.sample()
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.request_duration.labels(method, route_template(scope), str(status)).observe(perf_counter() - start)
+            in_progress.dec()
+
+
+def metrics_endpoint(request: Request) -> Response:
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest
+    from prometheus_client.multiprocess import MultiProcessCollector
+
+    registry: Optional[Any] = REGISTRY
+    if os.environ.get(MULTIPROCESS_DIR):
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -11,20 +11,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from server.schemas.bulk import BulkResult, BulkRowError
 from server.schemas.map import Map, MapCreate, MapCreateAdmin, MapUpdate, MapUpdateAdmin
 from server.schemas.msg import Msg
 from server.schemas.product import Product, ProductCreate, ProductUpdate
 from server.schemas.product_type import ProductType, ProductTypeCreate, ProductTypeUpdate
+from server.schemas.search import SearchResult
 from server.schemas.token import Token, TokenPayload
 from server.schemas.user import User, UserCreate, UserUpdate
 
 __all__ = (
+    "BulkResult",
+    "BulkRowError",
     "ProductType",
     "ProductTypeCreate",
     "ProductTypeUpdate",
     "Product",
     "ProductCreate",
     "ProductUpdate",
+    "SearchResult",
     "Token",
     "TokenPayload",
     "User",
@@ -0,0 +1,29 @@
+# Copyright 2019-2020 SURF.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import List
+from uuid import UUID
+
+from server.schemas.base import BoilerplateBaseModel
+
+
+class BulkRowError(BoilerplateBaseModel):
+    index: int
+    detail: str
+
+
+class BulkResult(BoilerplateBaseModel):
+    """Outcome of a bulk operation: the ids of the rows that succeeded and an error per failed input row."""
+
+    ids: List[UUID] = []
+    errors: List[BulkRowError] = []
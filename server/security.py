@@ -1,16 +1,39 @@
+import asyncio
 from datetime import datetime, timedelta
-from typing import Any, Optional, Union
+from functools import partial
+from threading import Lock
+from time import time
+from typing import TYPE_CHECKING, Any, Callable, Optional, Tuple, TypeVar, Union
 
 from jose import jwt
 from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
 from structlog import get_logger
 
+from server.metrics import cache_access
 from server.settings import app_settings
+from server.utils.ttl_cache import TTLCache
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+# Hashes with fewer rounds than configured are updated on the next successful login, see `verify_and_update`
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=app_settings.PASSWORD_HASH_ROUNDS,
+    bcrypt__min_rounds=app_settings.PASSWORD_HASH_ROUNDS,
+)
 
 logger = get_logger(__name__)
 
+TOKEN_CACHE_MAX_ENTRIES = 4096
+
+# Verified access token -> subject, entries never outlive the expiry of the token itself
+_token_cache: TTLCache[str] = TTLCache(
+    TOKEN_CACHE_MAX_ENTRIES, lambda: app_settings.AUTH_CACHE_TTL, partial(cache_access, "access_token")
+)
+
 
 def create_access_token(subject: Union[str, Any], expires_delta: Optional[timedelta] = None) -> str:
     if expires_delta:
@@ -22,9 +45,146 @@ def create_access_token(subject: Union[str, Any], expires_delta: Optional[timede
     return encoded_jwt
 
 
+def decode_access_token(token: str) -> Optional[str]:
+    """Verify `token` and return its subject (the user id).
+
+    Raises:
+        JWTError: when the token is invalid or expired.
+
+    """
+    subject = _token_cache.get(token)
+    if subject is not None:
+        return subject
+    payload = jwt.decode(token, app_settings.SESSION_SECRET, algorithms=[app_settings.JWT_ALGORITHM])
+    subject = payload.get("sub")
+    if subject is not None:
+        expires = payload.get("exp")
+        _token_cache.set(token, subject, ttl=expires - time() if expires is not None else None)
+    return subject
+
+
+def clear_token_cache() -> None:
+    _token_cache.clear()
+
+
+T = TypeVar("T")
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when too many password hashes are in flight, the API answers with a 503 and a `Retry-After` header."""
+
+    def __init__(self, retry_after: int) -> None:
+        super().__init__("Too many concurrent logins, try again later")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """Run bcrypt on a bounded process pool.
+
+    bcrypt is slow on purpose. Hashing in the request threads lets a burst of logins take every thread of the worker
+    and stall all other requests. The async methods (used by the login endpoint) await the pool without holding a
+    thread, the sync ones block the calling thread until the hash is done. The pool is created on first use; with
+    `workers` set to 0 hashing is done in a thread of the threadpool (e.g. on Lambda where there is no shared memory
+    for a process pool).
+
+    At most `workers + queue_limit` hashes are in flight, any more raise `PasswordHashingBusy`.
+    """
+
+    def __init__(self, workers: int, queue_limit: int, retry_after: int) -> None:
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.retry_after = retry_after
+        self.pending = 0
+        self._executor: Optional["ProcessPoolExecutor"] = None
+        self._lock = Lock()
+
+    @property
+    def executor(self) -> "ProcessPoolExecutor":
+        # Imported here: multiprocessing isn't needed when hashing inline (on Lambda) and adds to the import time
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        with self._lock:
+            if self._executor is None:
+                # Forking a process with an open database pool and running threads isn't safe, spawn clean workers
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def _acquire(self) -> None:
+        with self._lock:
+            if self.pending >= self.workers + self.queue_limit:
+                logger.warning("Password hashing queue is full", pending=self.pending)
+                raise PasswordHashingBusy(self.retry_after)
+            self.pending += 1
+
+    def _release(self) -> None:
+        with self._lock:
+            self.pending -= 1
+
+    def _run(self, fn: Callable[..., T], *args: Any) -> T:
+        if not self.workers:
+            return fn(*args)
+        self._acquire()
+        try:
+            return self.executor.submit(fn, *args).result()
+        finally:
+            self._release()
+
+    async def _async_run(self, fn: Callable[..., T], *args: Any) -> T:
+        if not self.workers:
+            return await run_in_threadpool(fn, *args)
+        self._acquire()
+        try:
+            return await asyncio.wrap_future(self.executor.submit(fn, *args))
+        finally:
+            self._release()
+
+    def hash(self, password: str) -> str:
+        return self._run(_hash, password)
+
+    def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Verify `password`, the second value is a new hash when `hashed_password` uses outdated settings."""
+        return self._run(_verify_and_update, password, hashed_password)
+
+    async def async_hash(self, password: str) -> str:
+        return await self._async_run(_hash, password)
+
+    async def async_verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._async_run(_verify_and_update, password, hashed_password)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+password_hasher = PasswordHasher(
+    0 if app_settings.RUNNING_ON_LAMBDA else app_settings.PASSWORD_HASH_WORKERS,
+    app_settings.PASSWORD_HASH_QUEUE_LIMIT,
+    app_settings.PASSWORD_HASH_RETRY_AFTER,
+)
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_hasher.verify_and_update(plain_password, hashed_password)[0]
+
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return password_hasher.verify_and_update(plain_password, hashed_password)
+
+
+async def async_verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return await password_hasher.async_verify_and_update(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return password_hasher.hash(password)
@@ -1,47 +1,29 @@
-import logging
 from datetime import datetime, timedelta
-from pathlib import Path
 from typing import Any, Dict, Optional
 
-import emails
-from emails.template import JinjaTemplate
+import structlog
 from jose import jwt
 
+from server.mail import Mail, mail_queue, render_template
 from server.settings import app_settings
 
+logger = structlog.get_logger(__name__)
 
-def send_email(
-    email_to: str,
-    subject_template: str = "",
-    html_template: str = "",
-    environment: Dict[str, Any] = {},
-) -> None:
+
+def send_email(email_to: str, subject: str, template: str, environment: Dict[str, Any]) -> None:
+    """Render `template` from `EMAIL_TEMPLATES_DIR` with `environment` and queue the mail, see `server.mail`."""
     assert app_settings.EMAILS_ENABLED, "no provided configuration for email variables"
-    message = emails.Message(
-        subject=JinjaTemplate(subject_template),
-        html=JinjaTemplate(html_template),
-        mail_from=(app_settings.EMAILS_FROM_NAME, app_settings.EMAILS_FROM_EMAIL),
-    )
-    smtp_options = {"host": app_settings.SMTP_HOST, "port": app_settings.SMTP_PORT}
-    if app_settings.SMTP_TLS:
-        smtp_options["tls"] = True
-    if app_settings.SMTP_USER:
-        smtp_options["user"] = app_settings.SMTP_USER
-    if app_settings.SMTP_PASSWORD:
-        smtp_options["password"] = app_settings.SMTP_PASSWORD
-    response = message.send(to=email_to, render=environment, smtp=smtp_options)
-    logging.info(f"send email result: {response}")
+    mail_queue.send(Mail(email_to, subject, render_template(template, **environment)))
+    logger.info("Queued email", to=email_to, template=template)
 
 
 def send_test_email(email_to: str) -> None:
     project_name = app_settings.PROJECT_NAME
     subject = f"{project_name} - Test email"
-    with open(Path(app_settings.EMAIL_TEMPLATES_DIR) / "test_email.html") as f:
-        template_str = f.read()
     send_email(
         email_to=email_to,
-        subject_template=subject,
-        html_template=template_str,
+        subject=subject,
+        template="test_email.html",
         environment={"project_name": app_settings.PROJECT_NAME, "email": email_to},
     )
 
@@ -49,14 +31,12 @@ def send_test_email(email_to: str) -> None:
 def send_reset_password_email(email_to: str, email: str, token: str) -> None:
     project_name = app_settings.PROJECT_NAME
     subject = f"{project_name} - Password recovery for user {email}"
-    with open(Path(app_settings.EMAIL_TEMPLATES_DIR) / "reset_password.html") as f:
-        template_str = f.read()
     server_host = app_settings.SERVER_HOST
     link = f"{server_host}/reset-password?token={token}"
     send_email(
         email_to=email_to,
-        subject_template=subject,
-        html_template=template_str,
+        subject=subject,
+        template="reset_password.html",
         environment={
             "project_name": app_settings.PROJECT_NAME,
             "username": email,
@@ -70,13 +50,11 @@ def send_reset_password_email(email_to: str, email: str, token: str) -> None:
 def send_new_account_email(email_to: str, username: str, password: str) -> None:
     project_name = app_settings.PROJECT_NAME
     subject = f"{project_name} - New account for user {username}"
-    with open(Path(app_settings.EMAIL_TEMPLATES_DIR) / "new_account.html") as f:
-        template_str = f.read()
     link = app_settings.SERVER_HOST
     send_email(
         email_to=email_to,
-        subject_template=subject,
-        html_template=template_str,
+        subject=subject,
+        template="new_account.html",
         environment={
             "project_name": app_settings.PROJECT_NAME,
             "username": username,
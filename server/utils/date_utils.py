@@ -13,9 +13,7 @@
 
 
 import re
-from datetime import datetime
-
-import pytz
+from datetime import datetime, timezone
 
 TIMESTAMP_REGEX = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}")
 
@@ -55,4 +53,4 @@ def nowtz() -> datetime:
         Datetime object
 
     """
-    return datetime.now(tz=pytz.utc)
+    return datetime.now(tz=timezone.utc)
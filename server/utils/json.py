@@ -75,10 +75,11 @@ decoding functions differently then `default` and `object_hook` is that they are
 
 """
 
+import re
 from contextlib import suppress
 from dataclasses import asdict, is_dataclass
 from datetime import datetime
-from typing import Any, Dict, List, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 from uuid import UUID
 
 import rapidjson as json
@@ -92,7 +93,16 @@ PY_JSON_TYPES = Union[Dict[str, Any], List, str, int, float, bool, None, object]
 logger = structlog.get_logger(__name__)
 
 
-def json_loads(s: Union[str, bytes, bytearray]) -> PY_JSON_TYPES:
+def json_loads(s: Union[str, bytes, bytearray], timestamps: Optional["TimestampPaths"] = None) -> PY_JSON_TYPES:
+    """Decode `s`, converting timestamps to :obj:`datetime.datetime` objects.
+
+    Without `timestamps` every dict is passed through :func:`from_serializable`, unless the document cannot contain a
+    timestamp at all. With `timestamps` only the declared paths are converted and the hook is never called.
+    """
+    if timestamps is not None:
+        return timestamps.convert(json.loads(s))
+    if not _has_timestamp_candidate(s):
+        return json.loads(s)
     return json.loads(s, object_hook=from_serializable)
 
 
@@ -100,6 +110,44 @@ def json_dumps(obj: PY_JSON_TYPES) -> str:
     return json.dumps(obj, default=to_serializable)
 
 
+def _serialize_dataclass(o: Any) -> Any:
+    return asdict(o)
+
+
+def _serialize_json(o: Any) -> Any:
+    return o.__json__()
+
+
+def _serialize_to_dict(o: Any) -> Any:
+    # api_client models all have a to_dict function
+    return o.to_dict()
+
+
+def _serialize_pydantic(o: BaseModel) -> Any:
+    return o.dict()
+
+
+def _resolve_serializer(cls: type) -> Optional[Callable[[Any], Any]]:
+    if issubclass(cls, UUID):
+        return str
+    if issubclass(cls, datetime):
+        return isoformat
+    if is_dataclass(cls):
+        return _serialize_dataclass
+    if hasattr(cls, "__json__"):
+        return _serialize_json
+    if hasattr(cls, "to_dict"):
+        return _serialize_to_dict
+    if issubclass(cls, BaseModel):
+        return _serialize_pydantic
+    return None
+
+
+# Serializers by exact class. Which serializer applies only depends on the class of an object, so the `isinstance`
+# chain in `_resolve_serializer` runs once per class instead of once per serialized object.
+_serializers: Dict[type, Callable[[Any], Any]] = {UUID: str, datetime: isoformat}
+
+
 def to_serializable(o: Any) -> Any:
     """Convert an object into an object that the JSON encode can serialize.
 
@@ -113,24 +161,41 @@ def to_serializable(o: Any) -> Any:
         TypeError: in case no conversion was possible.
 
     """
-    if isinstance(o, UUID):
-        return str(o)
-    if isinstance(o, datetime):
-        return isoformat(o)
-    if is_dataclass(o):
-        return asdict(o)
-    if hasattr(o, "__json__"):
-        return o.__json__()
-    if hasattr(o, "to_dict"):
-        # api_client models all have a to_dict function
-        return o.to_dict()
-    if isinstance(o, BaseModel):
-        return o.dict()
-    raise TypeError(f"Could not serialize object of type {o.__class__.__name__} to JSON")
+    cls = type(o)
+    serializer = _serializers.get(cls)
+    if serializer is None:
+        serializer = _resolve_serializer(cls)
+        if serializer is None:
+            raise TypeError(f"Could not serialize object of type {cls.__name__} to JSON")
+        _serializers[cls] = serializer
+    return serializer(o)
 
 
 ISO_FORMAT_STR_LEN = len("2019-05-18T15:17:00+00:00")  # assume 'seconds' precision
 
+# Every timestamp `from_serializable` can convert contains a "T" followed by the hour. Timestamp characters could also be
+# `\u` escaped, which no encoder does for printable ASCII, so those documents simply take the slow path.
+# Separate patterns: an alternation would disable the literal prefix scan of the regex engine.
+_TIMESTAMP_CANDIDATES = (r"T[0-9]", r"\\u00[2-7]")
+_TIMESTAMP_CANDIDATES_STR = [re.compile(pattern) for pattern in _TIMESTAMP_CANDIDATES]
+_TIMESTAMP_CANDIDATES_BYTES = [re.compile(pattern.encode()) for pattern in _TIMESTAMP_CANDIDATES]
+
+
+def _has_timestamp_candidate(s: Union[str, bytes, bytearray]) -> bool:
+    """Whether `from_serializable` could convert anything in the JSON document `s`.
+
+    Scanning the raw document for a literal is much cheaper than calling the `object_hook` for every decoded dict.
+    False positives (e.g. "T1" in some text) only cost the slow path.
+    """
+    patterns = _TIMESTAMP_CANDIDATES_STR if isinstance(s, str) else _TIMESTAMP_CANDIDATES_BYTES
+    return any(pattern.search(s) for pattern in patterns)
+
+
+def _parse_timestamp(v: str) -> datetime:
+    timestamp = datetime.fromisoformat(v)
+    assert timestamp.tzinfo is not None, "All timestamps should contain timezone information."
+    return timestamp
+
 
 def from_serializable(dct: Dict[str, Any]) -> Dict[str, Any]:
     """Convert a serializable object into a more specific, custom, Python data type.
@@ -145,14 +210,59 @@ def from_serializable(dct: Dict[str, Any]) -> Dict[str, Any]:
     for k, v in dct.items():
         # We don't want to try converting each string we come across to a `datetime` object, hence we employ a simple
         # and reasonably specific heuristic that identifies likely ISO formatted string candidates
-        if isinstance(v, str) and len(v) == ISO_FORMAT_STR_LEN and v[10] == "T":
+        if type(v) is str and len(v) == ISO_FORMAT_STR_LEN and v[10] == "T":
             with suppress(ValueError, TypeError):
-                timestamp = datetime.fromisoformat(v)
-                assert timestamp.tzinfo is not None, "All timestamps should contain timezone information."
-                dct[k] = timestamp
+                dct[k] = _parse_timestamp(v)
     return dct
 
 
+class TimestampPaths:
+    """The locations of the timestamps in a JSON document, for the schema aware decode mode of :func:`json_loads`.
+
+    Paths are dotted dict keys, `*` matches every item of a list or every value of a dict. Eg::
+
+        TimestampPaths("created_at", "events.*.end_date")
+
+    Declared values are always converted; a string that is not a timezone aware ISO timestamp raises a
+    :exc:`ValueError`. `None` values and paths that are absent from the document are left alone.
+    """
+
+    WILDCARD = "*"
+
+    def __init__(self, *paths: str) -> None:
+        self.paths = paths
+        self._tree: Dict[str, Dict] = {}
+        for path in paths:
+            node = self._tree
+            for key in path.split("."):
+                node = node.setdefault(key, {})
+
+    def convert(self, document: Any) -> Any:
+        return self._convert(document, self._tree)
+
+    def _convert(self, value: Any, node: Dict[str, Dict]) -> Any:
+        if not node:
+            if isinstance(value, str):
+                timestamp = datetime.fromisoformat(value)
+                if timestamp.tzinfo is None:
+                    raise ValueError(f"Timestamp without timezone information: {value}")
+                return timestamp
+            return value
+
+        if isinstance(value, dict):
+            for key, child in node.items():
+                if key == self.WILDCARD:
+                    for k, v in value.items():
+                        value[k] = self._convert(v, child)
+                elif key in value:
+                    value[key] = self._convert(value[key], child)
+        elif isinstance(value, list) and self.WILDCARD in node:
+            child = node[self.WILDCARD]
+            for i, v in enumerate(value):
+                value[i] = self._convert(v, child)
+        return value
+
+
 def non_none_dict(dikt: List[Tuple[str, Any]]) -> Dict[Any, Any]:
     """
     Return no `None` values in a Dict.
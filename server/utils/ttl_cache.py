@@ -0,0 +1,58 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+    """Thread safe in process cache with a maximum size and a per entry time to live.
+
+    The least recently used entries are evicted once `max_entries` is exceeded. `ttl` is a callable so settings that
+    are changed at runtime (e.g. in tests) are picked up. `on_access` is called with whether a lookup was a hit, e.g.
+    to count it in the metrics.
+    """
+
+    def __init__(
+        self, max_entries: int, ttl: Callable[[], float], on_access: Optional[Callable[[bool], None]] = None
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.on_access = on_access
+        self._entries: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if self.on_access is not None:
+            self.on_access(entry is not None)
+        return entry[1] if entry is not None else None
+
+    def set(self, key: Hashable, value: V, ttl: Optional[float] = None) -> None:
+        """Store `value`, `ttl` can shorten the configured time to live for this entry."""
+        ttl = self.ttl() if ttl is None else min(ttl, self.ttl())
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -11,7 +11,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import os
-from subprocess import check_output  # noqa: S404
 from typing import Optional
 
 import structlog
@@ -21,10 +20,37 @@ logger = structlog.getLogger(__name__)
 VERSION = "1.0"
 
 
+def _git_commit_hash() -> Optional[str]:
+    try:
+        from server.build_version import GIT_COMMIT_HASH  # type: ignore  # Written by `bin/bake-version`
+
+        return GIT_COMMIT_HASH
+    except ImportError:
+        pass
+
+    if os.environ.get("GIT_COMMIT_HASH"):
+        return os.environ["GIT_COMMIT_HASH"]
+
+    if os.environ.get("ENVIRONMENT") == "production":
+        return VERSION
+
+    from subprocess import check_output  # noqa: S404
+
+    try:
+        return check_output(["/usr/bin/env", "git", "rev-parse", "HEAD"]).decode().strip()  # noqa: S603
+    except Exception:
+        logger.exception("Could not get git commit hash")
+        return None
+
+
 def __getattr__(name: str) -> Optional[str]:
     """
     Return the GIT_COMMIT_HASH.
 
+    The hash baked in at build time by `bin/bake-version` is preferred, then the `GIT_COMMIT_HASH` environment variable.
+    Only when neither is available `git` is asked, which costs a subprocess on import of `server.main`. The result is
+    stored as module attribute, so this is done once.
+
     Usage::
 
         from server.version import GIT_COMMIT_HASH
@@ -36,14 +62,8 @@ def __getattr__(name: str) -> Optional[str]:
     Returns: current GIT commit SHA if any.
 
     """
-    if os.environ.get("ENVIRONMENT") == "production":
-        return VERSION
-
     if name == "GIT_COMMIT_HASH":
-        try:
-            return check_output(["/usr/bin/env", "git", "rev-parse", "HEAD"]).decode().strip()  # noqa: S603
-        except Exception:
-            logger.exception("Could not get git commit hash")
-            return None
+        git_commit_hash = globals()["GIT_COMMIT_HASH"] = _git_commit_hash()
+        return git_commit_hash
     else:
         raise AttributeError(name)
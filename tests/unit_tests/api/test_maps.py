@@ -1,4 +1,5 @@
 from http import HTTPStatus
+from uuid import uuid4
 
 from server.utils.json import json_dumps
 
@@ -129,3 +130,45 @@ def test_admin_map_update_with_not_admin(test_client, user_token_headers, map_1)
         headers=user_token_headers,
     )
     assert HTTPStatus.FORBIDDEN == response.status_code
+
+
+def test_map_update_404(test_client, user_token_headers):
+    body = {"name": "UpdatedMap", "description": "desc", "size_x": 10, "size_y": 10, "status": "new"}
+    response = test_client.put(f"/api/maps/{uuid4()}", data=json_dumps(body), headers=user_token_headers)
+    assert HTTPStatus.NOT_FOUND == response.status_code
+
+
+def test_map_conditional_get(test_client, map_1):
+    response = test_client.get(f"/api/maps/{map_1}")
+    assert HTTPStatus.OK == response.status_code
+    etag, modified = response.headers["ETag"], response.headers["Last-Modified"]
+
+    response = test_client.get(f"/api/maps/{map_1}", headers={"If-None-Match": etag})
+    assert HTTPStatus.NOT_MODIFIED == response.status_code
+    assert response.headers["ETag"] == etag
+    assert (
+        HTTPStatus.NOT_MODIFIED
+        == test_client.get(f"/api/maps/{map_1}", headers={"If-Modified-Since": modified}).status_code
+    )
+    assert HTTPStatus.OK == test_client.get(f"/api/maps/{map_1}", headers={"If-None-Match": '"other"'}).status_code
+
+
+def test_map_update_if_match(test_client, user_token_headers, map_1):
+    etag = test_client.get(f"/api/maps/{map_1}").headers["ETag"]
+    body = {"name": "UpdatedMap", "description": "desc", "size_x": 10, "size_y": 10, "status": "new"}
+
+    response = test_client.put(
+        f"/api/maps/{map_1}", data=json_dumps(body), headers={**user_token_headers, "If-Match": etag}
+    )
+    assert HTTPStatus.NO_CONTENT == response.status_code
+    new_etag = response.headers["ETag"]
+    assert new_etag != etag
+    assert test_client.get(f"/api/maps/{map_1}").headers["ETag"] == new_etag
+
+    # A second client with the old ETag doesn't overwrite the update
+    body["name"] = "LostUpdate"
+    response = test_client.put(
+        f"/api/maps/{map_1}", data=json_dumps(body), headers={**user_token_headers, "If-Match": etag}
+    )
+    assert HTTPStatus.PRECONDITION_FAILED == response.status_code
+    assert test_client.get(f"/api/maps/{map_1}").json()["name"] == "UpdatedMap"
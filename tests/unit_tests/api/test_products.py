@@ -2,9 +2,10 @@ from http import HTTPStatus
 from uuid import uuid4
 
 import pytest
+from sqlalchemy import event
 
-from server.db import ProductsTable
-from server.utils.json import json_dumps
+from server.db import ProductsTable, db
+from server.utils.json import json_dumps, json_loads
 
 
 def test_products_get_multi(product_1, test_client):
@@ -24,6 +25,38 @@ def test_product_by_id(product_1, test_client):
     assert product["name"] == "Product 1"
 
 
+def test_products_max_queries(product_1, test_client, max_queries):
+    with max_queries(2):
+        assert HTTPStatus.OK == test_client.get("/api/products/").status_code
+    with max_queries(1):
+        assert HTTPStatus.OK == test_client.get(f"/api/products/{product_1}").status_code
+
+
+def test_product_by_id_not_modified(product_1, test_client):
+    etag = test_client.get(f"/api/products/{product_1}").headers["ETag"]
+    response = test_client.get(f"/api/products/{product_1}", headers={"If-None-Match": etag})
+    assert HTTPStatus.NOT_MODIFIED == response.status_code
+    assert response.content == b""
+
+
+def test_product_update_if_match(product_1, test_client):
+    etag = test_client.get(f"/api/products/{product_1}").headers["ETag"]
+    body = {"name": "Product 1", "description": "Changed"}
+    response = test_client.put(f"/api/products/{product_1}", data=json_dumps(body), headers={"If-Match": '"stale"'})
+    assert HTTPStatus.PRECONDITION_FAILED == response.status_code
+    response = test_client.put(f"/api/products/{product_1}", data=json_dumps(body), headers={"If-Match": etag})
+    assert HTTPStatus.NO_CONTENT == response.status_code
+    assert ProductsTable.query.get(product_1).description == "Changed"
+
+
+def test_products_get_multi_not_modified(product_1, test_client):
+    etag = test_client.get("/api/products/").headers["ETag"]
+    assert HTTPStatus.NOT_MODIFIED == test_client.get("/api/products/", headers={"If-None-Match": etag}).status_code
+
+    test_client.put(f"/api/products/{product_1}", data=json_dumps({"name": "Product 1", "description": "Changed"}))
+    assert HTTPStatus.OK == test_client.get("/api/products/", headers={"If-None-Match": etag}).status_code
+
+
 def test_product_by_id_404(product_1, test_client):
     response = test_client.get(f"/api/products/{str(uuid4())}")
     assert HTTPStatus.NOT_FOUND == response.status_code
@@ -51,3 +84,92 @@ def test_product_delete(product_1, test_client):
     response = test_client.delete(f"/api/products/{product_1}")
     assert HTTPStatus.NO_CONTENT == response.status_code
     assert len(ProductsTable.query.all()) == 0
+
+
+def test_product_delete_404(test_client):
+    response = test_client.delete(f"/api/products/{uuid4()}")
+    assert HTTPStatus.NOT_FOUND == response.status_code
+
+
+def test_product_update_404(test_client):
+    body = {"name": "Product", "description": "Product description"}
+    response = test_client.put(f"/api/products/{uuid4()}", data=json_dumps(body))
+    assert HTTPStatus.NOT_FOUND == response.status_code
+
+
+def test_product_write_single_statement(product_1, test_client):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement.split()[0])
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        body = {"name": "Product 1", "description": "Changed"}
+        assert HTTPStatus.NO_CONTENT == test_client.put(f"/api/products/{product_1}", data=json_dumps(body)).status_code
+        assert HTTPStatus.NO_CONTENT == test_client.delete(f"/api/products/{product_1}").status_code
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+    assert [statement for statement in statements if statement in ("SELECT", "UPDATE", "DELETE")] == [
+        "UPDATE",
+        "DELETE",
+    ]
+
+
+def test_products_get_multi_cursor(product_1, product_2, test_client):
+    response = test_client.get("/api/products?limit=1&sort=name:ASC&cursor=")
+    assert HTTPStatus.OK == response.status_code
+    assert [p["name"] for p in response.json()] == ["Product 1"]
+    assert "X-Prev-Cursor" not in response.headers
+
+    response = test_client.get(f"/api/products?limit=1&sort=name:ASC&cursor={response.headers['X-Next-Cursor']}")
+    assert HTTPStatus.OK == response.status_code
+    assert [p["name"] for p in response.json()] == ["Product 2"]
+    assert "X-Prev-Cursor" in response.headers
+
+
+def test_products_get_multi_invalid_cursor(test_client):
+    response = test_client.get("/api/products?cursor=garbage")
+    assert HTTPStatus.BAD_REQUEST == response.status_code
+
+
+def test_products_bulk(product_1, test_client):
+    body = [
+        {"name": "Product 3", "description": "Product 3 description"},
+        {"name": "Product 1", "description": "Duplicate name"},
+        {"name": "Product 4", "description": "Product 4 description"},
+    ]
+    response = test_client.post("/api/products/bulk", data=json_dumps(body))
+    assert HTTPStatus.OK == response.status_code
+    result = response.json()
+    assert len(result["ids"]) == 2
+    assert [error["index"] for error in result["errors"]] == [1]
+    assert len(ProductsTable.query.all()) == 3
+
+    body[1]["description"] = "Updated"
+    response = test_client.put("/api/products/bulk", data=json_dumps(body))
+    assert HTTPStatus.OK == response.status_code
+    assert len(response.json()["ids"]) == 3
+    assert response.json()["errors"] == []
+    assert ProductsTable.query.get(product_1).description == "Updated"
+
+    ids = [product_1, str(uuid4())]
+    response = test_client.request("DELETE", "/api/products/bulk", data=json_dumps(ids))
+    assert HTTPStatus.OK == response.status_code
+    assert response.json()["ids"] == [product_1]
+    assert [error["index"] for error in response.json()["errors"]] == [1]
+    assert len(ProductsTable.query.all()) == 2
+
+
+def test_products_export(product_1, product_2, test_client):
+    response = test_client.get("/api/products?sort=name:ASC&limit=0", headers={"Accept": "application/x-ndjson"})
+    assert HTTPStatus.OK == response.status_code
+    assert response.headers["Content-Type"].startswith("application/x-ndjson")
+    assert [json_loads(line)["name"] for line in response.text.splitlines()] == ["Product 1", "Product 2"]
+
+    response = test_client.get("/api/products?filter=name:duct 2", headers={"Accept": "text/csv"})
+    assert HTTPStatus.OK == response.status_code
+    header, row = response.text.splitlines()
+    assert header == "name,description,id,created_at"
+    assert row.startswith("Product 2,Product 2 description,")
@@ -0,0 +1,91 @@
+import asyncio
+from http import HTTPStatus
+
+import pytest
+from starlette.requests import Request
+from starlette.responses import Response
+
+from server.api.response_cache import response_cache
+from server.settings import app_settings
+from server.utils.json import json_dumps
+
+
+@pytest.fixture
+def memory_cache(monkeypatch):
+    monkeypatch.setattr(app_settings, "RESPONSE_CACHE", "memory")
+    monkeypatch.setattr(response_cache, "_cache", None)
+    yield response_cache
+
+
+def test_products_cached(memory_cache, product_1, test_client):
+    response = test_client.get("/api/products/")
+    assert HTTPStatus.OK == response.status_code
+    assert response.headers["X-Cache"] == "MISS"
+    assert "ETag" in response.headers
+
+    cached = test_client.get("/api/products/")
+    assert cached.headers["X-Cache"] == "HIT"
+    assert cached.json() == response.json()
+    assert cached.headers["Content-Range"] == response.headers["Content-Range"]
+
+    assert test_client.get("/api/products/?limit=1").headers["X-Cache"] == "MISS"
+
+
+def test_products_not_modified(memory_cache, product_1, test_client):
+    etag = test_client.get("/api/products/").headers["ETag"]
+    response = test_client.get("/api/products/", headers={"If-None-Match": etag})
+    assert HTTPStatus.NOT_MODIFIED == response.status_code
+    assert response.content == b""
+
+
+def test_products_invalidated_by_writes(memory_cache, product_1, test_client):
+    assert len(test_client.get("/api/products/").json()) == 1
+
+    body = {"name": "Product", "description": "Product description"}
+    response = test_client.post("/api/products/", data=json_dumps(body))
+    assert HTTPStatus.NO_CONTENT == response.status_code
+
+    response = test_client.get("/api/products/")
+    assert response.headers["X-Cache"] == "MISS"
+    assert len(response.json()) == 2
+
+
+def test_clear_cache_endpoint(memory_cache, product_1, test_client):
+    test_client.get("/api/products/")
+    test_client.get("/api/maps/")
+
+    assert HTTPStatus.NO_CONTENT == test_client.delete("/api/settings/cache/products").status_code
+    assert test_client.get("/api/products/").headers["X-Cache"] == "MISS"
+    assert test_client.get("/api/maps/").headers["X-Cache"] == "HIT"
+
+    assert HTTPStatus.NO_CONTENT == test_client.delete("/api/settings/cache/all").status_code
+    assert test_client.get("/api/maps/").headers["X-Cache"] == "MISS"
+
+
+def test_exports_not_cached(memory_cache, product_1, test_client):
+    for _ in range(2):
+        response = test_client.get("/api/products/", headers={"Accept": "text/csv"})
+        assert HTTPStatus.OK == response.status_code
+        assert "X-Cache" not in response.headers
+
+
+def test_disabled(product_1, test_client):
+    assert app_settings.RESPONSE_CACHE == ""
+    assert "X-Cache" not in test_client.get("/api/products/").headers
+
+
+def test_stampede(memory_cache):
+    calls = []
+
+    async def endpoint():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return Response("[]", media_type="application/json")
+
+    async def requests():
+        request = Request({"type": "http", "method": "GET", "path": "/slow", "query_string": b"", "headers": []})
+        return await asyncio.gather(*(memory_cache.cached("slow", request, endpoint) for _ in range(10)))
+
+    responses = asyncio.run(requests())
+    assert len(calls) == 1
+    assert sorted(response.headers["X-Cache"] for response in responses) == ["HIT"] * 9 + ["MISS"]
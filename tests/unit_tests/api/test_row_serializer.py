@@ -0,0 +1,67 @@
+import json
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import List
+from uuid import uuid4
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+
+from server.api.row_serializer import row_serializer
+from server.db.models import MapsTable, ProductTypesTable
+from server.schemas import Map, ProductType
+from server.schemas.map import MapStatus
+
+
+def _maps(count):
+    created_at = datetime(2021, 10, 1, tzinfo=timezone.utc)
+    return [
+        SimpleNamespace(
+            name=f"Map {i}",
+            description="Description",
+            size_x=10,
+            size_y=20,
+            status=MapStatus.NEW,
+            id=uuid4(),
+            created_at=created_at + timedelta(seconds=i, microseconds=i),
+            created_by=uuid4() if i % 2 else None,
+        )
+        for i in range(count)
+    ]
+
+
+def _current_path(objects):
+    return json.dumps(jsonable_encoder(parse_obj_as(List[Map], objects))).encode()
+
+
+def test_row_serializer_matches_response_model():
+    serializer = row_serializer(Map, MapsTable)
+    objects = _maps(10)
+    rows = [tuple(getattr(o, column) for column in serializer.columns) for o in objects]
+
+    assert json.loads(serializer.dumps(rows)) == json.loads(_current_path(objects))
+    assert json.loads(serializer.dumps(objects)) == json.loads(_current_path(objects))
+
+
+def test_row_serializer_fields_without_column():
+    serializer = row_serializer(ProductType, ProductTypesTable)
+    assert "product_type_id" not in serializer.columns
+    row = tuple({"product_type": "Type", "description": None}[column] for column in serializer.columns)
+    assert json.loads(serializer.dumps([row])) == [
+        {"product_type": "Type", "description": None, "product_type_id": None}
+    ]
+
+
+@pytest.mark.benchmark(group="map-serialization")
+@pytest.mark.parametrize("path", ["response_model", "row_serializer"])
+def test_row_serializer_benchmark(benchmark, path):
+    serializer = row_serializer(Map, MapsTable)
+    objects = _maps(5000)
+    rows = [tuple(getattr(o, column) for column in serializer.columns) for o in objects]
+
+    if path == "response_model":
+        body = benchmark(_current_path, objects)
+    else:
+        body = benchmark(serializer.dumps, rows)
+    assert len(json.loads(body)) == len(objects)
@@ -0,0 +1,99 @@
+import os
+from http import HTTPStatus
+from itertools import count
+
+import pytest
+
+from server.crud import product_crud, search_crud
+from server.db import db
+from server.db.models import MapsTable, ProductsTable, ProductTypesTable
+from server.utils.date_utils import nowtz
+
+
+@pytest.fixture
+def catalog():
+    db.session.add_all(
+        [
+            ProductsTable(name="Widget", description="A red widget for the garden", created_at=nowtz()),
+            ProductsTable(name="Gadget", description="Works with every widget", created_at=nowtz()),
+            ProductTypesTable(product_type="Widgets", description="All kinds of widgets"),
+            MapsTable(name="Garden", description="Map of the widget garden", status="new"),
+        ]
+    )
+    db.session.commit()
+
+
+def test_search(catalog, test_client):
+    response = test_client.get("/api/search/?q=widg")
+    assert HTTPStatus.OK == response.status_code
+    results = response.json()
+    assert sorted((result["type"], result["title"]) for result in results) == [
+        ("maps", "Garden"),
+        ("product_types", "Widgets"),
+        ("products", "Gadget"),
+        ("products", "Widget"),
+    ]
+    # Title matches rank above description matches
+    assert {result["title"] for result in results[:2]} == {"Widget", "Widgets"}
+    assert [result["rank"] for result in results] == sorted((result["rank"] for result in results), reverse=True)
+
+    widget = next(result for result in results if result["title"] == "Widget")
+    assert widget["title_highlight"] == "<mark>Widget</mark>"
+    assert "<mark>widget</mark>" in widget["snippet"]
+
+
+def test_search_all_words(catalog, test_client):
+    results = test_client.get("/api/search/?q=red gard").json()
+    assert [(result["type"], result["title"]) for result in results] == [("products", "Widget")]
+
+
+def test_search_types_and_limit(catalog, test_client):
+    results = test_client.get("/api/search/?q=widget&types=maps&types=product_types").json()
+    assert sorted(result["type"] for result in results) == ["maps", "product_types"]
+
+    assert len(test_client.get("/api/search/?q=widget&limit=1").json()) == 1
+
+    response = test_client.get("/api/search/?q=widget&types=users")
+    assert HTTPStatus.BAD_REQUEST == response.status_code
+
+
+def test_search_without_words(catalog, test_client):
+    response = test_client.get("/api/search/?q=%26%21:*")
+    assert HTTPStatus.OK == response.status_code
+    assert response.json() == []
+
+
+def test_search_filter(catalog, test_client):
+    response = test_client.get("/api/products/?filter=tsv:garden")
+    assert [product["name"] for product in response.json()] == ["Widget"]
+
+    assert [product.name for product in ProductsTable.query.search("gadg")] == ["Gadget"]
+
+
+@pytest.mark.benchmark(group="search")
+@pytest.mark.parametrize("method", ["full_text", "ilike"])
+def test_search_benchmark(benchmark, method):
+    # The full text search against the ilike filter of the list endpoint, SEARCH_BENCHMARK_ROWS=1000000 for a large set
+    rows = int(os.environ.get("SEARCH_BENCHMARK_ROWS", "100000"))
+    db.session.execute(
+        """
+        INSERT INTO products (name, description)
+        SELECT 'Benchmark ' || i, 'Product ' || i || ' in collection tag' || (i % 1000) || ' ' || md5(i::text)
+        FROM generate_series(1, :rows) AS i
+        """,
+        {"rows": rows},
+    )
+    db.session.execute("ANALYZE products")
+    queries = (f"tag{i}" for i in count(100))
+
+    def search():
+        return search_crud.search(next(queries), types=["products"], limit=20)
+
+    def ilike():
+        products, _ = product_crud.get_multi(
+            filter_parameters=[next(queries)], sort_parameters=[], limit=20, columns=["id"]
+        )
+        return products
+
+    results = benchmark.pedantic(search if method == "full_text" else ilike, rounds=20)
+    assert len(results) == min(20, rows // 1000)
@@ -1,5 +1,13 @@
 from http import HTTPStatus
 
+import pytest
+
+from server.crud import user_crud
+from server.crud.crud_user import clear_principal_cache
+from server.db import db
+from server.db.models import UsersTable
+from server.schemas import UserUpdate
+
 
 def test_users_get_multi_admin(test_client, superuser_token_headers):
     response = test_client.get("/api/users", headers=superuser_token_headers)
@@ -12,3 +20,44 @@ def test_users_get_multi_admin(test_client, superuser_token_headers):
 def test_users_get_multi_non_admin(test_client, user_token_headers):
     response = test_client.get("/api/users", headers=user_token_headers)
     assert HTTPStatus.FORBIDDEN == response.status_code
+
+
+@pytest.fixture
+def principal_cache():
+    clear_principal_cache()
+    yield
+    clear_principal_cache()
+
+
+def test_users_principal_cache(principal_cache, test_client, superuser_token_headers, user_admin):
+    response = test_client.get("/api/users", headers=superuser_token_headers)
+    assert HTTPStatus.OK == response.status_code
+
+    # Changes that bypass `user_crud` are only picked up once the cached principal expires
+    user = UsersTable.query.get(user_admin)
+    db.session.execute(UsersTable.__table__.update().where(UsersTable.id == user.id).values(is_superuser=False))
+    response = test_client.get("/api/users", headers=superuser_token_headers)
+    assert HTTPStatus.OK == response.status_code
+
+    # Updates with `user_crud` invalidate the principal right away
+    db.session.refresh(user)
+    user_crud.update(db_obj=user, obj_in=UserUpdate(username="Admin 2"))
+    response = test_client.get("/api/users", headers=superuser_token_headers)
+    assert HTTPStatus.FORBIDDEN == response.status_code
+
+
+def test_users_principal_cache_write_paths(principal_cache, user_admin, user_non_admin):
+    assert user_crud.get_principal(user_admin).is_superuser
+    user_crud.update_by_id(id=user_admin, obj_in={"is_superuser": False})
+    assert not user_crud.get_principal(user_admin).is_superuser
+
+    assert user_crud.get_principal(user_admin).is_active
+    user_crud.bulk_upsert(
+        objs_in=[{"email": "admin@admin", "username": "Admin", "hashed_password": "-", "is_active": False}],
+        index_elements=["email"],
+    )
+    assert not user_crud.get_principal(user_admin).is_active
+
+    assert user_crud.get_principal(user_non_admin) is not None
+    user_crud.delete_by_id(id=user_non_admin)
+    assert user_crud.get_principal(user_non_admin) is None
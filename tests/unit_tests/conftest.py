@@ -1,6 +1,6 @@
 import os
 import uuid
-from contextlib import closing
+from contextlib import closing, contextmanager
 from typing import Dict, cast
 
 import pytest
@@ -23,10 +23,15 @@ from server.api.api_v1.api import api_router
 from server.api.error_handling import ProblemDetailException
 from server.db import ProductsTable, db
 from server.db.database import ENGINE_ARGUMENTS, SESSION_ARGUMENTS, BaseModel, DBSessionMiddleware, SearchQuery
+from server.db.instrumentation import capture_queries, enable_instrumentation
 from server.db.models import MapsTable, UsersTable
-from server.exception_handlers.generic_exception_handlers import form_error_handler, problem_detail_handler
+from server.exception_handlers.generic_exception_handlers import (
+    form_error_handler,
+    password_hashing_busy_handler,
+    problem_detail_handler,
+)
 from server.forms import FormException
-from server.security import get_password_hash
+from server.security import PasswordHashingBusy, get_password_hash
 from server.settings import app_settings
 from server.types import UUIDstr
 from server.utils.date_utils import nowtz
@@ -111,7 +116,8 @@ def database(db_uri):
         conn.execute(f'CREATE DATABASE "{db_to_create}";')
 
     run_migrations(db_uri)
-    db.engine = create_engine(db_uri, **ENGINE_ARGUMENTS)
+    # Always instrumented: `max_queries` and `capture_queries` count the statements of this engine
+    db.engine = enable_instrumentation(create_engine(db_uri, **ENGINE_ARGUMENTS))
 
     try:
         yield
@@ -173,6 +179,7 @@ def fastapi_app(database, db_uri):
     )
     app.add_exception_handler(FormException, form_error_handler)
     app.add_exception_handler(ProblemDetailException, problem_detail_handler)
+    app.add_exception_handler(PasswordHashingBusy, password_hashing_busy_handler)
 
     return app
 
@@ -182,6 +189,19 @@ def test_client(fastapi_app):
     return TestClient(fastapi_app)
 
 
+@pytest.fixture
+def max_queries():
+    """Fail when a block runs more queries than expected: `with max_queries(2): test_client.get(...)`."""
+
+    @contextmanager
+    def assert_max_queries(maximum):
+        with capture_queries() as stats:
+            yield stats
+        assert stats.count <= maximum, f"{stats.count} queries, expected at most {maximum}:\n{stats.describe()}"
+
+    return assert_max_queries
+
+
 @pytest.fixture
 def mocked_api():
     with respx.mock(base_url="https://foo.bar") as respx_mock:
@@ -1,4 +1,23 @@
+import asyncio
+from itertools import count
+from time import process_time
+
+import pytest
+import structlog
+from sqlalchemy import event
+from sqlalchemy.inspection import inspect as sa_inspect
+from structlog.testing import capture_logs
+
 from server import crud
+from server.crud.count import clear_count_cache
+from server.crud.crud_user import UserProfile
+from server.crud.query_cache import query_cache
+from server.db import ProductsTable, db
+from server.db.prepared import PREPARED_STATEMENTS, enable_prepared_statements
+from server.log import configure_logging
+from server.schemas import ProductCreate
+from server.settings import app_settings
+from server.utils.date_utils import nowtz
 
 
 def test_filter(product_1, product_2):
@@ -17,6 +36,24 @@ def test_filter(product_1, product_2):
     assert content_range == "products 0-100/1"
 
 
+def test_filter_debug_logging(product_1, product_2):
+    config = structlog.get_config()
+    configure_logging("DEBUG", "console", {}, background=False)
+    try:
+        with capture_logs() as logs:
+            result, _ = crud.product_crud.get_multi(
+                filter_parameters=["name:duct 1", "NONEXISITANT:0"], sort_parameters=["nonexistent:ASC"]
+            )
+    finally:
+        structlog.configure(**config)
+    assert len(result) == 1
+
+    events = {log["event"]: log for log in logs}
+    assert events["Filter keys not found in database model"]["keys"] == ["NONEXISITANT"]
+    assert events["Filter plan"]["model"] == "ProductsTable"
+    assert events["Sort column does not exist"]["sort_col"] == "nonexistent"
+
+
 def test_sort(product_1, product_2):
     result, content_range = crud.product_crud.get_multi(filter_parameters=[], sort_parameters=["name:ASC"])
     assert len(result) == 2
@@ -46,3 +83,209 @@ def test_sort(product_1, product_2):
     result, content_range = crud.product_crud.get_multi(filter_parameters=[], sort_parameters=["NONTRUE:NONTRUE"])
     assert len(result) == 2
     assert content_range == "products 0-100/2"
+
+
+def test_cursor_pagination(product_1, product_2):
+    result, content_range = crud.product_crud.get_multi(
+        limit=1, filter_parameters=[], sort_parameters=["name:ASC"], cursor=""
+    )
+    assert content_range == "products */2"
+    assert [p.name for p in result] == ["Product 1"]
+
+    headers = crud.product_crud.page_headers(result, limit=1, sort_parameters=["name:ASC"], cursor="")
+    assert "X-Prev-Cursor" not in headers
+
+    result, _ = crud.product_crud.get_multi(
+        limit=1, filter_parameters=[], sort_parameters=["name:ASC"], cursor=headers["X-Next-Cursor"]
+    )
+    assert [p.name for p in result] == ["Product 2"]
+
+    headers = crud.product_crud.page_headers(
+        result, limit=1, sort_parameters=["name:ASC"], cursor=headers["X-Next-Cursor"]
+    )
+    result, _ = crud.product_crud.get_multi(
+        limit=1, filter_parameters=[], sort_parameters=["name:ASC"], cursor=headers["X-Prev-Cursor"]
+    )
+    assert [p.name for p in result] == ["Product 1"]
+
+
+def test_cursor_pagination_desc(product_1, product_2):
+    result, _ = crud.product_crud.get_multi(limit=1, filter_parameters=[], sort_parameters=["name:DESC"], cursor="")
+    assert [p.name for p in result] == ["Product 2"]
+
+    headers = crud.product_crud.page_headers(result, limit=1, sort_parameters=["name:DESC"], cursor="")
+    result, _ = crud.product_crud.get_multi(
+        limit=1, filter_parameters=[], sort_parameters=["name:DESC"], cursor=headers["X-Next-Cursor"]
+    )
+    assert [p.name for p in result] == ["Product 1"]
+
+
+def test_count_strategies(product_1, product_2):
+    result, content_range = crud.product_crud.get_multi(filter_parameters=[], sort_parameters=[], count="none")
+    assert len(result) == 2
+    assert content_range == "products 0-100/*"
+
+    # Estimates below COUNT_ESTIMATE_THRESHOLD are replaced by an exact count
+    result, content_range = crud.product_crud.get_multi(filter_parameters=[], sort_parameters=[], count="estimated")
+    assert content_range == "products 0-100/2"
+    result, content_range = crud.product_crud.get_multi(
+        filter_parameters=["name:duct 1"], sort_parameters=[], count="estimated"
+    )
+    assert content_range == "products 0-100/1"
+
+    clear_count_cache()
+    result, content_range = crud.product_crud.get_multi(filter_parameters=[], sort_parameters=[], count="cached")
+    assert content_range == "products 0-100/2"
+    db.session.delete(ProductsTable.query.get(product_1))
+    db.session.commit()
+    result, content_range = crud.product_crud.get_multi(filter_parameters=[], sort_parameters=[], count="cached")
+    assert len(result) == 1
+    assert content_range == "products 0-100/2"
+    clear_count_cache()
+
+    headers = crud.product_crud.page_headers(result, limit=100, sort_parameters=[], cursor=None, count="estimated")
+    assert headers == {"X-Count-Strategy": "estimated"}
+
+
+def test_async_fallback(product_1, product_2):
+    # Without a connected async pool the async variants run the sync methods on the threadpool
+    result, content_range = asyncio.run(
+        crud.product_crud.async_get_multi(filter_parameters=["name:duct 1"], sort_parameters=[])
+    )
+    assert [p.name for p in result] == ["Product 1"]
+    assert content_range == "products 0-100/1"
+    assert asyncio.run(crud.product_crud.async_get(product_1)).name == "Product 1"
+
+
+def test_filter_plan():
+    plan = crud.map_crud.filter_plan(["name:abc", "size_x:10", "created_at:2021-10", "id:abc", "NONEXISTANT:0"])
+    assert plan.describe() == ["name:trigram", "size_x:integer", "created_at:timestamp_range", "id:cast"]
+    assert plan.ignored == ["NONEXISTANT"]
+
+    # Free text filters skip the typed columns the value can't match
+    plan = crud.map_crud.filter_plan(["abc"])
+    assert plan.describe() == ["name:trigram", "description:trigram", "status:text"]
+
+
+def test_filter_plan_shape():
+    plan = crud.map_crud.filter_plan(["name:abc", "created_at:2021-10"])
+    other = crud.map_crud.filter_plan(["name:xyz", "created_at:2022"])
+    assert plan.shape == other.shape
+    assert plan.params["filter_0"] == "%abc%" and other.params["filter_0"] == "%xyz%"
+    assert set(plan.params) == {"filter_0", "filter_1", "filter_1_end"}
+
+    # Values that select another predicate result in another shape
+    assert crud.map_crud.filter_plan(["name:abc", "created_at:abc"]).shape != plan.shape
+
+
+def test_filter_typed_columns(product_1, product_2):
+    result, content_range = crud.product_crud.get_multi(filter_parameters=[f"id:{product_1}"], sort_parameters=[])
+    assert [str(p.id) for p in result] == [product_1]
+
+    year = str(nowtz().year)
+    result, content_range = crud.product_crud.get_multi(filter_parameters=[f"created_at:{year}"], sort_parameters=[])
+    assert len(result) == 2
+    result, content_range = crud.product_crud.get_multi(filter_parameters=["created_at:1999-01"], sort_parameters=[])
+    assert len(result) == 0
+
+    # Multiple filters must all match
+    result, content_range = crud.product_crud.get_multi(
+        filter_parameters=["name:Product", "description:2 desc"], sort_parameters=[]
+    )
+    assert [p.name for p in result] == ["Product 2"]
+
+
+def test_user_loading_profiles(user_non_admin, map_1):
+    db.session.expunge_all()
+    user = crud.user_crud.get(user_non_admin, profile=UserProfile.PRINCIPAL)
+    assert {"email", "created_at", "maps", "roles"} <= sa_inspect(user).unloaded
+    assert user.is_active and not user.is_superuser
+
+    db.session.expunge_all()
+    user = crud.user_crud.get(user_non_admin)
+    assert {"maps", "roles"} == sa_inspect(user).unloaded
+
+    db.session.expunge_all()
+    user = crud.user_crud.get(user_non_admin, profile=UserProfile.DETAIL)
+    assert not sa_inspect(user).unloaded
+    assert [str(m.id) for m in user.maps] == [map_1]
+
+
+def test_bulk_create_round_trips(max_queries, monkeypatch):
+    monkeypatch.setattr(app_settings, "BULK_CHUNK_SIZE", 100)
+    rows = 500
+
+    # One multi-row INSERT per chunk, each within a SAVEPOINT and its RELEASE
+    with max_queries(3 * rows // 100) as stats:
+        result = crud.product_crud.bulk_create(
+            objs_in=[ProductCreate(name=f"Bulk {i}", description="Bulk path") for i in range(rows)]
+        )
+
+    assert len(result.ids) == rows and not result.errors
+    assert len(set(result.ids)) == rows
+    # The chunks have the same size, so it is the same INSERT of 100 rows every time
+    [(insert, executed)] = [
+        (statement, n) for statement, n in stats.statements.items() if statement.startswith("INSERT")
+    ]
+    assert executed == rows // 100
+    assert insert.count("%(name_m") == 100
+    assert sum(n for statement, n in stats.statements.items() if statement.startswith("SAVEPOINT")) == rows // 100
+
+
+def test_query_cache(product_1, product_2, monkeypatch):
+    monkeypatch.setattr(query_cache, "_statements", None)
+    for name in ("Product 1", "Product 2"):
+        result, content_range = crud.product_crud.get_multi(
+            filter_parameters=[f"name:{name}"], sort_parameters=["name:DESC"], columns=["id", "name"]
+        )
+        assert [(str(row.id), row.name) for row in result] == [(product_1 if name == "Product 1" else product_2, name)]
+        assert content_range == "products 0-100/1"
+    assert len(query_cache._statements) == 1
+
+    result, content_range = crud.product_crud.get_multi(
+        filter_parameters=[], sort_parameters=["name:DESC"], columns=["name"], limit=1, cursor=""
+    )
+    assert [row.name for row in result] == ["Product 2"]
+    assert content_range == "products */2"
+    assert len(query_cache._statements) == 2
+
+
+def test_prepared_statements(product_1, product_2):
+    prepared_statements = enable_prepared_statements(db.engine)
+    try:
+        for name in ("Product 1", "Product 2"):
+            result, _ = crud.product_crud.get_multi(
+                filter_parameters=[f"name:{name}"], sort_parameters=[], columns=["id", "name"]
+            )
+            assert [row.name for row in result] == [name]
+        prepared = [row[0] for row in db.session.execute("SELECT statement FROM pg_prepared_statements")]
+        assert any("ILIKE $1" in statement for statement in prepared)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", prepared_statements)
+
+
+def test_prepared_statements_deallocated(product_1):
+    prepared_statements = enable_prepared_statements(db.engine, max_statements=2)
+    try:
+        for filter_parameters in (["name:Product"], ["description:Product"], ["name:Product", "description:Product"]):
+            crud.product_crud.get_multi(filter_parameters=filter_parameters, sort_parameters=[], columns=["id"])
+        prepared = [row[0] for row in db.session.execute("SELECT statement FROM pg_prepared_statements")]
+        assert len(prepared) == 2
+        assert len(db.session.connection().connection.info[PREPARED_STATEMENTS]) == 2
+    finally:
+        event.remove(db.engine, "before_cursor_execute", prepared_statements)
+
+
+# CPU time per request: the query shape cache saves building and compiling the statements, not database time
+@pytest.mark.benchmark(group="get-multi-cpu", timer=process_time)
+@pytest.mark.parametrize("query_cache_size", [0, 500])
+def test_get_multi_cpu_benchmark(benchmark, test_client, map_1, monkeypatch, query_cache_size):
+    monkeypatch.setattr(app_settings, "QUERY_CACHE_SIZE", query_cache_size)
+    query_cache.clear()
+    requests = count()
+
+    def get_maps():
+        i = next(requests)
+        return test_client.get(f"/api/maps/?filter=name:Map {i}&filter=size_x:{i}&sort=name:DESC")
+
+    assert benchmark(get_maps).status_code == 200
@@ -0,0 +1,40 @@
+import os
+import re
+import subprocess  # noqa: S404
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parents[2]
+
+# Modules only needed by a few code paths; they are imported on first use
+LAZY_MODULES = [
+    "aiocache",
+    "jinja2",
+    "multiprocessing",
+    "psycopg2",
+    "sqlalchemy_searchable",
+    "sqlalchemy_utils",
+]
+
+
+def _python(*args):
+    env = {**os.environ, "PYTHONPATH": str(ROOT), "GIT_COMMIT_HASH": "test"}
+    return subprocess.run(  # noqa: S603
+        [sys.executable, *args], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+
+
+def test_lazy_modules():
+    code = f"import sys, server.main; print([m for m in {LAZY_MODULES!r} if m in sys.modules])"
+    assert _python("-c", code).stdout.strip().splitlines()[-1] == "[]"
+
+
+def test_import_time_benchmark(benchmark):
+    def import_time():
+        stderr = _python("-X", "importtime", "-c", "import server.main").stderr
+        return int(re.search(r"\|\s*(\d+) \| server\.main$", stderr, re.MULTILINE).group(1)) / 1000
+
+    # The cumulative import time of `server.main` as reported by the interpreter, part of every Lambda cold start
+    times = []
+    benchmark.pedantic(lambda: times.append(import_time()), rounds=3)
+    benchmark.extra_info["import_time_ms"] = min(times)
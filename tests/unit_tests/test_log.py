@@ -0,0 +1,125 @@
+import json
+import os
+import sys
+from threading import Event
+from time import sleep
+
+import pytest
+import structlog
+
+from server.log import EventSampler, LogQueue, configure_logging
+
+
+class BlockingFile:
+    def __init__(self):
+        self.written = []
+        self.unblocked = Event()
+
+    def write(self, text):
+        self.unblocked.wait()
+        self.written.append(text)
+
+    def flush(self):
+        pass
+
+
+@pytest.fixture
+def logging_config():
+    config = structlog.get_config()
+    yield
+    structlog.configure(**config)
+
+
+def test_sampling():
+    sampler = EventSampler({"Filter plan": 10})
+    kept = []
+    for _ in range(100):
+        try:
+            kept.append(sampler(None, "debug", {"event": "Filter plan"}))
+        except structlog.DropEvent:
+            pass
+    assert kept == [{"event": "Filter plan", "sample_rate": 10}] * 10
+    assert sampler(None, "info", {"event": "Other"}) == {"event": "Other"}
+
+
+def test_log_queue_drops_when_full():
+    file = BlockingFile()
+    queue = LogQueue(file, maxsize=5)
+    for i in range(20):
+        queue.msg(f"line {i}")
+    assert queue.dropped > 0
+    file.unblocked.set()
+    queue.flush()
+    queue.msg("after")
+    queue.shutdown()
+
+    lines = "".join(file.written).splitlines()
+    assert lines[0] == "line 0"
+    assert lines[-1] == "after"
+    [dropped] = [json.loads(line) for line in lines if line.startswith("{")]
+    assert dropped["event"] == "Dropped log lines"
+    assert dropped["count"] + len(lines) - 2 == 20
+
+
+def test_json_profile(logging_config, monkeypatch, capsys):
+    queue = LogQueue(sys.stdout)
+    monkeypatch.setattr("server.log.log_queue", queue)
+    configure_logging("INFO", "json", {}, background=True)
+    logger = structlog.get_logger("test")
+    logger.debug("Hidden")
+    logger.info("Shown", model="Product", count=3, value=object())
+    queue.shutdown()
+
+    [line] = capsys.readouterr().out.splitlines()
+    event = json.loads(line)
+    assert event["event"] == "Shown"
+    assert event["level"] == "info"
+    assert event["count"] == 3
+    assert event["value"].startswith("<object")
+    assert event["timestamp"].endswith("Z")
+
+
+class SlowFile:
+    """A stdout that takes a while to accept writes, like a pipe to a busy log collector."""
+
+    def write(self, text):
+        sleep(0.0001)
+
+    def flush(self):
+        pass
+
+
+# The cost of a log call in the development and production profiles, of a sampled event and of a call below LOG_LEVEL.
+# With a slow stdout only the background writer keeps log calls cheap.
+LOG_CALL_PROFILES = {
+    "console": {"log_format": "console"},
+    "json": {"log_format": "json", "background": False},
+    "json_queued": {"log_format": "json"},
+    "sampled": {"log_format": "json", "sampling": {"Filter plan": 100}},
+    "below_log_level": {"log_format": "json", "level": "INFO"},
+    "slow_stdout_json": {"log_format": "json", "background": False, "slow_stdout": True},
+    "slow_stdout_json_queued": {"log_format": "json", "slow_stdout": True},
+}
+
+
+@pytest.mark.benchmark(group="log-call")
+@pytest.mark.parametrize("profile", LOG_CALL_PROFILES)
+def test_log_call_benchmark(benchmark, logging_config, monkeypatch, profile):
+    options = LOG_CALL_PROFILES[profile]
+    file = SlowFile() if options.get("slow_stdout") else open(os.devnull, "w")
+    monkeypatch.setattr(sys, "stdout", file)
+    queue = LogQueue(file)
+    monkeypatch.setattr("server.log.log_queue", queue)
+    configure_logging(
+        options.get("level", "DEBUG"),
+        options["log_format"],
+        options.get("sampling", {}),
+        background=options.get("background", True),
+    )
+    logger = structlog.get_logger()
+    try:
+        benchmark(logger.debug, "Filter plan", model="Product", plan=["name:ILIKE"])
+    finally:
+        queue.shutdown()
+        if not isinstance(file, SlowFile):
+            file.close()
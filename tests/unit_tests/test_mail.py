@@ -0,0 +1,145 @@
+import socket
+from pathlib import Path
+
+import pytest
+from aiosmtpd.controller import Controller
+from structlog.testing import capture_logs
+
+import server
+from server.mail import Mail, MailQueue, render_template, template_environment
+from server.settings import app_settings
+from server.utils.auth import send_new_account_email
+
+
+class Mailbox:
+    def __init__(self):
+        self.messages = []
+        self.peers = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        self.peers.add(session.peer)
+        return "250 OK"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_port(monkeypatch):
+    port = free_port()
+    monkeypatch.setattr(app_settings, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(app_settings, "SMTP_PORT", port)
+    monkeypatch.setattr(app_settings, "SMTP_TLS", False)
+    monkeypatch.setattr(app_settings, "EMAILS_FROM_EMAIL", "noreply@example.com")
+    monkeypatch.setattr(app_settings, "EMAILS_ENABLED", True)
+    monkeypatch.setattr(
+        app_settings, "EMAIL_TEMPLATES_DIR", str(Path(server.__file__).parent / "email-templates/build")
+    )
+    return port
+
+
+@pytest.fixture
+def mailbox(smtp_port):
+    mailbox = Mailbox()
+    controller = Controller(mailbox, hostname="127.0.0.1", port=smtp_port)
+    controller.start()
+    yield mailbox
+    controller.stop()
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    queue = MailQueue(background=True, batch_size=50, max_retries=5, retry_backoff=0.05, idle_timeout=30)
+    monkeypatch.setattr("server.utils.auth.mail_queue", queue)
+    yield queue
+    queue.shutdown()
+
+
+def test_new_account_email(mailbox, queue):
+    send_new_account_email(email_to="new@example.com", username="new@example.com", password="secret")
+    queue.join()
+
+    [envelope] = mailbox.messages
+    assert envelope.rcpt_tos == ["new@example.com"]
+    content = envelope.content.decode()
+    assert "New account for user new@example.com" in content
+    assert "secret" in content
+
+
+def test_batch_on_one_connection(mailbox, queue):
+    for i in range(20):
+        queue.send(Mail(f"user{i}@example.com", f"Mail {i}", "<p>Hi</p>"))
+    queue.join()
+    assert sorted(envelope.rcpt_tos[0] for envelope in mailbox.messages) == sorted(
+        f"user{i}@example.com" for i in range(20)
+    )
+    assert len(mailbox.peers) == 1
+
+    # The connection is kept for the next batch
+    queue.send(Mail("late@example.com", "Late", "<p>Hi</p>"))
+    queue.join()
+    assert len(mailbox.messages) == 21
+    assert len(mailbox.peers) == 1
+
+
+def test_retry_until_server_is_up(smtp_port, queue, monkeypatch):
+    mailbox = Mailbox()
+    controller = Controller(mailbox, hostname="127.0.0.1", port=smtp_port)
+    backoffs = []
+
+    def start_server(backoff):
+        # The server comes up while the queue backs off after the first failed attempt
+        backoffs.append(backoff)
+        if len(backoffs) == 1:
+            controller.start()
+
+    monkeypatch.setattr("server.mail.sleep", start_server)
+    try:
+        with capture_logs() as logs:
+            queue.send(Mail("retry@example.com", "Retry", "<p>Hi</p>"))
+            queue.join()
+    finally:
+        controller.stop()
+    assert backoffs == [0.05]
+    assert [log["event"] for log in logs] == ["Mail delivery failed, retrying", "Sent mails"]
+    assert [envelope.rcpt_tos for envelope in mailbox.messages] == [["retry@example.com"]]
+
+
+def test_give_up_after_retries(smtp_port, monkeypatch):
+    queue = MailQueue(background=False, batch_size=50, max_retries=2, retry_backoff=0.01, idle_timeout=30)
+    attempts = []
+    connect = queue._connect
+
+    def count_attempts():
+        attempts.append(1)
+        return connect()
+
+    monkeypatch.setattr(queue, "_connect", count_attempts)
+    # Nothing listens on the port, the mail is logged and dropped instead of failing the request
+    with capture_logs() as logs:
+        queue.send(Mail("nobody@example.com", "Lost", "<p>Hi</p>"))
+
+    assert len(attempts) == 3
+    *retries, given_up = logs
+    assert [log["event"] for log in retries] == ["Mail delivery failed, retrying"] * 2
+    assert given_up["event"] == "Giving up on mails"
+    assert given_up["log_level"] == "error"
+    assert given_up["recipients"] == ["nobody@example.com"]
+
+
+def test_templates_compiled_once(smtp_port):
+    environment = template_environment(app_settings.EMAIL_TEMPLATES_DIR)
+    html = render_template("test_email.html", project_name="Boilerplate", email="a@example.com")
+    assert "a@example.com" in html
+    template = environment.get_template("test_email.html")
+    render_template("test_email.html", project_name="Boilerplate", email="b@example.com")
+    assert environment.get_template("test_email.html") is template
+
+
+def test_templates_escaped(smtp_port):
+    html = render_template("test_email.html", project_name="Boilerplate", email="<script>@example.com")
+    assert "&lt;script&gt;@example.com" in html
@@ -0,0 +1,123 @@
+import os
+import subprocess  # noqa: S404
+import sys
+from functools import partial
+from pathlib import Path
+
+import pytest
+from fastapi import FastAPI
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine
+from starlette.testclient import TestClient
+
+from server.db.database import ENGINE_ARGUMENTS
+from server.metrics import (
+    MetricsMiddleware,
+    cache_access,
+    instrument_pool,
+    metrics,
+    metrics_endpoint,
+    route_template,
+)
+from server.utils.ttl_cache import TTLCache
+
+ROOT = Path(__file__).parents[2]
+
+
+@pytest.fixture
+def enabled_metrics():
+    metrics.enable()
+    yield metrics
+    metrics.disable()
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_request_metrics(enabled_metrics):
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+    app.add_route("/metrics", metrics_endpoint)
+
+    @app.get("/items/{id}")
+    def get_item(id: int):
+        return {"id": id}
+
+    client = TestClient(app)
+    route = {"method": "GET", "route": "/items/{id}", "status": "200"}
+    before = sample("http_request_duration_seconds_count", **route)
+    unmatched = sample("http_request_duration_seconds_count", method="GET", route="unmatched", status="404")
+
+    assert client.get("/items/1").status_code == 200
+    assert client.get("/items/2").status_code == 200
+    assert client.get("/nothing/here").status_code == 404
+
+    assert sample("http_request_duration_seconds_count", **route) == before + 2
+    assert sample("http_request_duration_seconds_count", method="GET", route="unmatched", status="404") == unmatched + 1
+    assert sample("http_requests_in_progress", method="GET") == 0
+
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain")
+    assert sample("http_request_duration_seconds_count", method="GET", route="/metrics", status="200") >= 1
+    assert 'http_request_duration_seconds_bucket{le="0.005",method="GET",route="/items/{id}",status="200"}' in (
+        response.text
+    )
+    assert "threadpool_busy_threads" in response.text
+    assert "password_hash_capacity" in response.text
+
+
+def test_route_template():
+    app = FastAPI()
+
+    @app.get("/items/{id}")
+    def get_item(id: int):
+        return {"id": id}
+
+    # Older FastAPI versions do not add the matched route to the scope, the routes are matched again
+    def scope(path, method="GET"):
+        return {"type": "http", "path": path, "root_path": "", "method": method, "app": app}
+
+    assert route_template(scope("/items/1")) == "/items/{id}"
+    assert route_template(scope("/items/1", method="POST")) == "/items/{id}"
+    assert route_template(scope("/nothing/here")) == "unmatched"
+
+
+def test_cache_metrics(enabled_metrics):
+    cache = TTLCache(10, lambda: 60, partial(cache_access, "test"))
+    hits, misses = sample("cache_requests_total", cache="test", result="hit"), sample(
+        "cache_requests_total", cache="test", result="miss"
+    )
+    assert cache.get("key") is None
+    cache.set("key", 1)
+    assert cache.get("key") == 1
+
+    assert sample("cache_requests_total", cache="test", result="hit") == hits + 1
+    assert sample("cache_requests_total", cache="test", result="miss") == misses + 1
+
+
+def test_pool_metrics(enabled_metrics, db_uri):
+    engine = create_engine(db_uri, **ENGINE_ARGUMENTS)
+    try:
+        instrument_pool(engine, "test")
+        with engine.connect():
+            assert sample("db_pool_checked_out", pool="test") == 1
+        assert sample("db_pool_checked_out", pool="test") == 0
+        assert sample("db_pool_overflow", pool="test") == 0
+        assert sample("db_pool_wait_seconds_count", pool="test") == 1
+    finally:
+        engine.dispose()
+
+
+def test_multiprocess_metrics(tmp_path):
+    env = {**os.environ, "PYTHONPATH": str(ROOT), "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+
+    def python(code):
+        return subprocess.run(  # noqa: S603
+            [sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+        ).stdout
+
+    for _ in range(2):
+        python("from server.metrics import cache_access, metrics; metrics.enable(); cache_access('shared', True)")
+    scraped = python("from server.metrics import metrics_endpoint; print(metrics_endpoint(None).body.decode())")
+    assert 'cache_requests_total{cache="shared",result="hit"} 2.0' in scraped
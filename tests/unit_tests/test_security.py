@@ -0,0 +1,83 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import pytest
+from passlib.context import CryptContext
+
+from server.crud import user_crud
+from server.db import db
+from server.db.models import UsersTable
+from server.security import PasswordHasher, PasswordHashingBusy, get_password_hash, password_hasher, verify_password
+
+
+def test_password_hash_roundtrip():
+    hashed_password = get_password_hash("secret")
+    assert verify_password("secret", hashed_password)
+    assert not verify_password("wrong", hashed_password)
+
+
+def test_password_hasher_backpressure():
+    hasher = PasswordHasher(workers=1, queue_limit=0, retry_after=3)
+    hashed_password = hasher.hash("secret")
+
+    async def logins():
+        # The slot is taken before the first await and only given back when the hash is done
+        slow_login = asyncio.ensure_future(hasher.async_verify_and_update("secret", hashed_password))
+        await asyncio.sleep(0)
+        assert hasher.pending == 1
+
+        with pytest.raises(PasswordHashingBusy) as exc_info:
+            await hasher.async_verify_and_update("secret", hashed_password)
+        assert exc_info.value.retry_after == 3
+        with pytest.raises(PasswordHashingBusy):
+            hasher.verify_and_update("secret", hashed_password)
+
+        assert await slow_login == (True, None)
+        assert hasher.pending == 0
+
+    try:
+        asyncio.run(logins())
+    finally:
+        hasher.shutdown()
+
+
+def test_login_busy(test_client, user_non_admin, monkeypatch):
+    monkeypatch.setattr(password_hasher, "workers", 1)
+    monkeypatch.setattr(password_hasher, "queue_limit", 0)
+    monkeypatch.setattr(password_hasher, "pending", 1)
+
+    response = test_client.post("/api/login/access-token", data={"username": "User", "password": "user"})
+    assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == str(password_hasher.retry_after)
+
+
+def test_rehash_on_login(user_non_admin):
+    user = UsersTable.query.get(user_non_admin)
+    user.hashed_password = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("user")
+    db.session.commit()
+
+    assert user_crud.authenticate(username="User", password="user")
+    assert UsersTable.query.get(user_non_admin).hashed_password.startswith("$2b$12$")
+
+
+@pytest.mark.skipif((os.cpu_count() or 1) < 2, reason="Needs at least 2 cores to show the pool scaling")
+@pytest.mark.benchmark(group="login-throughput")
+@pytest.mark.parametrize("workers", [1, 2])
+def test_login_throughput_benchmark(benchmark, workers):
+    logins = 16
+    hasher = PasswordHasher(workers=workers, queue_limit=logins, retry_after=1)
+    hashed_password = hasher.hash("secret")  # also starts the pool
+
+    def login_burst():
+        with ThreadPoolExecutor(logins) as request_threads:
+            return list(
+                request_threads.map(lambda _: hasher.verify_and_update("secret", hashed_password), range(logins))
+            )
+
+    try:
+        results = benchmark.pedantic(login_burst, rounds=3)
+    finally:
+        hasher.shutdown()
+    assert results == [(True, None)] * logins
@@ -12,10 +12,18 @@
 # limitations under the License.
 
 import re
+from dataclasses import dataclass
 from datetime import datetime, timezone
 
+import pytest
+import rapidjson
+from pydantic import BaseModel
+from sqlalchemy import inspect as sa_inspect
+
+from server.db import db
+from server.db.models import MapsTable, ProductsTable
 from server.utils.date_utils import nowtz
-from server.utils.json import json_dumps, json_loads
+from server.utils.json import TimestampPaths, from_serializable, json_dumps, json_loads, to_serializable
 
 
 def test_serialization_datetime():
@@ -31,3 +39,132 @@ def test_deserialization_datetime():
 
     dct = {"end_date": datetime(2019, 12, 6, 19, 25, 22, 0, timezone.utc)}
     assert json_loads(json_dumps(dct)) == dct
+
+
+def _per_instance_json(obj, excluded_keys=frozenset()):
+    """The `__json__` algorithm before key plans: everything is derived from the instance state on every call."""
+    ins = sa_inspect(obj)
+    columns = set(ins.mapper.column_attrs.keys())
+    relationships = set(ins.mapper.relationships.keys())
+    unloaded = ins.unloaded
+    keys = columns | relationships
+    if not ins.transient:
+        keys -= unloaded
+    if ins.expired:
+        keys |= ins.expired_attributes
+    keys |= set(obj._json_include)
+    if ins.deleted or ins.detached:
+        keys -= relationships
+        keys -= unloaded
+    keys -= set(obj._json_exclude) | set(excluded_keys)
+    return {key: getattr(obj, key) for key in keys}
+
+
+def _per_instance_dumps(obj):
+    def default(o):
+        return _per_instance_json(o) if hasattr(o, "__json__") else to_serializable(o)
+
+    return rapidjson.dumps(obj, default=default)
+
+
+def _products(count):
+    db.session.add_all(
+        ProductsTable(name=f"Product {i}", description="Description", created_at=nowtz()) for i in range(count)
+    )
+    db.session.commit()
+    return ProductsTable.query.all()
+
+
+def test_serialization_model_key_plan(map_1):
+    persistent = MapsTable.query.get(map_1)
+    transient = MapsTable(name="Map", description="Description")
+    assert persistent.__json__() == _per_instance_json(persistent)
+    assert persistent.__json__({"description"}) == _per_instance_json(persistent, {"description"})
+    assert transient.__json__() == _per_instance_json(transient)
+
+    db.session.expire(persistent)
+    assert persistent.__json__() == _per_instance_json(persistent)
+
+    db.session.expunge(persistent)
+    assert persistent.__json__() == _per_instance_json(persistent)
+
+
+def test_serialization_dispatch_by_class():
+    class Point(BaseModel):
+        x: int
+
+    @dataclass
+    class Pair:
+        a: int
+
+    assert json_loads(json_dumps([Point(x=1), Pair(a=2), Point(x=3)])) == [{"x": 1}, {"a": 2}, {"x": 3}]
+    with pytest.raises(TypeError):
+        json_dumps(object())
+
+
+def test_serialization_model_list():
+    products = _products(20)
+    assert json_loads(json_dumps(products)) == json_loads(_per_instance_dumps(products))
+
+
+@pytest.mark.benchmark(group="model-list-serialization")
+@pytest.mark.parametrize("dumps", [_per_instance_dumps, json_dumps], ids=["per_instance", "key_plan"])
+def test_serialization_model_list_benchmark(benchmark, dumps):
+    products = _products(2000)
+    assert len(json_loads(benchmark(dumps, products))) == len(products)
+
+
+def _documents(count, with_timestamps):
+    return json_dumps(
+        {
+            "items": [
+                {
+                    "name": f"Item {i}",
+                    "description": "A somewhat longer text to make the document representative",
+                    "tags": ["a", "b", "c"],
+                    "size": {"x": i, "y": i * 2},
+                    **({"end_date": nowtz()} if with_timestamps else {}),
+                }
+                for i in range(count)
+            ]
+        }
+    )
+
+
+def test_deserialization_escaped_datetime():
+    assert json_loads('{"end_date": "\\u0032019-12-06T19:25:22+00:00"}') == {
+        "end_date": datetime(2019, 12, 6, 19, 25, 22, 0, timezone.utc)
+    }
+    assert json_loads(b'{"name": "2019-12-06 and more"}') == {"name": "2019-12-06 and more"}
+
+
+def test_deserialization_timestamp_paths():
+    document = _documents(3, with_timestamps=True)
+    assert json_loads(document, TimestampPaths("items.*.end_date")) == json_loads(document)
+    assert json_loads('{"end_date": null}', TimestampPaths("end_date", "missing.*")) == {"end_date": None}
+    with pytest.raises(ValueError):
+        json_loads('{"end_date": "2019-12-06T19:25:22"}', TimestampPaths("end_date"))
+
+
+DECODERS = {
+    "object_hook": lambda s: rapidjson.loads(s, object_hook=from_serializable),
+    "json_loads": json_loads,
+    "timestamp_paths": lambda s: json_loads(s, TimestampPaths("items.*.end_date")),
+}
+
+
+@pytest.mark.parametrize("with_timestamps", [False, True])
+def test_deserialization_decoders_agree(with_timestamps):
+    document = _documents(50, with_timestamps)
+    expected = DECODERS["object_hook"](document)
+    for decode in DECODERS.values():
+        assert decode(document) == expected
+
+
+# Documents without timestamps take the fast path of json_loads, the others benefit from declaring the timestamp paths
+@pytest.mark.benchmark(group="deserialization")
+@pytest.mark.parametrize("decoder", DECODERS)
+@pytest.mark.parametrize("with_timestamps", [False, True])
+def test_deserialization_benchmark(benchmark, with_timestamps, decoder):
+    document = _documents(5000, with_timestamps)
+    assert len(benchmark(DECODERS[decoder], document)["items"]) == 5000